@@ -1,6 +1,13 @@
+import os
+import sys
+import numpy as np
 from Frame import Frame
 from Room import Room
 
+# The shared COLMAP model readers are in the parent Orb_version folder:
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from colmap_model import read_images_file, read_points3d_file
+
 
 class Point:
     def __init__(self, x, y, z, qx=0, qy=0, qz=0, qw=0, frame_id=0, label=-1):
@@ -32,35 +39,26 @@ class Point:
 
 def create_date_from_colmap(images_file_name, point3d_file_name, threshold=1000):
     room = Room()
-    with open(images_file_name, "r") as frames_file:
-        for i in range(0, 4):
-            frames_file.readline()
-        row = frames_file.readline()
-        even = True
-        while row != '':
-            if even:
-                values = row.split(" ")
-                room.frames[int(values[0])] = Frame(float(values[5]), float(values[6]), float(values[7]),
-                                                    float(values[2]), float(values[3]), float(values[4]),
-                                                    float(values[1]), int(values[0]))
-            row = frames_file.readline()
-            even = not even
-    with open(point3d_file_name, "r") as point3d_file:
-        for i in range(0, 3):
-            point3d_file.readline()
-        row = point3d_file.readline()
-        while row != '':
-            values = row.split(" ")
-            frame = room.frames[int(values[8])]
-            x = float(values[1])
-            y = float(values[3])
-            z = float(values[2])
-            if abs(x) < threshold and abs(y) < threshold and abs(z) < threshold:
-                room.points.append(Point(x, y, z, frame.qx, frame.qy,
-                                         frame.qz, frame.qw, frame.frame_id))
-            row = point3d_file.readline()
-
-        #print(len(room.points))
+    images = read_images_file(images_file_name)
+    for image_id, (qw, qx, qy, qz), (tx, ty, tz) in zip(images.ids.tolist(), images.qvecs.tolist(),
+                                                         images.tvecs.tolist()):
+        room.frames[image_id] = Frame(tx, ty, tz, qx, qy, qz, qw, image_id)
+
+    points = read_points3d_file(point3d_file_name, use_cache=True)
+
+    # Each point gets the frame of the first image of its track:
+    has_track = np.diff(points.track_offsets) > 0
+    frame_ids = points.track_image_ids[points.track_offsets[:-1][has_track]]
+    xyz = points.xyz[has_track]
+    inside = np.all(np.abs(xyz) < threshold, axis=1)
+
+    # The room plane is the model (X, Z) plane:
+    for (x, z, y), frame_id in zip(xyz[inside].tolist(), frame_ids[inside].tolist()):
+        frame = room.frames[frame_id]
+        room.points.append(Point(x, y, z, frame.qx, frame.qy,
+                                 frame.qz, frame.qw, frame.frame_id))
+
+    #print(len(room.points))
     return room.points
 
 
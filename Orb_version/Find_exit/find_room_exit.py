@@ -1,9 +1,14 @@
 # Parser definition:
 import argparse
 import os
+import sys
 from Point import create_date_from_colmap
 from source import get_exit_point
 
+# The shared COLMAP model readers are in the parent Orb_version folder:
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from colmap_model import get_model_file
+
 ap = argparse.ArgumentParser()
 ap.add_argument('-p', '--path', required=True,
                 help='path to colmap output files')
@@ -14,8 +19,8 @@ def get_input_arguments(debug=False):
         return 'images.txt', 'points3D.txt'
     args = vars(ap.parse_args())
     path = args['path']
-    images_path = os.path.join(path, 'images.txt')
-    points_path = os.path.join(path, 'points3D.txt')
+    images_path = get_model_file(path, 'images')
+    points_path = get_model_file(path, 'points3D')
 
     return path, images_path, points_path
 
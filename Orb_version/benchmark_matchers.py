@@ -0,0 +1,107 @@
+import os
+import time
+import argparse
+from functools import partial
+import cv2
+import numpy as np
+import feature_matching as fm
+from orb_presets import PRESETS, DEFAULT_PRESET, get_preset, get_orb_params
+from orb_features import detect_and_compute
+
+"""
+Benchmark of the matcher backends on a workspace images folder, against brute force BFMatcher:
+    pairs/sec, matches/sec:  matching throughput (filtered matches, as written to the database)
+    match recall:            fraction of the brute force filtered matches also returned by the backend
+    inlier recall:           fraction of the brute force RANSAC inliers (fundamental matrix) also returned
+"""
+
+# RANSAC parameters of the fundamental matrix used to select the brute force inliers:
+RANSAC_THRESHOLD = 1.0
+RANSAC_CONFIDENCE = 0.99
+
+# Parser definition:
+ap = argparse.ArgumentParser()
+ap.add_argument('-p', '--path', required=True,
+                help='path to input images folder')
+ap.add_argument('--preset', choices=sorted(PRESETS), default=DEFAULT_PRESET,
+                help='ORB extraction and matching preset (default: %(default)s)')
+ap.add_argument('-n', '--max_images', type=int, default=30,
+                help='number of images of the sequence to benchmark (default: %(default)s)')
+ap.add_argument('-r', '--ratio', type=float, default=0.8,
+                help='ratio test threshold of the "+ratio" backends (default: %(default)s)')
+
+
+def get_backends(ratio: float) -> dict:
+    """
+    :param ratio: ratio test threshold - float
+    :return: backends: name -> match function (descriptors1, descriptors2) -> (query_idx, train_idx, distance)
+    """
+    return {'bf': fm.match_bf,
+            'hamming': fm.match_hamming,
+            'mih': fm.match_mih,
+            'mih (probe radius 1)': partial(fm.match_mih, probe_radius=1),
+            'hamming+ratio': partial(fm.match_hamming, ratio=ratio),
+            'mih+ratio': partial(fm.match_mih, ratio=ratio)}
+
+
+def get_inliers(keypoints1: np.ndarray, keypoints2: np.ndarray, matches: np.ndarray) -> set:
+    """
+    :param keypoints1: (x, y, size, angle) of each keypoint of the first image - np.array of size (n,4)
+    :param keypoints2: (x, y, size, angle) of each keypoint of the second image - np.array of size (m,4)
+    :param matches: matching feature ids - np.array of size (k,2)
+    :return: inliers: the matches consistent with the RANSAC fundamental matrix - set of tuples
+    """
+    if len(matches) < 8:
+        return set()
+
+    _, mask = cv2.findFundamentalMat(keypoints1[matches[:, 0], :2], keypoints2[matches[:, 1], :2],
+                                     cv2.FM_RANSAC, RANSAC_THRESHOLD, RANSAC_CONFIDENCE)
+    if mask is None:
+        return set()
+
+    return set(map(tuple, matches[mask.ravel() > 0].tolist()))
+
+
+def main():
+    args = vars(ap.parse_args())
+    preset = get_preset(args['preset'])
+
+    images = [os.path.join(args['path'], file) for file in sorted(os.listdir(args['path']))
+              if file.endswith(('.jpg', '.JPG', '.png'))][:args['max_images']]
+
+    orb = cv2.ORB_create(**get_orb_params(preset))
+    features = [detect_and_compute(orb, cv2.imread(image)) for image in images]
+    keypoints = [kp for kp, _ in features]
+    descriptors = [dsk for _, dsk in features]
+
+    pairs = fm.get_sequential_pairs(len(images), preset['match_window_overlap'], preset['do_quadratic_match'],
+                                    preset['filter_ratio'], preset['quadratic_filter_ratio'])
+    print('%d images, %d pairs, %.0f features per image (preset: %s)\n' %
+          (len(images), len(pairs), np.mean([len(d) for d in descriptors]) if descriptors else 0, args['preset']))
+
+    reference, reference_inliers = None, None
+    print('%-22s %10s %12s %14s %14s' % ('backend', 'pairs/sec', 'matches/sec', 'match recall', 'inlier recall'))
+
+    for name, match in get_backends(args['ratio']).items():
+        start = time.time()
+        matches = [fm.filter_matches(*match(descriptors[image_idx1], descriptors[image_idx2]), threshold)
+                   for image_idx1, image_idx2, threshold in pairs]
+        elapsed = max(time.time() - start, 1e-9)
+
+        found = [set(map(tuple, pair_matches.tolist())) for pair_matches in matches]
+        if reference is None:
+            reference = found
+            reference_inliers = [get_inliers(keypoints[image_idx1], keypoints[image_idx2], pair_matches)
+                                 for (image_idx1, image_idx2, _), pair_matches in zip(pairs, matches)]
+
+        total = sum(len(pair_matches) for pair_matches in matches)
+        match_recall = sum(len(f & r) for f, r in zip(found, reference)) / max(sum(map(len, reference)), 1)
+        inlier_recall = (sum(len(f & r) for f, r in zip(found, reference_inliers)) /
+                         max(sum(map(len, reference_inliers)), 1))
+
+        print('%-22s %10.2f %12.0f %14.3f %14.3f' % (name, len(pairs) / elapsed, total / elapsed,
+                                                      match_recall, inlier_recall))
+
+
+if __name__ == "__main__":
+    main()
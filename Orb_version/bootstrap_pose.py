@@ -0,0 +1,223 @@
+import cv2
+import numpy as np
+import feature_matching as fm
+import two_view_geometry as tvg
+from orb_features import CAMERA_MATRIX, DIST_COEFFS, CAMERA_MODEL_NAME, CAMERA_WIDTH, CAMERA_HEIGHT, CAMERA_PARAMS, \
+    detect_and_compute
+from orb_presets import DEFAULT_PRESET, get_preset, get_orb_params
+
+"""
+In-process replacement of the temporary COLMAP model (automatic_reconstructor on the first frames), which is only
+used for the pose of the first image:
+    1. ORB features of the first frames, matched between the first frame and each of the next frames
+    2. essential matrix and pose recovery (known intrinsics) of the best pair, that also triangulates its inliers
+    3. the other frames are registered to the triangulated points (PnP), which also selects the best pair
+    4. the poses are normalized like COLMAP normalizes its reconstructions (Reconstruction::Normalize), so the first
+       image pose is in the same kind of frame as the pose read from the temporary model
+"""
+
+# Ratio test of the matches between the first frame and the next frames:
+MATCH_RATIO = 0.8
+
+# Essential matrix RANSAC, with the local optimization of its best model (OpenCV >= 4.5, plain RANSAC before):
+ESSENTIAL_METHOD = getattr(cv2, 'USAC_ACCURATE', cv2.RANSAC)
+
+# The initial pair needs at least this many inliers (COLMAP's init_min_num_inliers), and this median triangulation
+# angle in degrees (much lower than COLMAP's init_min_tri_angle, the first frames of the video are close to each other):
+MIN_INIT_INLIERS = 100
+MIN_INIT_TRIANGULATION_ANGLE = 1.0
+
+# Triangulated points further than this number of baselines from the first camera are dropped (almost at infinity):
+MAX_POINT_DISTANCE = 50.0
+
+# Minimal number of PnP inliers of a registered frame (COLMAP's abs_pose_min_num_inliers):
+MIN_PNP_INLIERS = 30
+
+# The camera centers between these percentiles span NORMALIZED_EXTENT after the normalization:
+NORMALIZED_EXTENT = 10.0
+NORMALIZE_PERCENTILES = (10, 90)
+
+
+def get_features(images: list, orb_params=None) -> list:
+    """
+    :param images: grayscale images - list of np.array
+    :param orb_params: keyword arguments for cv2.ORB_create, by default the parameters of the default preset - dict
+    :return: features: (normalized points, descriptors) of each image - list of tuples
+    """
+    orb = cv2.ORB_create(**(get_orb_params(get_preset(DEFAULT_PRESET)) if orb_params is None else orb_params))
+    features = []
+    for image in images:
+        keypoints, descriptors = detect_and_compute(orb, image)
+        features.append((tvg.normalize_points(keypoints, CAMERA_MATRIX, DIST_COEFFS), descriptors))
+    return features
+
+
+def get_triangulation_angles(points: np.ndarray, rotation: np.ndarray, translation: np.ndarray) -> np.ndarray:
+    """
+    :param points: 3D points in the first camera frame - np.array of size (n,3)
+    :param rotation: rotation of the second camera (x2 = R x1 + t) - np.array of size (3,3)
+    :param translation: translation of the second camera - np.array of size (3,)
+    :return: angles: the angle between the rays of the two cameras of each point in degrees - np.array of size (n,)
+    """
+    ray1 = points
+    ray2 = points + rotation.T @ translation
+    cosine = np.sum(ray1 * ray2, axis=1) / (np.linalg.norm(ray1, axis=1) * np.linalg.norm(ray2, axis=1))
+    return np.degrees(np.arccos(np.clip(cosine, -1, 1)))
+
+
+def estimate_pair(points1: np.ndarray, points2: np.ndarray, threshold: float):
+    """
+    Essential matrix (5-point RANSAC with local optimization) and pose recovery between two frames.
+    :param points1: normalized points of the matches in the first frame - np.array of size (n,2)
+    :param points2: normalized points of the matches in the second frame - np.array of size (n,2)
+    :param threshold: maximal epipolar error of an inlier in normalized coordinates - float
+    :return: (rotation, translation, triangulated mask of the matches, 3D points in the first camera frame,
+             median triangulation angle), or None if the pose can't be recovered
+    """
+    essential, inliers = cv2.findEssentialMat(points1, points2, np.eye(3), ESSENTIAL_METHOD, tvg.CONFIDENCE,
+                                              threshold)
+    if essential is None or essential.shape != (3, 3):
+        return None
+
+    _, rotation, translation, inliers, points = cv2.recoverPose(essential, points1, points2, np.eye(3),
+                                                                distanceThresh=MAX_POINT_DISTANCE, mask=inliers)
+    is_triangulated = (inliers.reshape(-1) > 0) & (points[3] != 0)
+    if is_triangulated.sum() < MIN_INIT_INLIERS:
+        return None
+
+    points = (points[:3, is_triangulated] / points[3, is_triangulated]).T
+    translation = translation.reshape(3)
+    angle = float(np.median(get_triangulation_angles(points, rotation, translation)))
+    return rotation, translation, is_triangulated, points, angle
+
+
+def register_frame(object_points: np.ndarray, image_points: np.ndarray, threshold: float):
+    """
+    :param object_points: 3D points - np.array of size (n,3)
+    :param image_points: their normalized points in the frame - np.array of size (n,2)
+    :param threshold: maximal reprojection error of an inlier in normalized coordinates - float
+    :return: (rotation, translation, number of inliers) of the frame, or None if it can't be registered
+    """
+    if len(object_points) < MIN_PNP_INLIERS:
+        return None
+
+    is_solved, rotation_vector, translation, inliers = cv2.solvePnPRansac(
+        object_points, image_points, np.eye(3), None, reprojectionError=threshold, confidence=tvg.CONFIDENCE,
+        flags=cv2.SOLVEPNP_EPNP)
+    if not is_solved or inliers is None or len(inliers) < MIN_PNP_INLIERS:
+        return None
+
+    inliers = inliers.reshape(-1)
+    rotation_vector, translation = cv2.solvePnPRefineLM(object_points[inliers], image_points[inliers], np.eye(3),
+                                                        None, rotation_vector, translation)
+    return cv2.Rodrigues(rotation_vector)[0], translation.reshape(3), len(inliers)
+
+
+def register_frames(features: list, matches: list, feature_ids: np.ndarray, points: np.ndarray,
+                    threshold: float) -> tuple:
+    """
+    :param features: (normalized points, descriptors) of each frame - list of tuples
+    :param matches: (feature ids in the first frame, feature ids in the frame) of each frame - list of tuples
+    :param feature_ids: the first frame feature ids of the triangulated points - np.array of size (n,)
+    :param points: the triangulated points - np.array of size (n,3)
+    :param threshold: maximal reprojection error of an inlier in normalized coordinates - float
+    :return: poses: (rotation, translation) of each registered frame - dict
+    :return: inliers: the total number of PnP inliers of the registered frames - int
+    """
+    point_idx = np.full(len(features[0][0]), -1)
+    point_idx[feature_ids] = np.arange(len(feature_ids))
+
+    poses, inliers = {}, 0
+    for frame in range(1, len(features)):
+        query_idx, train_idx = matches[frame]
+        has_point = point_idx[query_idx] >= 0
+        pose = register_frame(points[point_idx[query_idx[has_point]]], features[frame][0][train_idx[has_point]],
+                              threshold)
+        if pose is not None:
+            poses[frame] = pose[:2]
+            inliers += pose[2]
+    return poses, inliers
+
+
+def normalize_poses(poses: dict) -> dict:
+    """
+    Move the centroid of the camera centers to the origin and scale them to NORMALIZED_EXTENT (the outer camera
+    centers are left out of both, like COLMAP's Reconstruction::Normalize).
+    :param poses: (rotation, translation) of each frame (x_camera = R x_world + t) - dict
+    :return: normalized_poses: the poses in the normalized frame - dict
+    """
+    centers = np.array([-rotation.T @ translation for rotation, translation in poses.values()])
+    low, high = np.percentile(centers, NORMALIZE_PERCENTILES, axis=0)
+    is_inner = np.all((centers >= low) & (centers <= high), axis=1)
+    centroid = centers[is_inner].mean(axis=0) if np.any(is_inner) else centers.mean(axis=0)
+    scale = NORMALIZED_EXTENT / max(np.linalg.norm(high - low), np.finfo(np.float64).eps)
+
+    return {frame: (rotation, -rotation @ (scale * (center - centroid)))
+            for (frame, (rotation, _)), center in zip(poses.items(), centers)}
+
+
+def estimate_poses(images: list, orb_params=None) -> dict:
+    """
+    Two-view initialization between the first frame and the best of the next frames, and registration of the other
+    frames to the points it triangulates.
+    :param images: grayscale frames, the first one is the reference frame - list of np.array
+    :param orb_params: keyword arguments for cv2.ORB_create, by default the parameters of the default preset - dict
+    :return: poses: normalized (rotation, translation) of each registered frame index (x_camera = R x_world + t),
+                    empty if there is no initial pair - dict
+    """
+    if len(images) < 2:
+        return {}
+
+    features = get_features(images, orb_params)
+    threshold = tvg.MAX_ERROR / np.mean((CAMERA_MATRIX[0, 0], CAMERA_MATRIX[1, 1]))
+    matches = [None] + [fm.match_hamming(features[0][1], features[frame][1], MATCH_RATIO)[:2]
+                        for frame in range(1, len(images))]
+
+    # Each pair with the first frame that has enough parallax is an initial pair candidate, the candidate that
+    # registers the other frames best wins (a wrong relative pose triangulates a structure the frames don't fit):
+    best_poses, best_score = {}, 0
+    for frame in range(1, len(images)):
+        query_idx, train_idx = matches[frame]
+        if len(query_idx) < MIN_INIT_INLIERS:
+            continue
+
+        pair = estimate_pair(features[0][0][query_idx], features[frame][0][train_idx], threshold)
+        if pair is None or pair[4] < MIN_INIT_TRIANGULATION_ANGLE:
+            continue
+
+        rotation, translation, is_triangulated, points, _ = pair
+        poses, inliers = register_frames(features, matches, query_idx[is_triangulated], points, threshold)
+        poses[frame] = (rotation, translation)
+        if is_triangulated.sum() + inliers > best_score:
+            best_poses, best_score = poses, is_triangulated.sum() + inliers
+
+    if not best_poses:
+        return {}
+
+    best_poses[0] = (np.eye(3), np.zeros(3))
+    return normalize_poses(dict(sorted(best_poses.items())))
+
+
+def estimate_first_pose(image_paths: list, orb_params=None):
+    """
+    :param image_paths: paths to the first images, the first one is the image the pose is estimated for - list of str
+    :param orb_params: keyword arguments for cv2.ORB_create, by default the parameters of the default preset - dict
+    :return: (rotation, translation) of the first image (x_camera = R x_world + t), None if it can't be estimated
+    """
+    images = [cv2.imread(image_path, cv2.IMREAD_GRAYSCALE) for image_path in image_paths]
+    if any(image is None for image in images):
+        return None
+
+    return estimate_poses(images, orb_params).get(0)
+
+
+def write_cameras_file(cameras_path: str) -> None:
+    """
+    Write the calibrated camera of the database (instead of the camera estimated by the temporary model)
+    :param cameras_path: path to the cameras.txt file - str
+    """
+    with open(cameras_path, 'w') as file:
+        file.write('# Camera list with one line of data per camera:\n')
+        file.write('#   CAMERA_ID, MODEL, WIDTH, HEIGHT, PARAMS[]\n')
+        file.write('# Number of cameras: 1\n')
+        file.write(' '.join(map(str, [1, CAMERA_MODEL_NAME, CAMERA_WIDTH, CAMERA_HEIGHT, *CAMERA_PARAMS])) + '\n')
@@ -6,40 +6,26 @@ from os import path, makedirs
 from PIL import Image
 import numpy as np
 from matplotlib import pyplot as plt
-from workplace_preparation import prepare_video, clear_workspace, quaternion_to_rotation_matrix, draw_rel_camera_pose
+from colmap_model import get_model_file, read_points3d_file, read_images_file
+from workplace_preparation import prepare_video, clear_workspace, quaternions_to_rotation_matrices, draw_rel_camera_pose
+from frame_source import DEFAULT_NUMBER_OF_FRAMES
 import deepdish as dd
 
 
 def plot_model_2d(sparse_folder: str, output_path: str, threshold=500) -> None:
     """
-    get a list of 3d points from the points.txt file
-    :param sparse_folder: path to points.txt file
+    Create a 2d plot of the 3d points of the model
+    :param sparse_folder: path to the model folder (points3D.bin or points3D.txt file)
     :param output_path: path to save the plot
     :param threshold: threshold for filter outlier points
-    :return points: list of points
     """
+    xyz = read_points3d_file(get_model_file(sparse_folder, 'points3D')).xyz
 
-    x = []
-    y = []
-    z = []
-
-    file_name = path.join(sparse_folder, 'points3D.txt')
-    with open(file_name, "r") as f:
-        for line in f.readlines():
-            if "#" not in line:
-                data = line.split(" ")
-                x_val = float(data[1])
-                y_val = float(data[3])
-                z_val = float(data[2])
-
-                # filter outliers
-                if abs(x_val) < threshold and abs(y_val) < threshold and abs(z_val) < threshold:
-                    x.append(x_val)
-                    y.append(y_val)
-                    z.append(z_val)
+    # filter outliers
+    xyz = xyz[np.all(np.abs(xyz) < threshold, axis=1)]
 
     fig = plt.figure()
-    plt.scatter(x, y, linewidth=0.1, s=2)
+    plt.scatter(xyz[:, 0], xyz[:, 2], linewidth=0.1, s=2)
     fig.savefig(path.join(output_path, 'sparse_plot.png'))
 
 
@@ -66,41 +52,20 @@ def run_colmap(input_path: str) -> str:
 
 def get_pose_from_file(path_to_folder: str) -> dict:
     """
-    Parsing the camera pose from COLMAP image.txt output file
+    Parsing the camera pose from COLMAP images.bin (or images.txt) output file
     :param path_to_folder: path to sparse model directory
     :return camera_pose_dict: dictionary of camera pose <camera_id , camera_pose>
     """
-    camera_pose_dict = {}
-    image_src = path.join(path_to_folder, 'images.txt')
-
-    # read images file
-    f = open(image_src, "r")
-    lines = f.readlines()[4::2]
-    f.close()
-
-    # create absolut camera pose dictionary
-    for line in lines:
-        columns = line.split()
-        image_name = columns[9].split('.')[0]
-        image_id = int(image_name.split('e')[1])
+    images = read_images_file(get_model_file(path_to_folder, 'images'))
 
-        camera_pose_dict[image_id] = []
+    # get the rotation matrices of all the images at once
+    rotations = quaternions_to_rotation_matrices(images.qvecs)
 
-        # get rotation matrix
-        qw = float(columns[1])
-        qx = float(columns[2])
-        qy = float(columns[3])
-        qz = float(columns[4])
-        R = quaternion_to_rotation_matrix(qw, qx, qy, qz)
-
-        # get translation vector
-        tx = float(columns[5])
-        ty = float(columns[6])
-        tz = float(columns[7])
-        T = np.array([tx, ty, tz])
-
-        camera_pose_dict[image_id].append(R)
-        camera_pose_dict[image_id].append(T)
+    # create absolut camera pose dictionary, the image id is the number in the image name (imageN.jpg)
+    camera_pose_dict = {}
+    for name, rotation, translation in zip(images.names, rotations, images.tvecs):
+        image_id = int(name.split('.')[0].split('e')[1])
+        camera_pose_dict[image_id] = [rotation, np.array(translation)]
 
     # return camera pose sorted by image id
     return collections.OrderedDict(sorted(camera_pose_dict.items()))
@@ -154,7 +119,7 @@ def main(input_path):
     clear_workspace(input_path)
 
     # extract images from video
-    prepare_video(input_path, 87)
+    prepare_video(input_path, DEFAULT_NUMBER_OF_FRAMES)
 
     # create model with colmap
     path_to_sparse_model = run_colmap(input_path)
@@ -4,6 +4,29 @@
 use_orb_version=true
 USER_NAME="rbdstudent"
 
+# ORB extraction and matching preset (pi0-fast, balanced or quality):
+ORB_PRESET="balanced"
+
+# Output format of the triangulated model (BIN is read without any text parsing, TXT for inspection):
+MODEL_OUTPUT_TYPE="BIN"
+
+# Map output format of db_conversion (csv, binary or both):
+MAP_FORMAT="csv"
+
+# Keep only the sharp keyframes the camera moved to (at most one for each of the 87 image slots):
+select_keyframes=true
+
+# Get the first image pose from a temporary COLMAP model (automatic_reconstructor) instead of the in-process two-view
+# bootstrap (the temporary model is otherwise only its fallback):
+use_temp_model=false
+
+# Take the ORB extractor input out of the video instead of the JPEG images (the same images, but the video is decoded a
+# second time after workplace_preparation):
+extract_from_video=false
+
+# Verify the matches while they are extracted (two_view_geometries), instead of COLMAP's sequential_matcher:
+in_process_geometric_verification=false
+
 # Get path to image and database folders:
 while getopts p: flag
 do
@@ -21,9 +44,23 @@ start_program_time="$(date -u +%s)"
 # Workplace preparation (images and camera pose)
 start="$(date -u +%s)"
 
+if [ "$select_keyframes" = true ] ; then
+  keyframes_flag="--keyframes"
+else
+  keyframes_flag=""
+fi
+
+if [ "$use_temp_model" = true ] ; then
+  temp_model_flag="--temp_model"
+else
+  temp_model_flag=""
+fi
+
 if [ "$use_orb_version" = true ] ; then
   python3 "/home/$USER_NAME/colmap/Orb_version/workplace_preparation.py"  \
-  	  --workspace_path "$DB_PATH"
+  	  --workspace_path "$DB_PATH" \
+  	  $keyframes_flag \
+  	  $temp_model_flag
 else
   mkdir $DB_PATH/images
   ffmpeg -i "$DB_PATH/outpy.h264" -r 0.5 -f image2 "$DB_PATH/images/image%d.jpg"
@@ -35,18 +72,34 @@ echo "Workplace preparation (images and camera pose)  [sec]: $elapsed" >> "$DB_P
 
 if [ "$use_orb_version" = true ] ; then
   # Extract and match ORB features
+  if [ "$in_process_geometric_verification" = true ] ; then
+    verification_flag="--geometric_verification"
+  else
+    verification_flag=""
+  fi
+  if [ "$extract_from_video" = true ] ; then
+    video_flag="--video $DB_PATH/outpy.h264 $keyframes_flag"
+  else
+    video_flag=""
+  fi
+
   python3 "/home/$USER_NAME/colmap/Orb_version/detect_and_compute_keypoints.py" \
      --path "$DB_PATH/images/" \
-     --db_path "$DB_PATH"
+     --db_path "$DB_PATH" \
+     --preset "$ORB_PRESET" \
+     $verification_flag \
+     $video_flag
 
-  start="$(date -u +%s)"
+  if [ "$in_process_geometric_verification" != true ] ; then
+    start="$(date -u +%s)"
 
-  colmap sequential_matcher \
-    --database_path "$DB_PATH/database.db"
+    colmap sequential_matcher \
+      --database_path "$DB_PATH/database.db"
 
-  end="$(date -u +%s)"
-  elapsed="$(($end-$start))"
-  echo "Two View Geometry  [sec]: $elapsed" >> "$DB_PATH/sfm_log.txt"
+    end="$(date -u +%s)"
+    elapsed="$(($end-$start))"
+    echo "Two View Geometry  [sec]: $elapsed" >> "$DB_PATH/sfm_log.txt"
+  fi
 
   start="$(date -u +%s)"
 
@@ -54,7 +107,8 @@ if [ "$use_orb_version" = true ] ; then
      --database_path $DB_PATH/database.db \
      --image_path $DB_PATH/images \
      --input_path $DB_PATH/camera_poses \
-     --output_path $DB_PATH
+     --output_path $DB_PATH \
+     --output_type $MODEL_OUTPUT_TYPE
 
   end="$(date -u +%s)"
   elapsed="$(($end-$start))"
@@ -75,7 +129,8 @@ fi
 start="$(date -u +%s)"
 
 python3 "/home/$USER_NAME/colmap/Orb_version/db_conversion.py" \
-    --input_path  "$DB_PATH"
+    --input_path  "$DB_PATH" \
+    --format "$MAP_FORMAT"
 
 end="$(date -u +%s)"
 elapsed="$(($end-$start))"
@@ -2,6 +2,7 @@
 # 0. General Setup:
 ###################
 
+import time
 import sqlite3
 import numpy as np
 
@@ -68,6 +69,19 @@ CREATE_MATCHES_TABLE = """DROP TABLE IF EXISTS matches; CREATE TABLE IF NOT EXIS
 
 CREATE_NAME_INDEX = "CREATE UNIQUE INDEX IF NOT EXISTS index_name ON images(name)"
 
+# Connection settings for a fast one-shot load of a fresh database (page_size only applies before tables exist, so
+# it is set once by set_bulk_pragmas, the others are also set again by bulk_ingest):
+BULK_PAGE_SIZE_PRAGMA = "PRAGMA page_size = 65536"
+BULK_PRAGMAS = ["PRAGMA journal_mode = MEMORY",
+                "PRAGMA synchronous = OFF"]
+
+INSERT_CAMERA = "INSERT INTO cameras VALUES (?, ?, ?, ?, ?, ?)"
+INSERT_IMAGE = "INSERT INTO images VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+INSERT_KEYPOINTS = "INSERT INTO keypoints VALUES (?, ?, ?, ?)"
+INSERT_DESCRIPTORS = "INSERT INTO descriptors VALUES (?, ?, ?, ?)"
+INSERT_MATCHES = "INSERT INTO matches VALUES (?, ?, ?, ?)"
+INSERT_TWO_VIEW_GEOMETRY = "INSERT INTO two_view_geometries VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+
 CREATE_ALL = '; '.join([CREATE_CAMERAS_TABLE,
                         CREATE_IMAGES_TABLE,
                         CREATE_KEYPOINTS_TABLE,
@@ -123,6 +137,82 @@ def blob_to_array(blob, dtype, shape=(-1,)):
     """
     return np.fromstring(blob, dtype=dtype).reshape(*shape)
 
+
+def camera_row(model, width, height, params, prior_focal_length=False, camera_id=None):
+    """
+    Converts a camera model into a row of the cameras table (see COLMAPDatabase.add_camera).
+    :return row: values of the cameras table columns - tuple
+    """
+    params = np.asarray(params, np.float64)
+    return camera_id, model, width, height, array_to_blob(params), prior_focal_length
+
+
+def image_row(name, camera_id, prior_q=np.zeros(4), prior_t=np.zeros(3), image_id=None):
+    """
+    Converts an image into a row of the images table (see COLMAPDatabase.add_image).
+    :return row: values of the images table columns - tuple
+    """
+    return (image_id, name, camera_id, prior_q[0], prior_q[1], prior_q[2],
+            prior_q[3], prior_t[0], prior_t[1], prior_t[2])
+
+
+def keypoints_row(image_id, keypoints):
+    """
+    Converts the keypoints of an image into a row of the keypoints table (see COLMAPDatabase.add_keypoints).
+    :return row: values of the keypoints table columns - tuple
+    """
+    assert(len(keypoints.shape) == 2)
+    assert(keypoints.shape[1] in [2, 4, 6])
+
+    keypoints = np.asarray(keypoints, np.float32)
+    return (image_id,) + keypoints.shape + (array_to_blob(keypoints),)
+
+
+def descriptors_row(image_id, descriptors):
+    """
+    Converts the descriptors of an image into a row of the descriptors table (see COLMAPDatabase.add_descriptors).
+    :return row: values of the descriptors table columns - tuple
+    """
+    descriptors = np.ascontiguousarray(descriptors, np.uint8)
+    return (image_id,) + descriptors.shape + (array_to_blob(descriptors),)
+
+
+def matches_row(image_id1, image_id2, matches):
+    """
+    Converts the matches of an images pair into a row of the matches table (see COLMAPDatabase.add_matches).
+    :return row: values of the matches table columns - tuple
+    """
+    assert(len(matches.shape) == 2)
+    assert(matches.shape[1] == 2)
+
+    if image_id1 > image_id2:
+        matches = matches[:,::-1]
+
+    pair_id = image_ids_to_pair_id(image_id1, image_id2)
+    matches = np.asarray(matches, np.uint32)
+    return (pair_id,) + matches.shape + (array_to_blob(matches),)
+
+
+def two_view_geometry_row(image_id1, image_id2, matches, F=np.eye(3), E=np.eye(3), H=np.eye(3), config=2):
+    """
+    Converts a two view geometry into a row of the two_view_geometries table
+    (see COLMAPDatabase.add_two_view_geometry).
+    :return row: values of the two_view_geometries table columns - tuple
+    """
+    assert(len(matches.shape) == 2)
+    assert(matches.shape[1] == 2)
+
+    if image_id1 > image_id2:
+        matches = matches[:,::-1]
+
+    pair_id = image_ids_to_pair_id(image_id1, image_id2)
+    matches = np.asarray(matches, np.uint32)
+    F = np.asarray(F, dtype=np.float64)
+    E = np.asarray(E, dtype=np.float64)
+    H = np.asarray(H, dtype=np.float64)
+    return (pair_id,) + matches.shape + (array_to_blob(matches), config,
+                                         array_to_blob(F), array_to_blob(E), array_to_blob(H))
+
 ########################################################################################################################
 
 ###########################
@@ -169,11 +259,9 @@ class COLMAPDatabase(sqlite3.Connection):
         :param camera_id: unique camera id, if not specified, a new id is created - int
         :return: camera_id: the unique camera id - int
         """
-        params = np.asarray(params, np.float64)
         cursor = self.execute(
-            "INSERT INTO cameras VALUES (?, ?, ?, ?, ?, ?)",
-            (camera_id, model, width, height, array_to_blob(params),
-             prior_focal_length))
+            INSERT_CAMERA,
+            camera_row(model, width, height, params, prior_focal_length, camera_id))
         return cursor.lastrowid
 
     def add_image(self, name, camera_id,
@@ -188,9 +276,8 @@ class COLMAPDatabase(sqlite3.Connection):
         :return: image_id: the unique image id - int
         """
         cursor = self.execute(
-            "INSERT INTO images VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
-            (image_id, name, camera_id, prior_q[0], prior_q[1], prior_q[2],
-             prior_q[3], prior_t[0], prior_t[1], prior_t[2]))
+            INSERT_IMAGE,
+            image_row(name, camera_id, prior_q, prior_t, image_id))
         return cursor.lastrowid
 
     def add_keypoints(self, image_id, keypoints):
@@ -199,24 +286,15 @@ class COLMAPDatabase(sqlite3.Connection):
         :param image_id: the unique image id - int
         :param keypoints: a list of keypoints, each is [x,y,scale,angle] - list of lists
         """
-        assert(len(keypoints.shape) == 2)
-        assert(keypoints.shape[1] in [2, 4, 6])
-
-        keypoints = np.asarray(keypoints, np.float32)
-        self.execute(
-            "INSERT INTO keypoints VALUES (?, ?, ?, ?)",
-            (image_id,) + keypoints.shape + (array_to_blob(keypoints),))
+        self.execute(INSERT_KEYPOINTS, keypoints_row(image_id, keypoints))
 
     def add_descriptors(self, image_id, descriptors):
         """
-        Add keypoint descriptors to an image.
+        Add keypoint descriptors to an image, the descriptor length is stored in the cols column.
         :param image_id: the unique image id - int
-        :param descriptors: a list of descriptors, each of length 128 - list of np.arrays
+        :param descriptors: a list of descriptors, each of length 128 (or 32 for compact ORB descriptors) - np.array
         """
-        descriptors = np.ascontiguousarray(descriptors, np.uint8)
-        self.execute(
-            "INSERT INTO descriptors VALUES (?, ?, ?, ?)",
-            (image_id,) + descriptors.shape + (array_to_blob(descriptors),))
+        self.execute(INSERT_DESCRIPTORS, descriptors_row(image_id, descriptors))
 
     def add_matches(self, image_id1, image_id2, matches):
         """
@@ -225,17 +303,7 @@ class COLMAPDatabase(sqlite3.Connection):
         :param image_id2: image id 2 - int
         :param matches: an array of feature matches of size (n,2) - np.array
         """
-        assert(len(matches.shape) == 2)
-        assert(matches.shape[1] == 2)
-
-        if image_id1 > image_id2:
-            matches = matches[:,::-1]
-
-        pair_id = image_ids_to_pair_id(image_id1, image_id2)
-        matches = np.asarray(matches, np.uint32)
-        self.execute(
-            "INSERT INTO matches VALUES (?, ?, ?, ?)",
-            (pair_id,) + matches.shape + (array_to_blob(matches),))
+        self.execute(INSERT_MATCHES, matches_row(image_id1, image_id2, matches))
 
     def add_two_view_geometry(self, image_id1, image_id2, matches,
                               F=np.eye(3), E=np.eye(3), H=np.eye(3), config=2):
@@ -249,21 +317,57 @@ class COLMAPDatabase(sqlite3.Connection):
         :param H: Homography matrix of size (3,3) - np.array
         :param config: configuration of two-view geometry [1-DEGENERATE, 2-CALIBRATED, 3-UNCALIBRATED...] - int
         """
-        assert(len(matches.shape) == 2)
-        assert(matches.shape[1] == 2)
-
-        if image_id1 > image_id2:
-            matches = matches[:,::-1]
-
-        pair_id = image_ids_to_pair_id(image_id1, image_id2)
-        matches = np.asarray(matches, np.uint32)
-        F = np.asarray(F, dtype=np.float64)
-        E = np.asarray(E, dtype=np.float64)
-        H = np.asarray(H, dtype=np.float64)
-        self.execute(
-            "INSERT INTO two_view_geometries VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-            (pair_id,) + matches.shape + (array_to_blob(matches), config,
-             array_to_blob(F), array_to_blob(E), array_to_blob(H)))
+        self.execute(INSERT_TWO_VIEW_GEOMETRY,
+                     two_view_geometry_row(image_id1, image_id2, matches, F, E, H, config))
+
+    def set_bulk_pragmas(self):
+        """
+        Tune the connection for a one-shot bulk load (call before create_tables for page_size to take effect).
+        """
+        self.execute(BULK_PAGE_SIZE_PRAGMA)
+        for pragma in BULK_PRAGMAS:
+            self.execute(pragma)
+
+    def bulk_ingest(self, cameras=(), images=(), keypoints=(), descriptors=(), matches=(),
+                    two_view_geometries=()):
+        """
+        Insert cameras, images, keypoints, descriptors and matches with executemany in a single transaction.
+        :param cameras: list of (model, width, height, params) tuples, optionally followed by
+                        prior_focal_length and camera_id - list of tuples
+        :param images: list of (name, camera_id) tuples, optionally followed by prior_q, prior_t and image_id
+        :param keypoints: list of (image_id, keypoints) tuples - list of tuples
+        :param descriptors: list of (image_id, descriptors) tuples - list of tuples
+        :param matches: list of (image_id1, image_id2, matches) tuples - list of tuples
+        :param two_view_geometries: list of (image_id1, image_id2, matches) tuples, optionally followed by
+                                    F, E, H and config - list of tuples
+        :return: rows: number of inserted rows - int
+        :return: rows_per_sec: insertion throughput - float
+        """
+        start = time.time()
+
+        # Pragmas can't be changed inside a transaction, the pending inserts are part of the bulk load anyway (the
+        # page size is left to set_bulk_pragmas, the tables already exist):
+        self.commit()
+        for pragma in BULK_PRAGMAS:
+            self.execute(pragma)
+
+        tables = ((INSERT_CAMERA, camera_row, cameras),
+                  (INSERT_IMAGE, image_row, images),
+                  (INSERT_KEYPOINTS, keypoints_row, keypoints),
+                  (INSERT_DESCRIPTORS, descriptors_row, descriptors),
+                  (INSERT_MATCHES, matches_row, matches),
+                  (INSERT_TWO_VIEW_GEOMETRY, two_view_geometry_row, two_view_geometries))
+
+        rows = 0
+        with self:
+            for insert, to_row, items in tables:
+                cursor = self.executemany(insert, (to_row(*item) for item in items))
+                rows += max(cursor.rowcount, 0)
+
+        elapsed = time.time() - start
+        rows_per_sec = rows / elapsed if elapsed > 0 else float('inf')
+
+        return rows, rows_per_sec
 
 
 ########################################################################################################################
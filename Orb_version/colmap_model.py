@@ -0,0 +1,221 @@
+import os
+import sys
+import collections
+import numpy as np
+
+# The binary model files are decoded by the COLMAP scripts (colmap/scripts/python/read_write_model.py), so there is a
+# single decoder of each file and a single points3D.bin offset index:
+COLMAP_SCRIPTS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'colmap', 'scripts',
+                                   'python')
+if COLMAP_SCRIPTS_PATH not in sys.path:
+    sys.path.append(COLMAP_SCRIPTS_PATH)
+import read_write_model as rwm
+
+# Number of points3D.txt lines parsed in a single NumPy block:
+POINTS_CHUNK_SIZE = 65536
+
+# Number of values before the track of a points3D.txt line (POINT3D_ID, X, Y, Z, R, G, B, ERROR):
+POINT_HEADER_SIZE = 8
+
+# Bump when the cached arrays change for the same points3D.txt file:
+CACHE_VERSION = 1
+
+# The 3D points of a COLMAP model as arrays, the track of point p is elements track_offsets[p]:track_offsets[p+1]
+# of track_image_ids and track_point2d_ids:
+Points3D = collections.namedtuple('Points3D', ['ids', 'xyz', 'rgb', 'error', 'track_offsets', 'track_image_ids',
+                                               'track_point2d_ids'])
+
+# The registered images of a COLMAP model as arrays (their 2D points are not kept):
+Images = collections.namedtuple('Images', ['ids', 'qvecs', 'tvecs', 'camera_ids', 'names'])
+
+def empty_points3d() -> Points3D:
+    """
+    :return: points: a Points3D without any point
+    """
+    return Points3D(np.zeros(0, dtype=np.int64), np.zeros((0, 3)), np.zeros((0, 3), dtype=np.uint8), np.zeros(0),
+                    np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+
+
+def parse_points3d_lines(lines: list) -> Points3D:
+    """
+    Parse points3D.txt data lines (without comments) with a single numeric conversion for all of them.
+    :param lines: lines of the file - list of str
+    :return: points: Points3D of the lines
+    """
+    if len(lines) == 0:
+        return empty_points3d()
+
+    counts = np.array([len(line.split()) for line in lines], dtype=np.int64)
+    values = np.fromstring(' '.join(lines), dtype=np.float64, sep=' ')
+    if len(values) != counts.sum() or np.any(counts < POINT_HEADER_SIZE) or np.any((counts - POINT_HEADER_SIZE) % 2):
+        raise ValueError('invalid points3D.txt line')
+
+    starts = np.cumsum(counts) - counts
+    header = values[starts[:, None] + np.arange(POINT_HEADER_SIZE)]
+
+    # Position of each track element in values:
+    lengths = (counts - POINT_HEADER_SIZE) // 2
+    track_offsets = np.concatenate(([0], np.cumsum(lengths)))
+    point_of_element = np.repeat(np.arange(len(lines)), lengths)
+    elements = (starts[point_of_element] + POINT_HEADER_SIZE +
+                2 * (np.arange(track_offsets[-1]) - track_offsets[point_of_element]))
+
+    return Points3D(header[:, 0].astype(np.int64), header[:, 1:4], header[:, 4:7].astype(np.uint8), header[:, 7],
+                    track_offsets, values[elements].astype(np.int64), values[elements + 1].astype(np.int64))
+
+
+def concatenate_points3d(chunks: list) -> Points3D:
+    """
+    :param chunks: list of Points3D
+    :return: points: a single Points3D of all the chunks points, in order
+    """
+    chunks = [empty_points3d()] + list(chunks)
+    lengths = [chunk.track_offsets[-1] for chunk in chunks]
+    track_offsets = [chunk.track_offsets[1:] + first for chunk, first in zip(chunks, np.cumsum(lengths) - lengths)]
+
+    return Points3D(*(np.concatenate([getattr(chunk, field) for chunk in chunks])
+                      for field in ('ids', 'xyz', 'rgb', 'error')),
+                    np.concatenate([[0]] + track_offsets).astype(np.int64),
+                    np.concatenate([chunk.track_image_ids for chunk in chunks]),
+                    np.concatenate([chunk.track_point2d_ids for chunk in chunks]))
+
+
+def iter_points3d(path: str, chunk_size=POINTS_CHUNK_SIZE):
+    """
+    Stream a points3D.txt file in chunks of points, without holding the whole file in memory.
+    :param path: path to the points3D.txt file - str
+    :param chunk_size: number of points of each chunk - int
+    :return: generator of Points3D chunks
+    """
+    lines = []
+    with open(path, 'r') as file:
+        for line in file:
+            line = line.strip()
+            if len(line) > 0 and line[0] != '#':
+                lines.append(line)
+                if len(lines) == chunk_size:
+                    yield parse_points3d_lines(lines)
+                    lines = []
+
+    if len(lines) > 0:
+        yield parse_points3d_lines(lines)
+
+
+def get_cache_path(path: str) -> str:
+    """
+    :param path: path to the points3D.txt file - str
+    :return: cache_path: path to the .npz cache of the file - str
+    """
+    return os.path.splitext(path)[0] + '_cache.npz'
+
+
+def read_points3d(path: str, chunk_size=POINTS_CHUNK_SIZE, use_cache=False) -> Points3D:
+    """
+    Read all the points of a points3D.txt file.
+    :param path: path to the points3D.txt file - str
+    :param chunk_size: number of points parsed in a single block - int
+    :param use_cache: boolean flag for reading (and writing) an .npz cache next to the file, valid while the file
+                      modification time and size are unchanged
+    :return: points: Points3D of the file
+    """
+    stat = os.stat(path)
+    key = np.array([CACHE_VERSION, stat.st_mtime_ns, stat.st_size], dtype=np.int64)
+    cache_path = get_cache_path(path)
+
+    if use_cache:
+        try:
+            with np.load(cache_path) as cache:
+                if np.array_equal(cache['key'], key):
+                    return Points3D(*(cache[field] for field in Points3D._fields))
+        except (OSError, ValueError, KeyError):
+            pass
+
+    points = concatenate_points3d(iter_points3d(path, chunk_size))
+
+    if use_cache:
+        # Written to a temporary file first, so readers never see a partial cache (a read-only folder is not cached):
+        temp_path = cache_path + '.{}.tmp.npz'.format(os.getpid())
+        try:
+            np.savez(temp_path, key=key, **points._asdict())
+            os.replace(temp_path, cache_path)
+        except OSError:
+            pass
+
+    return points
+
+
+def read_points3d_binary(path: str, use_index=False) -> Points3D:
+    """
+    Read all the points of a points3D.bin file (see read_write_model.read_points3d_binary_arrays).
+    :param path: path to the points3D.bin file - str
+    :param use_index: boolean flag for memory-mapping the file and reading (and writing) its offset index, so the
+                      sequential scan runs once per file (see read_write_model.Points3DBinaryView)
+    :return: points: Points3D of the file
+    """
+    if use_index:
+        points = rwm.Points3DBinaryView(path).read_rows()
+    else:
+        points = rwm.read_points3d_binary_arrays(path)
+
+    return Points3D(points.ids, points.xyz, points.rgb, points.error, points.track_offsets, points.image_ids,
+                    points.point2D_idxs)
+
+
+def read_images_text(path: str) -> Images:
+    """
+    :param path: path to the images.txt file - str
+    :return: images: Images of the file
+    """
+    with open(path, 'r') as file:
+        lines = [line.strip() for line in file if not line.startswith('#')]
+
+    # Two lines for each image, the image line and its (possibly empty) 2D points line:
+    values = [line.split() for line in lines[0::2] if len(line) > 0]
+    if len(values) == 0:
+        return Images(np.zeros(0, dtype=np.int64), np.zeros((0, 4)), np.zeros((0, 3)), np.zeros(0, dtype=np.int64),
+                      [])
+
+    numbers = np.array([row[:9] for row in values], dtype=np.float64)
+    return Images(numbers[:, 0].astype(np.int64), numbers[:, 1:5], numbers[:, 5:8], numbers[:, 8].astype(np.int64),
+                  [' '.join(row[9:]) for row in values])
+
+
+def read_images_binary(path: str) -> Images:
+    """
+    :param path: path to the images.bin file - str
+    :return: images: Images of the file (see read_write_model.read_images_binary_arrays)
+    """
+    images = rwm.read_images_binary_arrays(path)
+    return Images(images.ids, images.qvecs, images.tvecs, images.camera_ids, images.names)
+
+
+def get_model_file(model_path: str, name: str) -> str:
+    """
+    :param model_path: path to the model folder - str
+    :param name: model file name without extension ('cameras', 'images' or 'points3D') - str
+    :return: path: the newer of the binary and the text files of the model (a model written again in the other
+                   format leaves the old file next to it), the text file if there is neither - str
+    """
+    paths = [os.path.join(model_path, name + extension) for extension in ('.txt', '.bin')]
+    existing = [path for path in paths if os.path.exists(path)]
+    return max(existing, key=os.path.getmtime) if len(existing) > 0 else paths[0]
+
+
+def read_points3d_file(path: str, use_cache=False) -> Points3D:
+    """
+    :param path: path to a points3D.bin or points3D.txt file - str
+    :param use_cache: boolean flag for the .npz cache of text files (see read_points3d) and the offset index of
+                      binary files (see read_points3d_binary)
+    :return: points: Points3D of the file
+    """
+    if path.endswith('.bin'):
+        return read_points3d_binary(path, use_index=use_cache)
+    return read_points3d(path, use_cache=use_cache)
+
+
+def read_images_file(path: str) -> Images:
+    """
+    :param path: path to an images.bin or images.txt file - str
+    :return: images: Images of the file
+    """
+    return read_images_binary(path) if path.endswith('.bin') else read_images_text(path)
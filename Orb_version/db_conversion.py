@@ -4,89 +4,94 @@ import sqlite3
 import argparse
 import numpy as np
 import matplotlib.pyplot as plt
+from colmap_model import get_model_file, read_points3d_file
+from descriptor_table import load_descriptor_table
+from orb_map import MAP_FILE_NAME, write_map
+
+# Number of track elements whose medoid costs are computed in a single NumPy block:
+MEDOID_BLOCK_SIZE = 16384
 
 
 # Parser for path to database file:
 def parse_args() -> tuple:
     """
     Function to parse user argument
-    :return: input_path and output_path
+    :return: input_path, output_path and output format
     """
     ap = argparse.ArgumentParser(description='Converting colmap output files into ORB descriptors.')
     ap.add_argument('-p', '--input_path', required=True)
     ap.add_argument('-o', '--output_path', type=str, default=None)
+    ap.add_argument('-f', '--format', choices=('csv', 'binary', 'both'), default='csv',
+                    help='pointData.csv and descriptorsData.xml (csv), a single %s map file (binary) or both '
+                         '(default: %%(default)s)' % MAP_FILE_NAME)
     args = vars(ap.parse_args())
-    return args['input_path'], args['output_path']
+    return args['input_path'], args['output_path'], args['format']
 
 
-def get_descriptors(cursor, img_list: list) -> list:
-    """
-    get list of descriptors for each image
-    :param cursor: sqlite3.connect().cursor
-    :param img_list: list of images
-    :return dsk: list of descriptors
-    """
-    dsk = []
-    for image_id, _ in img_list:
-        cursor.execute('SELECT data FROM descriptors WHERE image_id=?;', (image_id,))
-        row = next(cursor)
-        if row[0] is None:
-            dsk.append(np.zeros((0, 128), dtype=np.uint8))
-        else:
-            dsk.append(np.frombuffer(row[0], dtype=np.uint8).reshape(-1, 128))
-    return dsk
-
-
-def get_3d_points(input_path: str) -> list:
+def select_descriptors(xyz: np.ndarray, offsets: np.ndarray, image_ids: np.ndarray, point2d_ids: np.ndarray,
+                       table: np.ndarray, table_offsets: np.ndarray, table_counts: np.ndarray) -> tuple:
     """
-    get a list of 3d points from the points.txt file
-    :param input_path: path to points.txt file
-    :return points: list of points
+    Select the Hamming medoid descriptor of each 3D point track, for all the points at once.
+    The total Hamming distance of a track element e to the L elements of its track is
+    sum_b (bit_eb ? L - c_b : c_b), where c_b is the number of track elements with bit b set, so the medoid needs
+    only the per-track bit counts. Tracks are grouped by length so each group is a dense array.
+    Track elements of unknown images or keypoints are ignored, and points without any valid element are dropped.
+    :param xyz: np.array of size (n,3)
+    :param offsets: track offsets - np.array of size (n+1,)
+    :param image_ids: image of each track element - np.array
+    :param point2d_ids: keypoint of each track element - np.array
+    :param table: all the descriptors, as returned by load_descriptor_table - np.array of size (total,32)
+    :param table_offsets: first row of each image_id in table - np.array
+    :param table_counts: number of descriptors of each image_id - np.array
+    :return: xyz: the kept points - np.array of size (m,3)
+    :return: descriptors: the medoid descriptor of each kept point - np.array of size (m,32)
     """
-    points = []
-    path = os.path.join(input_path, 'points3D.txt')
-    with open(path, 'r') as file:
-        lines = file.readlines()
-        for line in lines:
-            line = line.strip()
-            if len(line) > 0 and line[0] != "#":
-                elements = line.split()
-                xyz = np.array(tuple(map(float, elements[1:4])))
-                image_ids = np.array(tuple(map(int, elements[8::2])))
-                point2d_ids = np.array(tuple(map(int, elements[9::2])))
-                error = float(elements[7])
-                points.append([xyz, image_ids, point2d_ids, error])
-    return points
-
-
-def plot_2d(file_name: str, output_path: str, threshold=500) -> None:
+    point_of_element = np.repeat(np.arange(len(xyz)), np.diff(offsets))
+
+    # Keep the elements pointing to an existing descriptor:
+    known = (image_ids >= 0) & (image_ids < len(table_counts))
+    known[known] = (point2d_ids[known] >= 0) & (point2d_ids[known] < table_counts[image_ids[known]])
+    rows = table_offsets[image_ids[known]] + point2d_ids[known]
+    point_of_element = point_of_element[known]
+
+    lengths = np.bincount(point_of_element, minlength=len(xyz))
+    kept = np.flatnonzero(lengths)
+    starts = np.concatenate(([0], np.cumsum(lengths[kept])[:-1])).astype(np.int64)
+    medoids = np.empty(len(kept), dtype=np.int64)
+
+    # Tracks of the same length L form a dense (tracks, L, 256) block of bits, processed in bounded chunks:
+    for length in np.unique(lengths[kept]):
+        tracks = np.flatnonzero(lengths[kept] == length)
+        chunk_size = max(MEDOID_BLOCK_SIZE // length, 1)
+
+        for chunk in range(0, len(tracks), chunk_size):
+            track_starts = starts[tracks[chunk:chunk + chunk_size]]
+            elements = track_starts[:, None] + np.arange(length)
+            bits = np.unpackbits(table[rows[elements]], axis=2)
+
+            # cost_e = sum_b c_b + sum_b bit_eb * (L - 2 c_b), with c_b the bit counts of the track:
+            ones = bits.sum(axis=1, dtype=np.int32)
+            cost = np.einsum('teb,tb->te', bits, length - 2 * ones, dtype=np.int64)
+            cost += ones.sum(axis=1, dtype=np.int64)[:, None]
+
+            # np.argmin keeps the first track element of minimal cost:
+            medoids[tracks[chunk:chunk + chunk_size]] = track_starts + np.argmin(cost, axis=1)
+
+    return xyz[kept], table[rows[medoids]]
+
+
+def plot_2d(xyz: np.ndarray, output_path: str, threshold=500) -> None:
     """
     Create a 2d plot of the reconstructed model
-    :param file_name: path to points.txt file
+    :param xyz: the 3D points - np.array of size (n,3)
     :param output_path: path to save the plot
     :param threshold: threshold for filter outlier points
-    :return points: list of points
     """
-    x = []
-    y = []
-    z = []
-
-    with open(file_name, "r") as f:
-        for line in f.readlines():
-            if "#" not in line:
-                data = line.split(" ")
-                x_val = float(data[0])
-                y_val = float(data[2])
-                z_val = float(data[1])
-
-                # filter outliers
-                if abs(x_val) < threshold and abs(y_val) < threshold and abs(z_val) < threshold:
-                    x.append(x_val)
-                    y.append(y_val)
-                    z.append(z_val)
+    # filter outliers
+    xyz = xyz[np.all(np.abs(xyz) < threshold, axis=1)]
 
     fig = plt.figure()
-    plt.scatter(x, y, linewidth=0.1, s=2)
+    plt.scatter(xyz[:, 0], xyz[:, 2], linewidth=0.1, s=2)
     fig.savefig(os.path.join(output_path, 'sparse_plot.png'))
 
 
@@ -94,63 +99,49 @@ def main():
     plot_map = True
 
     # Parse input arguments:
-    input_path, output_path = parse_args()
+    input_path, output_path, output_format = parse_args()
     if output_path is None:
         output_path = input_path
 
-    # Connect to the database and create cursor object:
-    connection = sqlite3.connect(os.path.join(input_path, 'database.db'))
+    # Load the descriptors of all the images with a single query (or from the sidecar written at ingest time):
+    database_file = os.path.join(input_path, 'database.db')
+    connection = sqlite3.connect(database_file)
     cursor = connection.cursor()
-
-    # Get list of images (img_id, img_name):
-    cursor.execute('SELECT image_id, name FROM images;')
-    images = list(row for row in cursor)
-
-    # Get list of descriptors:
-    descriptors = get_descriptors(cursor, images)
+    table, table_offsets, table_counts = load_descriptor_table(database_file, cursor)
 
     # End SQL connection:
     cursor.close()
     connection.close()
 
-    # Get list 3D points:
-    points_3D = get_3d_points(input_path)
-
-    # Compute mean ORB descriptors for all 3D points:
-    feature_desc = []
+    # Get the 3D points and their tracks (points3D.bin, or points3D.txt if the model was written as text):
+    points = read_points3d_file(get_model_file(input_path, 'points3D'), use_cache=True)
 
-    for point in points_3D:
-        dsc = []
-        for d in range(len(point[1])):
-            img_id = point[1][d] - 1
-            pt_id = point[2][d]
-            if pt_id < len(descriptors[img_id]):
-                dsc.append(descriptors[img_id][pt_id])
-
-        if len(dsc) != 0:
-            mean_dsc = np.mean(dsc, axis=0)
-            l2_dist = np.linalg.norm(mean_dsc - dsc, axis=1)
-            feature_desc.append(np.concatenate([point[0], dsc[np.argmin(l2_dist)]]))
+    # Select the Hamming medoid ORB descriptor of all 3D points:
+    xyz, point_descriptors = select_descriptors(points.xyz, points.track_offsets, points.track_image_ids,
+                                                points.track_point2d_ids, table, table_offsets, table_counts)
 
     # Save according to RBD requirement:
-    feature_desc = np.array(feature_desc)
+    if output_format in ('csv', 'both'):
+        np.savetxt(os.path.join(output_path, 'pointData.csv'),
+                   xyz, delimiter=',')
 
-    np.savetxt(os.path.join(output_path, 'pointData.csv'),
-               feature_desc[:, :3], delimiter=',')
+        cv_file = cv2.FileStorage(os.path.join(output_path, 'descriptorsData.xml'),
+                                  cv2.FILE_STORAGE_WRITE)
 
-    if plot_map:
-        np.savetxt(os.path.join(output_path, 'sparse.xyz'),
-                   feature_desc[:, :3], delimiter=' ')
+        for p in range(len(point_descriptors)):
+            cv_file.write('desc{}'.format(p + 1), point_descriptors[p:p + 1])
 
-        plot_2d(os.path.join(output_path, 'sparse.xyz'), output_path)
+        cv_file.release()
 
-    cv_file = cv2.FileStorage(os.path.join(output_path, 'descriptorsData.xml'),
-                              cv2.FILE_STORAGE_WRITE)
+    # Header, float32 xyz block and uint8 descriptors block, loaded with orb_map.read_map:
+    if output_format in ('binary', 'both'):
+        write_map(os.path.join(output_path, MAP_FILE_NAME), xyz, point_descriptors)
 
-    for p in range(len(feature_desc)):
-        cv_file.write('desc{}'.format(p + 1), feature_desc[p:p + 1, 3:35].astype('uint8'))
+    if plot_map:
+        np.savetxt(os.path.join(output_path, 'sparse.xyz'),
+                   xyz, delimiter=' ')
 
-    cv_file.release()
+        plot_2d(xyz, output_path)
 
     print('Files were saved at ', output_path)
 
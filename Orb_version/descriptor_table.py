@@ -0,0 +1,142 @@
+import os
+import numpy as np
+
+# Size of a native ORB descriptor in bytes (tiled descriptors repeat it to fill 128 columns):
+ORB_DESCRIPTOR_SIZE = 32
+
+# Sidecar files written next to the database at ingest time: all the native descriptors in a single array, and
+# the (image_id, offset, count) of each image in it:
+DESCRIPTORS_SIDECAR_SUFFIX = '_descriptors.npy'
+INDEX_SIDECAR_SUFFIX = '_descriptors_index.npy'
+
+
+def get_sidecar_paths(database_file: str) -> tuple:
+    """
+    :param database_file: path to the database file - str
+    :return: descriptors_path, index_path: paths to the sidecar files of the database - str
+    """
+    root = os.path.splitext(database_file)[0]
+    return root + DESCRIPTORS_SIDECAR_SUFFIX, root + INDEX_SIDECAR_SUFFIX
+
+
+def to_table(image_ids: np.ndarray, counts: np.ndarray, table: np.ndarray) -> tuple:
+    """
+    Index the concatenated descriptors of the images by image_id.
+    :param image_ids: id of each image, in the table order - np.array of size (n,)
+    :param counts: number of descriptors of each image - np.array of size (n,)
+    :param table: the concatenated descriptors - np.array of size (counts.sum(),32)
+    :return: table: all the descriptors - np.array of size (total,32)
+    :return: offsets: first row of each image_id in table - np.array of size (max_image_id+1,)
+    :return: counts: number of descriptors of each image_id (0 for missing images) - np.array of size (max_image_id+1,)
+    """
+    image_ids = np.asarray(image_ids, dtype=np.int64)
+    counts = np.asarray(counts, dtype=np.int64)
+
+    max_image_id = int(image_ids.max()) if len(image_ids) > 0 else 0
+    table_offsets = np.zeros(max_image_id + 1, dtype=np.int64)
+    table_counts = np.zeros(max_image_id + 1, dtype=np.int64)
+    table_offsets[image_ids] = np.cumsum(counts) - counts
+    table_counts[image_ids] = counts
+
+    return table, table_offsets, table_counts
+
+
+def read_descriptor_table(cursor) -> tuple:
+    """
+    Read the descriptors of all the images with a single query, into one contiguous array of native descriptors.
+    :param cursor: sqlite3.connect().cursor
+    :return: (table, offsets, counts) as returned by to_table
+    """
+    cursor.execute('SELECT image_id, rows, cols, data FROM descriptors ORDER BY image_id;')
+    rows = [row for row in cursor if row[3] is not None and row[1] > 0]
+
+    image_ids = np.array([row[0] for row in rows], dtype=np.int64)
+    counts = np.array([row[1] for row in rows], dtype=np.int64)
+    columns = set(row[2] for row in rows)
+
+    if len(columns) == 1:
+        # The same width for all the images: a single buffer of all the blobs:
+        table = np.frombuffer(b''.join(row[3] for row in rows), dtype=np.uint8).reshape(-1, columns.pop())
+    else:
+        table = np.concatenate([np.frombuffer(data, dtype=np.uint8).reshape(-1, cols)[:, :ORB_DESCRIPTOR_SIZE]
+                                for _, _, cols, data in rows] + [np.zeros((0, ORB_DESCRIPTOR_SIZE), np.uint8)])
+
+    return to_table(image_ids, counts, np.ascontiguousarray(table[:, :ORB_DESCRIPTOR_SIZE]))
+
+
+def save_sidecar(database_file: str, image_ids: list, descriptors: list) -> None:
+    """
+    Write the native descriptors of all the images next to the database (temporary files first, so readers never
+    see a partial sidecar).
+    :param database_file: path to the database file - str
+    :param image_ids: id of each image - list of ints
+    :param descriptors: native descriptors of each image - list of np.arrays of size (n,32)
+    """
+    index = np.zeros((len(image_ids), 3), dtype=np.int64)
+    index[:, 0] = image_ids
+    index[:, 2] = [len(dsk) for dsk in descriptors]
+    index[:, 1] = np.cumsum(index[:, 2]) - index[:, 2]
+
+    descriptors_path, index_path = get_sidecar_paths(database_file)
+
+    # Stream the images one after the other instead of concatenating them in memory:
+    temp_path = descriptors_path + '.{}.tmp'.format(os.getpid())
+    with open(temp_path, 'wb') as file:
+        np.lib.format.write_array_header_1_0(file, {'descr': '|u1', 'fortran_order': False,
+                                                    'shape': (int(index[:, 2].sum()), ORB_DESCRIPTOR_SIZE)})
+        for dsk in descriptors:
+            file.write(np.ascontiguousarray(dsk, dtype=np.uint8).tobytes())
+    os.replace(temp_path, descriptors_path)
+
+    temp_path = index_path + '.{}.tmp'.format(os.getpid())
+    with open(temp_path, 'wb') as file:
+        np.save(file, index)
+    os.replace(temp_path, index_path)
+
+
+def remove_sidecar(database_file: str) -> None:
+    """
+    Delete the sidecar files of the database, if any (before the database is written, a sidecar of a previous run
+    would otherwise describe other descriptors with the same counts).
+    :param database_file: path to the database file - str
+    """
+    for sidecar_path in get_sidecar_paths(database_file):
+        if os.path.exists(sidecar_path):
+            os.remove(sidecar_path)
+
+
+def load_sidecar(database_file: str, cursor):
+    """
+    Memory-map the descriptors sidecar of the database, if it exists and matches the descriptors table.
+    :param database_file: path to the database file - str
+    :param cursor: sqlite3.connect().cursor, used to check the sidecar against the (image_id, rows) of the table
+    :return: (table, offsets, counts) as returned by to_table, or None if there is no valid sidecar
+    """
+    descriptors_path, index_path = get_sidecar_paths(database_file)
+    try:
+        index = np.load(index_path)
+        table = np.load(descriptors_path, mmap_mode='r')
+    except (OSError, ValueError):
+        return None
+
+    cursor.execute('SELECT image_id, rows FROM descriptors WHERE rows > 0 ORDER BY image_id;')
+    expected = np.array(list(cursor), dtype=np.int64).reshape(-1, 2)
+
+    order = np.argsort(index[:, 0], kind='stable')
+    if (table.shape != (index[:, 2].sum(), ORB_DESCRIPTOR_SIZE) or
+            not np.array_equal(index[order][index[order, 2] > 0][:, [0, 2]], expected) or
+            not np.array_equal(index[:, 1], np.cumsum(index[:, 2]) - index[:, 2])):
+        return None
+
+    return to_table(index[:, 0], index[:, 2], table)
+
+
+def load_descriptor_table(database_file: str, cursor, use_sidecar=True) -> tuple:
+    """
+    :param database_file: path to the database file - str
+    :param cursor: sqlite3.connect().cursor of the database
+    :param use_sidecar: boolean flag for memory-mapping the sidecar when it is valid
+    :return: (table, offsets, counts) as returned by to_table
+    """
+    table = load_sidecar(database_file, cursor) if use_sidecar else None
+    return table if table is not None else read_descriptor_table(cursor)
@@ -1,11 +1,37 @@
 import os
+from functools import partial
 from multiprocessing import cpu_count, Pool
-import copyreg
 import cv2
 import time
+import json
 import argparse
 import numpy as np
 import colmap_database as cdb
+import descriptor_table as dt
+import feature_matching as fm
+import frame_source as fs
+import shared_features as sf
+import two_view_geometry as tvg
+from feature_cache import FeatureCache
+from orb_features import CAMERA_MODEL, CAMERA_WIDTH, CAMERA_HEIGHT, CAMERA_PARAMS, CAMERA_MATRIX, DIST_COEFFS, \
+    ORB_DESCRIPTOR_SIZE, get_slot_capacity, detect_and_compute
+from orb_presets import PRESETS, DEFAULT_PRESET, get_preset, get_orb_params
+from streaming_pipeline import StreamingPipeline
+from vocabulary_tree import VocabularyTree, LoopClosureIndex
+
+# ORB patch size, COLMAP keypoint scale is the keypoint size relative to it:
+ORB_PATCH_SIZE = 31
+
+# Descriptors are tiled to fit COLMAP requirements, unless stored in compact mode:
+COLMAP_DESCRIPTOR_SIZE = 128
+
+# Maximal number of loop-closure candidates retrieved for each image by the vocabulary tree:
+LOOP_CANDIDATES = 5
+
+# Extraction worker state (set by the pool initializer):
+_feature_store = None
+_feature_cache = None
+_orb = None
 
 # Parser definition:
 ap = argparse.ArgumentParser()
@@ -13,149 +39,198 @@ ap.add_argument('-p', '--path', required=True,
                 help='path to input images folder')
 ap.add_argument('-d', '--db_path', type=str, default=None,
                 help='path for created database file')
+ap.add_argument('-m', '--matcher', choices=fm.MATCHER_BACKENDS, default='bf',
+                help='matcher backend: open-cv BFMatcher, NumPy Hamming-distance blocks or approximate multi-index '
+                     'hashing (mih)')
+ap.add_argument('-r', '--ratio', type=float, default=None,
+                help='ratio test threshold of the hamming and mih matchers (e.g. 0.8), disabled by default')
+ap.add_argument('-c', '--compact_descriptors', action='store_true',
+                help='store native 32 bytes ORB descriptors instead of tiling them to 128 columns')
+ap.add_argument('-s', '--stream', action='store_true',
+                help='stream features and matches to the database with bounded memory (no quadratic matching)')
+ap.add_argument('--cache_dir', type=str, default=None,
+                help='path to the feature cache folder (db_path/feature_cache by default)')
+ap.add_argument('--no_cache', action='store_true',
+                help='always extract the features, without reading or writing the feature cache')
+ap.add_argument('--preset', choices=sorted(PRESETS), default=DEFAULT_PRESET,
+                help='ORB extraction and matching preset (default: %(default)s)')
+ap.add_argument('-g', '--geometric_verification', action='store_true',
+                help='verify the matches with RANSAC and write the two_view_geometries table (COLMAP\'s '
+                     'sequential_matcher can then be skipped)')
+ap.add_argument('-l', '--loop_detection', choices=('window', 'vocabulary'), default='window',
+                help='loop-closure pairs: first window against the last images, or candidates retrieved by a '
+                     'binary bag-of-words vocabulary tree (not available with --stream)')
+ap.add_argument('--vocabulary', type=str, default=None,
+                help='path to a .npz vocabulary tree, trained on the scan and saved there if missing')
+ap.add_argument('--video', type=str, default=None,
+                help='path to the scan video (outpy.h264): its frames are taken out of it in-process instead of reading '
+                     'the JPEG images of --path (the same images, but the video is decoded a second time after '
+                     'workplace_preparation)')
+ap.add_argument('--number_of_images', type=int, default=fs.DEFAULT_NUMBER_OF_FRAMES,
+                help='number of frames taken out of --video (default: %(default)s)')
+ap.add_argument('--keyframes', action='store_true',
+                help='take only the sharp keyframes the camera moved to out of --video (as workplace_preparation '
+                     '--keyframes does)')
 
 
 def get_input_arguments() -> tuple:
     """
     Function to parse user argument
-    :return: image_path, database_path
+    :return: image_path, database_path, args (dictionary of all the other arguments)
     """
     args = vars(ap.parse_args())
+    if args['ratio'] is not None and args['matcher'] == 'bf':
+        ap.error('--ratio needs the hamming or mih matcher')
+    if args['keyframes'] and args['video'] is None:
+        ap.error('--keyframes needs --video')
+    if args['stream'] and args['loop_detection'] == 'vocabulary':
+        ap.error('--loop_detection vocabulary needs all the descriptors and is not available with --stream')
     image_path = args['path']
     database_path = args['db_path'] if args['db_path'] is not None else image_path
 
-    return image_path, database_path
+    return image_path, database_path, args
 
 
-def compute_descriptors(images: list) -> tuple:
+def _init_extraction_worker(orb_params: dict, store_spec=None, cache_dir=None) -> None:
     """
-    Computes keypoints and ORB descriptors for a list of images.
-    :param images: a list of images paths
-    :return: keypoints: detected keypoints for each image - list of opencv keypoint lists
-    :return: descriptors: computed ORB descriptors for each image - list np.arrays
-    :return: img_name_list: list of images name to enable storing in database
+    Pool initializer, creates the extraction worker ORB detector and attaches it to the shared feature store
+    and to the feature cache.
+    :param orb_params: keyword arguments for cv2.ORB_create (also part of the feature cache key) - dict
+    :param store_spec: the SharedFeatureStore spec, None when features are returned to the parent - tuple
+    :param cache_dir: path to the feature cache folder, None to disable the cache - str
     """
-    # Initiate ORB detector
-    orb = cv2.ORB_create(nfeatures=3000, scoreType=cv2.ORB_FAST_SCORE)
+    global _feature_store, _feature_cache, _orb
+    _feature_store = sf.SharedFeatureStore.attach(store_spec) if store_spec is not None else None
+    _feature_cache = FeatureCache(cache_dir, orb_params) if cache_dir is not None else None
+    _orb = cv2.ORB_create(**orb_params)
 
-    img_name_list, keypoints, descriptors = [], [], []
 
-    for file in images:
-        if file.endswith(('.jpg', '.JPG', '.png')):
-            image = cv2.imread(file)
+def get_image_name(image) -> str:
+    """
+    :param image: image path - str, or video frame - frame_source.Frame
+    :return: name: the image name in the database
+    """
+    return image.name if isinstance(image, fs.Frame) else os.path.basename(image)
 
-            if image is None:
-                continue
 
-            image_file_name = os.path.basename(file)
-            img_name_list.append(image_file_name)
+def load_or_compute(file):
+    """
+    Get the features of a single image from the feature cache, or compute (and cache) them.
+    :param file: image path - str, or video frame - frame_source.Frame
+    :return: (keypoints, descriptors, is_cached) tuple, or None if the image can't be read
+    """
+    if isinstance(file, fs.Frame):
+        data = file.data
+    else:
+        try:
+            with open(file, 'rb') as image_file:
+                data = image_file.read()
+        except OSError:
+            return None
 
-            # Detect keypoints and compute descriptors for each image:
-            keypoint, dsk = orb.detectAndCompute(image, None)
+    if _feature_cache is not None:
+        key = _feature_cache.key(data)
+        features = _feature_cache.load(key)
+        if features is not None:
+            return features + (True,)
 
-            keypoints.append(keypoint)
-            descriptors.append(np.tile(dsk, (1, 4)))  # Descriptors are tiled to fit COLMAP requirements
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        return None
 
-    return keypoints, descriptors, img_name_list
+    kp, dsk = detect_and_compute(_orb, image)
 
+    if _feature_cache is not None:
+        _feature_cache.save(key, kp, dsk)
 
-def filter_BF_matches(matches: list, threshold=45) -> list:
+    return kp, dsk, False
+
+
+def compute_descriptors(images: list) -> int:
     """
-    filter matches list and keep the best matches according to threshold
-    :param matches: a list of matches
-    :param threshold: threshold filtering
-    :return: matches_tmp: list of the best matches
+    Computes keypoints and ORB descriptors for a list of images, and writes them into the shared feature store.
+    Images that can't be read keep a count of -1 in the store.
+    :param images: a list of (slot, image path or frame_source.Frame) tuples
+    :return: cached: number of images read from the feature cache
     """
-    matches_tmp = []
-    sorted_matches = sorted(matches, key=lambda x: x.distance)
-    threshold_percent = int(len(sorted_matches) * threshold / 100)
-    for match_index in range(threshold_percent):
-        matches_tmp.append([sorted_matches[match_index].queryIdx, sorted_matches[match_index].trainIdx])
+    cached = 0
+
+    for slot, file in images:
+        features = load_or_compute(file)
+
+        if features is None:
+            continue
 
-    return matches_tmp
+        kp, dsk, is_cached = features
+        _feature_store.write(slot, kp, dsk)
+        cached += is_cached
 
+    return cached
 
-def get_matches_sequential(descriptors: list, match_window_overlap=5, do_quadratic_match=False) -> tuple:
+
+def extract_features(file):
     """
-    sequential matching according to match_window_overlap.
+    Computes keypoints and ORB descriptors for a single image (used by the streaming pipeline).
+    :param file: image path - str, or decoded grayscale frame - frame_source.Frame
+    :return: (image name, keypoints, descriptors) tuple, or None if the image can't be read
+    """
+    features = load_or_compute(file)
+    if features is None:
+        return None
+
+    kp, dsk, _ = features
+    return get_image_name(file), np.asarray(kp), np.asarray(dsk)
+
+
+def get_loop_candidates(descriptors: list, match_window_overlap: int, vocabulary_path=None) -> list:
+    """
+    Retrieve the loop-closure candidates of each image with a binary bag-of-words vocabulary tree.
     :param descriptors: a list of descriptors - list of np.arrays
-    :param match_window_overlap: the size of the match window of each image
-    :param do_quadratic_match: boolean flag for quadratic matching
-    :return: matches: matching feature ids - list np.arrays
-    :return: pair_ids: the associated image ids - list of tuples
+    :param match_window_overlap: the size of the match window (closer images are not candidates)
+    :param vocabulary_path: path to a saved vocabulary, trained on the descriptors (and saved) if missing - str
+    :return: loop_candidates: (image_idx1, image_idx2) candidate pairs - list of tuples
     """
+    if vocabulary_path is not None and os.path.exists(vocabulary_path):
+        vocabulary = VocabularyTree.load(vocabulary_path)
+    else:
+        vocabulary = VocabularyTree.train(descriptors)
+        if vocabulary_path is not None:
+            vocabulary.save(vocabulary_path)
 
-    # create BFMatcher object
-    matcher = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
-    matches, pair_ids = [], []
-    number_of_descriptors = len(descriptors)
-    for image_idx1 in range(number_of_descriptors):
-        for window in range(1, match_window_overlap):
-            image_idx2 = image_idx1 + window
-
-            # Check for overlap
-            if image_idx2 >= number_of_descriptors:
-                break
-
-            # Match current images pair descriptors:
-            current_matches = matcher.match(descriptors[image_idx1], descriptors[image_idx2])
-            current_matches = filter_BF_matches(current_matches)
-
-            # Add current pair ids and fine matches:
-            matches.append(np.array(current_matches))
-            pair_ids.append((image_idx1 + 1, image_idx2 + 1))
-
-            if do_quadratic_match:
-                image_idx2_quadratic = image_idx1 + (1 << (window - 1))
-                # Check for quadratic overlap
-                if (image_idx2_quadratic > image_idx1 + match_window_overlap) and (
-                        image_idx2_quadratic < number_of_descriptors):
-                    # Match current images pair descriptors:
-                    current_matches = matcher.match(descriptors[image_idx1], descriptors[image_idx2_quadratic])
-                    current_matches = filter_BF_matches(current_matches, 30)
-
-                    # Add current pair ids and fine matches:
-                    matches.append(np.array(current_matches))
-                    pair_ids.append((image_idx1 + 1, image_idx2_quadratic + 1))
-
-    # loop detection
-    for image_idx1 in range(match_window_overlap):
-        image_idx2 = number_of_descriptors + image_idx1 - match_window_overlap
-
-        for loop_closer_image_idx in range(image_idx2, match_window_overlap):
-            if (image_idx1 + 1, loop_closer_image_idx + 1) in pair_ids:
-                continue
-
-            # Match current images pair descriptors:
-            current_matches = matcher.match(descriptors[image_idx1], descriptors[image_idx2])
-            current_matches = filter_BF_matches(current_matches)
-
-            # Add current pair ids and fine matches:
-            matches.append(np.array(current_matches))
-            pair_ids.append((image_idx1 + 1, image_idx2 + 1))
+    index = LoopClosureIndex(vocabulary)
+    for image_descriptors in descriptors:
+        index.add(image_descriptors)
 
-    return matches, pair_ids
+    loop_candidates = index.candidates(LOOP_CANDIDATES, min_gap=match_window_overlap)
+    print('Retrieved %d loop-closure candidates (%d words)' % (len(loop_candidates), vocabulary.number_of_words))
+
+    return loop_candidates
 
 
-def patch_Keypoint_pickling() -> None:
+def get_matches_sequential(descriptors: list, match_window_overlap=5, do_quadratic_match=False,
+                           matcher='bf', processes=1, filter_ratio=45, quadratic_filter_ratio=30,
+                           loop_candidates=None, ratio=None) -> tuple:
     """
-    Allows multi-processing with open-cv's Keypoints, by making them pickle-able.
-    Creates the bundling between class and arguments.
+    sequential matching according to match_window_overlap.
+    :param descriptors: a list of descriptors - list of np.arrays
+    :param match_window_overlap: the size of the match window of each image
+    :param do_quadratic_match: boolean flag for quadratic matching
+    :param matcher: matcher backend, 'bf' (open-cv BFMatcher), 'hamming' (NumPy popcount blocks) or 'mih'
+                    (multi-index hashing)
+    :param processes: number of matching processes
+    :param filter_ratio: percent of the best matches kept for each sequential pair
+    :param quadratic_filter_ratio: percent of the best matches kept for each quadratic pair
+    :param loop_candidates: loop-closure pairs to verify, None for the fixed first/last window pairs
+    :param ratio: ratio test threshold of the hamming and mih matchers, None to disable
+    :return: matches: matching feature ids - list np.arrays
+    :return: pair_ids: the associated image ids - list of tuples
     """
+    matches, pair_ids, pairs_per_sec = fm.match_sequential(descriptors, match_window_overlap, do_quadratic_match,
+                                                           matcher, processes, filter_ratio,
+                                                           quadratic_filter_ratio, loop_candidates, ratio)
+    print('Matched %d pairs (%.2f pairs/sec)' % (len(pair_ids), pairs_per_sec))
 
-    def _pickle_keypoint(keypoint):  # cv2.KeyPoint
-        return cv2.KeyPoint, (
-            keypoint.pt[0],
-            keypoint.pt[1],
-            keypoint.size,
-            keypoint.angle,
-            keypoint.response,
-            keypoint.octave,
-            keypoint.class_id,
-        )
-
-    # Apply the bundling to pickle:
-    copyreg.pickle(cv2.KeyPoint().__class__, _pickle_keypoint)
+    return matches, pair_ids
 
 
 def chunk(in_list: list, num_item: int) -> list:
@@ -173,14 +248,14 @@ def chunk(in_list: list, num_item: int) -> list:
 
 def update_camera_pose_file(workspace_path: str, images_id_in_db: dict) -> None:
     """
-    update the images.txt file according to the image table in workspace DB
+    update the images.txt file according to the image table in workspace DB, the poses of images that are not in
+    the DB (dropped keyframes or unreadable images) are removed
     :param workspace_path:  path to workspace folder
     :param images_id_in_db: dictionary of all the images and there indexes in DB
-    :return: separate sub-item lists
     """
     camera_pose_path = os.path.join(workspace_path, 'camera_poses/images.txt')
     if os.path.exists(camera_pose_path):
-        val_list = list(images_id_in_db.values())
+        ids_by_name = {name: image_id for image_id, name in images_id_in_db.items()}
 
         # read image.txt file
         f = open(camera_pose_path, "r")
@@ -191,26 +266,152 @@ def update_camera_pose_file(workspace_path: str, images_id_in_db: dict) -> None:
         with open(camera_pose_path, 'w') as file:
             for line in lines:
                 data = line.split()
-                data[0] = str(val_list.index(data[9]) + 1)
+                if data[9] not in ids_by_name:
+                    continue
+                data[0] = str(ids_by_name[data[9]])
                 file.write(' '.join(data) + '\n\n')
 
 
+def to_colmap_features(keypoints: np.ndarray, descriptors: np.ndarray, compact=False) -> tuple:
+    """
+    Converts extracted features to the COLMAP database format.
+    :param keypoints: (x, y, size, angle) of each keypoint - np.array of size (n,4)
+    :param descriptors: native ORB descriptors - np.array of size (n,32)
+    :param compact: boolean flag for storing the native descriptors instead of tiling them
+    :return: keypoints: (x, y, scale, angle) of each keypoint - np.array of size (n,4)
+    :return: descriptors: descriptors of size (n,32) in compact mode, (n,128) otherwise - np.array
+    """
+    tile = 1 if compact else COLMAP_DESCRIPTOR_SIZE // ORB_DESCRIPTOR_SIZE
+    return keypoints / np.array([1, 1, ORB_PATCH_SIZE, 1]), np.tile(descriptors, (1, tile))
+
+
+def verify_pair(keypoints1: np.ndarray, keypoints2: np.ndarray, matches: np.ndarray):
+    """
+    Geometric verification of a single pair with the camera intrinsics (used by the streaming pipeline).
+    :param keypoints1: (x, y, size, angle) of each keypoint of the first image - np.array of size (n,4)
+    :param keypoints2: (x, y, size, angle) of each keypoint of the second image - np.array of size (m,4)
+    :param matches: matching feature ids - np.array of size (k,2)
+    :return: (inlier_matches, F, config) tuple, or None if the pair is not verified
+    """
+    return tvg.verify_pair(tvg.normalize_points(keypoints1, CAMERA_MATRIX, DIST_COEFFS),
+                           tvg.normalize_points(keypoints2, CAMERA_MATRIX, DIST_COEFFS), matches, CAMERA_MATRIX)
+
+
+def get_cache_dir(database_path: str, args: dict):
+    """
+    :param database_path: path to workspace folder
+    :param args: dictionary of the input arguments
+    :return: path to the feature cache folder, or None if the cache is disabled
+    """
+    if args['no_cache']:
+        return None
+    return args['cache_dir'] if args['cache_dir'] is not None else os.path.join(database_path, 'feature_cache')
+
+
+def stream_to_database(images: list, database_path: str, args: dict, preset: dict, processes: int) -> tuple:
+    """
+    Extract, match and write the images to the database with the bounded memory streaming pipeline.
+    :param images: a list of images paths
+    :param database_path: path to workspace folder
+    :param args: dictionary of the input arguments
+    :param preset: extraction and matching preset parameters - dict
+    :param processes: number of extraction processes
+    :return: images_id_in_db: dictionary of all the images and there indexes in DB
+    :return: counts: number of features, pairs, matches and verified pairs written to the database - dict
+    """
+    pipeline = StreamingPipeline(os.path.join(database_path, 'database.db'), extract_features,
+                                 partial(to_colmap_features, compact=args['compact_descriptors']),
+                                 (CAMERA_MODEL, CAMERA_WIDTH, CAMERA_HEIGHT, CAMERA_PARAMS),
+                                 preset['match_window_overlap'], args['matcher'], processes,
+                                 initializer=_init_extraction_worker,
+                                 initargs=(get_orb_params(preset), None, get_cache_dir(database_path, args)),
+                                 filter_ratio=preset['filter_ratio'], ratio=args['ratio'],
+                                 verify=verify_pair if args['geometric_verification'] else None)
+    images_id_in_db, pair_ids = pipeline.run(images)
+    print('Matched %d pairs, inserted %d rows' % (len(pair_ids), pipeline.rows))
+
+    return images_id_in_db, {'features': pipeline.features, 'pairs': len(pair_ids), 'matches': pipeline.matches,
+                             'verified_pairs': pipeline.verified_pairs}
+
+
+def write_report(database_path: str, args: dict, preset: dict, timings: dict, **counts) -> None:
+    """
+    Append a machine-readable record of the run to sfm_report.jsonl (next to sfm_log.txt), one JSON object per run.
+    :param database_path: path to workspace folder
+    :param args: dictionary of the input arguments
+    :param preset: extraction and matching preset parameters - dict
+    :param timings: elapsed time of each stage in seconds - dict
+    :param counts: images, features, pairs, matches and cached images counts of the run
+    """
+    record = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'preset': args['preset'],
+              'params': preset,
+              'matcher': args['matcher'],
+              'ratio': args['ratio'],
+              'loop_detection': args['loop_detection'],
+              'geometric_verification': args['geometric_verification'],
+              'stream': args['stream'],
+              'compact_descriptors': args['compact_descriptors'],
+              'timings': {stage: round(seconds, 4) for stage, seconds in timings.items()},
+              'total_time': round(sum(timings.values()), 4)}
+    record.update(counts)
+    record['mean_features'] = round(counts['features'] / counts['images'], 2) if counts['images'] else 0.0
+
+    with open(os.path.join(database_path, 'sfm_report.jsonl'), 'a') as file:
+        file.write(json.dumps(record) + '\n')
+
+
 def main():
     ##########################################################
     # Initialize script
     ##########################################################
-    image_path, database_path = get_input_arguments()
-    images = [os.path.join(image_path, file) for file in sorted(os.listdir(image_path))]
-
-    # Patch open-cv's keypoint class:
-    patch_Keypoint_pickling()
+    image_path, database_path, args = get_input_arguments()
+    preset = get_preset(args['preset'])
+
+    # The descriptors sidecar of a previous run doesn't describe the database written now (only the batch path
+    # writes a new one):
+    dt.remove_sidecar(os.path.join(database_path, 'database.db'))
+    if args['video'] is not None:
+        # Color frames, the same JPEG data as the images written by workplace_preparation (and the same feature
+        # cache entries):
+        images = fs.extract_frames(args['video'], args['number_of_images'], grayscale=False,
+                                   keyframes=args['keyframes'])
+    else:
+        images = [os.path.join(image_path, file) for file in sorted(os.listdir(image_path))
+                  if file.endswith(('.jpg', '.JPG', '.png'))]
 
     # Get number of available processes and number of images per process:
     cpu_num = cpu_count()
     img_per_process = int(np.ceil(len(images) / float(cpu_num)))
 
+    if args['stream']:
+        print('\n==============================================================================')
+        print('Streaming feature extraction, matching and database preparation')
+        print('==============================================================================\n')
+        start = time.time()
+
+        images_id_in_db, counts = stream_to_database(images, database_path, args, preset, cpu_num)
+
+        # update camera_pose with id's from DB
+        update_camera_pose_file(database_path, images_id_in_db)
+
+        end = time.time()
+        fs_time = (end - start)
+        print('Elapsed time: %.2f [seconds]' % fs_time)
+
+        # Create log file:
+        with open(os.path.join(database_path, 'sfm_log.txt'), "a") as file:
+            file.write('streaming extraction, matching and database preparation [sec]: %.2f\n' % fs_time)
+        write_report(database_path, args, preset, {'streaming': fs_time}, images=len(images_id_in_db),
+                     cached=None, **counts)
+        return
+
+    # Workers write keypoints and descriptors straight into shared memory:
+    store = sf.SharedFeatureStore(len(images), get_slot_capacity(preset['nfeatures']), ORB_DESCRIPTOR_SIZE)
+
     # Initialize a Pool object:
-    pool = Pool(processes=cpu_num)
+    pool = Pool(processes=cpu_num, initializer=_init_extraction_worker,
+                initargs=(get_orb_params(preset), store.spec, get_cache_dir(database_path, args)))
 
     print('\n==============================================================================')
     print('Feature extraction')
@@ -218,11 +419,17 @@ def main():
     start = time.time()
 
     # compute descriptors with multiprocessing
-    chunked_images = list(chunk(images, img_per_process))
-    temp = pool.map(compute_descriptors, chunked_images)
-    keypoints = [item for sublist in temp for item in sublist[0]]
-    descriptors = [item for sublist in temp for item in sublist[1]]
-    names = [item for sublist in temp for item in sublist[2]]
+    chunked_images = list(chunk(list(enumerate(images)), img_per_process))
+    cached = sum(pool.map(compute_descriptors, chunked_images))
+    pool.close()
+    store.unlink()
+    print('%d of %d images read from the feature cache' % (cached, len(images)))
+
+    # Read the features of all the valid images as views of the shared memory:
+    slots = [slot for slot in range(len(images)) if store.counts[slot] >= 0]
+    keypoints = [store.keypoints(slot) for slot in slots]
+    descriptors = [store.descriptors(slot) for slot in slots]
+    names = [get_image_name(images[slot]) for slot in slots]
 
     end = time.time()
     fe_time = (end - start)
@@ -234,13 +441,37 @@ def main():
 
     start = time.time()
 
+    # Loop-closure candidates from the vocabulary tree (None keeps the fixed first/last window pairs):
+    loop_candidates = None
+    if args['loop_detection'] == 'vocabulary':
+        loop_candidates = get_loop_candidates(descriptors, preset['match_window_overlap'], args['vocabulary'])
+
     # get matches with multiprocessing
-    matches, pair_ids = get_matches_sequential(descriptors, 10, True)
+    matches, pair_ids = get_matches_sequential(descriptors, preset['match_window_overlap'],
+                                               preset['do_quadratic_match'], args['matcher'], cpu_num,
+                                               preset['filter_ratio'], preset['quadratic_filter_ratio'],
+                                               loop_candidates, args['ratio'])
 
     end = time.time()
     fm_time = (end - start)
     print('Elapsed time: %.2f [seconds]' % fm_time)
 
+    timings = {'feature_extraction': fe_time, 'feature_matching': fm_time}
+    two_view_geometries = []
+
+    if args['geometric_verification']:
+        print('\n==============================================================================')
+        print('Geometric verification')
+        print('==============================================================================\n')
+        start = time.time()
+
+        two_view_geometries = tvg.verify_pairs(keypoints, matches, pair_ids, CAMERA_MATRIX, DIST_COEFFS, cpu_num)
+        print('Verified %d of %d pairs' % (len(two_view_geometries), len(pair_ids)))
+
+        end = time.time()
+        timings['geometric_verification'] = gv_time = (end - start)
+        print('Elapsed time: %.2f [seconds]' % gv_time)
+
     ##########################################################
     # Import to COLMAP format:
     ##########################################################
@@ -249,57 +480,45 @@ def main():
     # Open the SQL database:
     db = cdb.COLMAPDatabase.connect(os.path.join(database_path, 'database.db'))
 
-    # Create all tables upfront:
+    # Tune the connection for a single bulk load and create all tables upfront:
+    db.set_bulk_pragmas()
     db.create_tables()
 
-    """
-    camera matrix:
-        [505.61918164   0.         314.90808858]
-        [  0.         506.35795295 233.38488026]
-        [  0.           0.           1.        ]
-        
-    distortion coefficients:  
-        [ 0.10637077  0.41155632 -0.00463533 -0.00815625 -2.5849433 ]
-        
-        https://docs.opencv.org/2.4/modules/calib3d/doc/camera_calibration_and_3d_reconstruction.html
-    """
-    fx = 505.61918164
-    fy = 506.35795295
-    cx = 314.90808858
-    cy = 233.38488026
-    k1 = 0.10637077
-    k2 = 0.41155632
-    p1 = -0.00463533
-    p2 = -0.00815625
-
-    # Add a single camera model for all images (for model=4, parameters are (fx, fy, cx, cy, k1, k2, p1, p2)):
-    camera_id = db.add_camera(model=4, width=640, height=480,
-                              params=np.array((fx, fy, cx, cy, k1, k2, p1, p2)))
-
-    # Add images to database:
-    images_id_in_db = {}
-    for i, image_name in enumerate(names):
-        exec('image_id{} = db.add_image(image_name, camera_id)'.format(i + 1))
-        images_id_in_db[i + 1] = image_name
+    # A single camera model for all images, inserted with them (the cameras table of a previous run is kept):
+    camera_id = db.execute('SELECT IFNULL(MAX(camera_id), 0) + 1 FROM cameras').fetchone()[0]
+    db_cameras = [(CAMERA_MODEL, CAMERA_WIDTH, CAMERA_HEIGHT, CAMERA_PARAMS, False, camera_id)]
+
+    # Images get consecutive ids in the database:
+    images_id_in_db = {i + 1: image_name for i, image_name in enumerate(names)}
+    db_images = [(image_name, camera_id, np.zeros(4), np.zeros(3), image_id)
+                 for image_id, image_name in images_id_in_db.items()]
 
     # update camera_pose with id's from DB
     update_camera_pose_file(database_path, images_id_in_db)
 
-    # Add keypoints and descriptors to database:
-    for i, image_name in enumerate(names):
-        kp = np.array([[k.pt[0], k.pt[1], k.size / 31, k.angle] for k in keypoints[i]])
-        exec('db.add_keypoints(image_id{}, kp)'.format(i + 1))
-        exec('db.add_descriptors(image_id{}, descriptors[{}])'.format(i + 1, i))
+    # Keypoints, descriptors and matches rows are generated while they are inserted:
+    db_features = [to_colmap_features(keypoints[i], descriptors[i], args['compact_descriptors'])
+                   for i in range(len(names))]
+    db_keypoints = ((i + 1, db_features[i][0]) for i in range(len(names)))
+    db_descriptors = ((i + 1, db_features[i][1]) for i in range(len(names)))
+    db_matches = ((pair_ids[p][0], pair_ids[p][1], matches[p]) for p in range(len(pair_ids)) if len(matches[p]) > 0)
 
-    # Add each pair's matches to database:
-    for p in range(len(pair_ids)):
-        if len(matches[p]) > 0:
-            exec('db.add_matches(image_id{}, image_id{}, matches[p])'.format(pair_ids[p][0], pair_ids[p][1]))
+    rows, rows_per_sec = db.bulk_ingest(db_cameras, db_images, db_keypoints, db_descriptors, db_matches,
+                                        two_view_geometries)
+    print('Inserted %d rows (%.2f rows/sec)' % (rows, rows_per_sec))
 
     # Commit and cleanup the data to the file:
     db.commit()
     db.close()
 
+    # Native descriptors sidecar, memory-mapped by db_conversion instead of reading the descriptors table:
+    dt.save_sidecar(os.path.join(database_path, 'database.db'), list(images_id_in_db), descriptors)
+
+    # Release the shared memory views before closing it:
+    number_of_features = int(store.counts[slots].sum()) if slots else 0
+    del keypoints, descriptors
+    store.close()
+
     end = time.time()
     fd_time = (end - start)
 
@@ -307,7 +526,13 @@ def main():
     with open(os.path.join(database_path, 'sfm_log.txt'), "a") as file:
         file.write('feature extraction [sec]: %.2f\n' % fe_time)
         file.write('feature matching   [sec]: %.2f\n' % fm_time)
+        if args['geometric_verification']:
+            file.write('geometric verification [sec]: %.2f\n' % gv_time)
         file.write('database preparation   [sec]: %.2f\n' % fd_time)
+    timings['database_preparation'] = fd_time
+    write_report(database_path, args, preset, timings, images=len(names), features=number_of_features,
+                 pairs=len(pair_ids), matches=int(sum(len(m) for m in matches)),
+                 verified_pairs=len(two_view_geometries), cached=cached)
 
 
 if __name__ == "__main__":
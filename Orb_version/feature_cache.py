@@ -0,0 +1,68 @@
+import os
+import hashlib
+import numpy as np
+
+# Bump when the extraction output changes for the same image and parameters:
+CACHE_VERSION = 1
+
+# One record for each feature, so a cached image is a single memory-mappable .npy file:
+FEATURE_DTYPE = np.dtype([('keypoint', np.float32, (4,)), ('descriptor', np.uint8, (32,))])
+
+
+class FeatureCache(object):
+    """
+    On-disk cache of extracted ORB features, keyed by the image content hash and the ORB parameters.
+    Each image is stored as a .npy shard of FEATURE_DTYPE records that is loaded as a memory map.
+    """
+
+    def __init__(self, cache_dir, orb_params):
+        """
+        :param cache_dir: path to the cache folder (created if missing) - str
+        :param orb_params: the parameters the ORB detector is created with - dict
+        """
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+        params = ' '.join('{}={}'.format(name, orb_params[name]) for name in sorted(orb_params))
+        self._salt = 'v{} {}'.format(CACHE_VERSION, params).encode()
+
+    def key(self, image_data: bytes) -> str:
+        """
+        :param image_data: the content of the image file - bytes
+        :return: key: the cache key of the image - str
+        """
+        return hashlib.sha1(self._salt + image_data).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + '.npy')
+
+    def load(self, key: str):
+        """
+        :param key: the cache key of the image - str
+        :return: (keypoints, descriptors) as views of the memory-mapped shard, or None if the image is not cached
+        """
+        try:
+            features = np.load(self._path(key), mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+
+        if features.dtype != FEATURE_DTYPE:
+            return None
+
+        return features['keypoint'], features['descriptor']
+
+    def save(self, key: str, keypoints: np.ndarray, descriptors: np.ndarray) -> None:
+        """
+        Store the features of an image (written to a temporary file first, so readers never see a partial shard).
+        :param key: the cache key of the image - str
+        :param keypoints: (x, y, size, angle) of each keypoint - np.array of size (n,4)
+        :param descriptors: native ORB descriptors - np.array of size (n,32)
+        """
+        features = np.empty(len(keypoints), dtype=FEATURE_DTYPE)
+        features['keypoint'] = keypoints
+        features['descriptor'] = descriptors
+
+        temp_path = self._path(key) + '.{}.tmp'.format(os.getpid())
+        with open(temp_path, 'wb') as file:
+            np.save(file, features)
+        os.replace(temp_path, self._path(key))
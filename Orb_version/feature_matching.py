@@ -0,0 +1,371 @@
+import time
+from functools import partial
+from multiprocessing import Pool
+import cv2
+import numpy as np
+
+# Number of set bits for every possible byte value (used when descriptors can't be viewed as 64 bit words):
+POPCOUNT_TABLE = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+# Masks for the 64 bit SWAR popcount:
+_M1 = np.uint64(0x5555555555555555)
+_M2 = np.uint64(0x3333333333333333)
+_M4 = np.uint64(0x0f0f0f0f0f0f0f0f)
+_H01 = np.uint64(0x0101010101010101)
+
+# Number of query descriptors compared against all the train descriptors in a single NumPy block:
+HAMMING_BLOCK_SIZE = 64
+
+# Multi-index hashing: descriptors are split into 16 bit substrings, a train descriptor is a candidate neighbour of
+# a query descriptor if one of their substrings is within MIH_PROBE_RADIUS bits:
+MIH_SUBSTRING_BITS = 16
+MIH_PROBE_RADIUS = 0
+
+MATCHER_BACKENDS = ('bf', 'hamming', 'mih')
+
+# Descriptors shared with the matching workers (set by the pool initializer):
+_worker_descriptors = None
+_worker_match = None
+
+
+def get_sequential_pairs(number_of_images: int, match_window_overlap=5, do_quadratic_match=False,
+                         filter_ratio=45, quadratic_filter_ratio=30, loop_candidates=None) -> list:
+    """
+    Build the full list of image pairs to match, according to the sequential matching scheme.
+    :param number_of_images: number of images to match - int
+    :param match_window_overlap: the size of the match window of each image - int
+    :param do_quadratic_match: boolean flag for quadratic matching
+    :param filter_ratio: percent of the best matches kept for sequential (and loop) pairs - int
+    :param quadratic_filter_ratio: percent of the best matches kept for quadratic pairs - int
+    :param loop_candidates: (image_idx1, image_idx2) loop-closure pairs to verify (e.g. retrieved by a
+                            vocabulary_tree.LoopClosureIndex), None to match the first window with the last images
+    :return: pairs: list of (image_idx1, image_idx2, threshold) tuples (0-based image indexes)
+    """
+    pairs, pair_ids = [], set()
+
+    for image_idx1 in range(number_of_images):
+        for window in range(1, match_window_overlap):
+            image_idx2 = image_idx1 + window
+
+            # Check for overlap
+            if image_idx2 >= number_of_images:
+                break
+
+            pairs.append((image_idx1, image_idx2, filter_ratio))
+            pair_ids.add((image_idx1, image_idx2))
+
+            if do_quadratic_match:
+                image_idx2_quadratic = image_idx1 + (1 << (window - 1))
+                # Check for quadratic overlap
+                if (image_idx2_quadratic > image_idx1 + match_window_overlap) and (
+                        image_idx2_quadratic < number_of_images):
+                    pairs.append((image_idx1, image_idx2_quadratic, quadratic_filter_ratio))
+                    pair_ids.add((image_idx1, image_idx2_quadratic))
+
+    # loop detection
+    if loop_candidates is None:
+        loop_candidates = []
+        for image_idx1 in range(min(match_window_overlap, number_of_images)):
+            image_idx2 = number_of_images + image_idx1 - match_window_overlap
+            for loop_closer_image_idx in range(max(image_idx2, image_idx1 + 1), number_of_images):
+                loop_candidates.append((image_idx1, loop_closer_image_idx))
+
+    for image_idx1, image_idx2 in loop_candidates:
+        if (image_idx1, image_idx2) in pair_ids:
+            continue
+
+        pairs.append((image_idx1, image_idx2, filter_ratio))
+        pair_ids.add((image_idx1, image_idx2))
+
+    return pairs
+
+
+def popcount64(words: np.ndarray) -> np.ndarray:
+    """
+    Counts the set bits of every 64 bit word (in place SWAR popcount, or numpy's bitwise_count when available).
+    :param words: array of words - np.array of uint64
+    :return: bit counts for each word - np.array
+    """
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words)
+
+    words -= (words >> np.uint64(1)) & _M1
+    words = (words & _M2) + ((words >> np.uint64(2)) & _M2)
+    words += words >> np.uint64(4)
+    words &= _M4
+    words *= _H01
+    words >>= np.uint64(56)
+    return words
+
+
+def hamming_distance(descriptors1: np.ndarray, descriptors2: np.ndarray) -> np.ndarray:
+    """
+    Computes the Hamming distance between every pair of binary descriptors, block by block.
+    :param descriptors1: packed binary descriptors of size (n,d) - np.array of uint8
+    :param descriptors2: packed binary descriptors of size (m,d) - np.array of uint8
+    :return: distances: Hamming distances of size (n,m) - np.array of uint16
+    """
+    descriptors1 = np.ascontiguousarray(descriptors1, dtype=np.uint8)
+    descriptors2 = np.ascontiguousarray(descriptors2, dtype=np.uint8)
+    distances = np.empty((len(descriptors1), len(descriptors2)), dtype=np.uint16)
+
+    # Compare 64 bits at a time when the descriptor length allows it (32 byte ORB descriptors are 4 words):
+    if descriptors1.shape[1] % 8 == 0:
+        descriptors1 = descriptors1.view(np.uint64)
+        descriptors2 = descriptors2.view(np.uint64)
+
+    for start in range(0, len(descriptors1), HAMMING_BLOCK_SIZE):
+        block = descriptors1[start:start + HAMMING_BLOCK_SIZE]
+        xor = np.bitwise_xor(block[:, None, :], descriptors2[None, :, :])
+        if xor.dtype == np.uint64:
+            bits = popcount64(xor)
+        else:
+            bits = POPCOUNT_TABLE[xor]
+        distances[start:start + len(block)] = bits.sum(axis=2, dtype=np.uint16)
+
+    return distances
+
+
+def match_hamming(descriptors1: np.ndarray, descriptors2: np.ndarray, ratio=None) -> tuple:
+    """
+    Brute force cross-checked matching using the NumPy Hamming distance (same result as BFMatcher with crossCheck).
+    :param descriptors1: query descriptors - np.array
+    :param descriptors2: train descriptors - np.array
+    :param ratio: ratio test, keep a match only if its distance is below ratio times the second best distance
+                  of the query, None to disable - float
+    :return: query_idx, train_idx, distance: the cross-checked matches ordered by query index - np.arrays
+    """
+    if len(descriptors1) == 0 or len(descriptors2) == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty
+
+    distances = hamming_distance(descriptors1, descriptors2)
+    best_train = np.argmin(distances, axis=1)
+    best_query = np.argmin(distances, axis=0)
+
+    # Keep only the mutual nearest neighbours:
+    query_idx = np.flatnonzero(best_query[best_train] == np.arange(len(descriptors1)))
+    train_idx = best_train[query_idx]
+    distance = distances[query_idx, train_idx]
+
+    if ratio is not None and distances.shape[1] > 1:
+        second = np.partition(distances[query_idx], 1, axis=1)[:, 1]
+        passed = distance < ratio * second
+        query_idx, train_idx, distance = query_idx[passed], train_idx[passed], distance[passed]
+
+    return query_idx, train_idx, distance
+
+
+def _substrings(descriptors: np.ndarray) -> np.ndarray:
+    """
+    :param descriptors: packed binary descriptors of size (n,d) - np.array of uint8
+    :return: the MIH_SUBSTRING_BITS substrings of each descriptor, size (n,d*8/MIH_SUBSTRING_BITS) - np.array
+    """
+    return np.ascontiguousarray(descriptors, dtype=np.uint8).view(np.uint16)
+
+
+def mih_candidates(descriptors1: np.ndarray, descriptors2: np.ndarray, probe_radius=MIH_PROBE_RADIUS) -> tuple:
+    """
+    Multi-index hashing candidate search: for each substring position, the train descriptors are bucketed by their
+    substring (a direct table of all the 2**16 values) and every query substring, and its variants within
+    probe_radius bits, is looked up in the table.
+    Descriptors closer than (probe_radius + 1) * number_of_substrings bits are always candidates.
+    :param descriptors1: query descriptors - np.array of uint8
+    :param descriptors2: train descriptors - np.array of uint8
+    :param probe_radius: number of flipped bits probed in each query substring (0 or 1) - int
+    :return: query_idx, train_idx: the unique candidate pairs - np.arrays
+    """
+    substrings1, substrings2 = _substrings(descriptors1), _substrings(descriptors2)
+    flips = [np.uint16(0)] + [np.uint16(1 << bit) for bit in range(MIH_SUBSTRING_BITS)] * (probe_radius > 0)
+    query_idx, train_idx = [], []
+
+    for position in range(substrings1.shape[1]):
+        order = np.argsort(substrings2[:, position], kind='stable')
+        bucket_sizes = np.bincount(substrings2[:, position], minlength=1 << MIH_SUBSTRING_BITS)
+        bucket_starts = np.cumsum(bucket_sizes) - bucket_sizes
+
+        for flip in flips:
+            keys = substrings1[:, position] ^ flip
+            starts = bucket_starts[keys]
+            lengths = bucket_sizes[keys]
+
+            # Expand each query key to its bucket of train descriptors:
+            first = np.cumsum(lengths) - lengths
+            query_idx.append(np.repeat(np.arange(len(keys)), lengths))
+            train_idx.append(order[np.repeat(starts - first, lengths) + np.arange(lengths.sum())])
+
+    codes = np.unique(np.concatenate(query_idx) * len(descriptors2) + np.concatenate(train_idx))
+    return codes // len(descriptors2), codes % len(descriptors2)
+
+
+def match_mih(descriptors1: np.ndarray, descriptors2: np.ndarray, ratio=None, probe_radius=MIH_PROBE_RADIUS) -> tuple:
+    """
+    Approximate cross-checked matching: exact Hamming distances are computed only for the multi-index hashing
+    candidates, neighbours without a close enough substring are missed.
+    :param descriptors1: query descriptors - np.array
+    :param descriptors2: train descriptors - np.array
+    :param ratio: ratio test over the candidates of each query, None to disable - float
+    :param probe_radius: number of flipped bits probed in each query substring (0 or 1) - int
+    :return: query_idx, train_idx, distance: the cross-checked matches ordered by query index - np.arrays
+    """
+    if len(descriptors1) == 0 or len(descriptors2) == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty
+
+    query_idx, train_idx = mih_candidates(descriptors1, descriptors2, probe_radius)
+    words1 = np.ascontiguousarray(descriptors1, dtype=np.uint8).view(np.uint64)
+    words2 = np.ascontiguousarray(descriptors2, dtype=np.uint8).view(np.uint64)
+    distance = popcount64(words1[query_idx] ^ words2[train_idx]).sum(axis=1, dtype=np.uint16)
+
+    # Nearest candidate of each query and of each train descriptor (lowest index on ties, as BFMatcher):
+    by_query = np.lexsort((train_idx, distance, query_idx))
+    query_first = np.ones(len(by_query), dtype=bool)
+    query_first[1:] = query_idx[by_query[1:]] != query_idx[by_query[:-1]]
+    best = by_query[query_first]
+
+    by_train = np.lexsort((query_idx, distance, train_idx))
+    train_first = np.ones(len(by_train), dtype=bool)
+    train_first[1:] = train_idx[by_train[1:]] != train_idx[by_train[:-1]]
+    best_query = np.full(len(descriptors2), -1, dtype=np.int64)
+    best_query[train_idx[by_train[train_first]]] = query_idx[by_train[train_first]]
+
+    # Keep only the mutual nearest neighbours:
+    mutual = best[best_query[train_idx[best]] == query_idx[best]]
+
+    if ratio is not None:
+        # The second candidate of a query follows its best one in by_query order:
+        group_starts = np.flatnonzero(query_first)
+        has_second = np.diff(np.append(group_starts, len(by_query))) > 1
+        second = np.full(len(descriptors1), np.inf)
+        second[query_idx[best[has_second]]] = distance[by_query[group_starts[has_second] + 1]]
+        mutual = mutual[distance[mutual] < ratio * second[query_idx[mutual]]]
+
+    return query_idx[mutual], train_idx[mutual], distance[mutual]
+
+
+def match_bf(descriptors1: np.ndarray, descriptors2: np.ndarray, ratio=None) -> tuple:
+    """
+    Brute force cross-checked matching using open-cv's BFMatcher.
+    :param descriptors1: query descriptors - np.array
+    :param descriptors2: train descriptors - np.array
+    :param ratio: not supported, BFMatcher cross-check returns a single neighbour - None
+    :return: query_idx, train_idx, distance: the cross-checked matches ordered by query index - np.arrays
+    """
+    if ratio is not None:
+        raise ValueError('The ratio test needs the hamming or mih matcher backend')
+
+    matcher = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
+    matches = matcher.match(descriptors1, descriptors2)
+
+    query_idx = np.array([match.queryIdx for match in matches], dtype=np.int64)
+    train_idx = np.array([match.trainIdx for match in matches], dtype=np.int64)
+    distance = np.array([match.distance for match in matches], dtype=np.float32)
+
+    return query_idx, train_idx, distance
+
+
+def filter_matches(query_idx: np.ndarray, train_idx: np.ndarray, distance: np.ndarray, threshold=45) -> np.ndarray:
+    """
+    keep the best matches according to threshold (stable sort by distance, as BFMatcher results were sorted)
+    :param query_idx: query feature ids - np.array
+    :param train_idx: train feature ids - np.array
+    :param distance: match distances - np.array
+    :param threshold: threshold filtering (percent of matches to keep)
+    :return: matches: array of the best matches of size (n,2) - np.array
+    """
+    threshold_percent = int(len(distance) * threshold / 100)
+    best = np.argsort(distance, kind='stable')[:threshold_percent]
+
+    return np.column_stack((query_idx[best], train_idx[best]))
+
+
+def get_match_function(backend='bf', ratio=None):
+    """
+    :param backend: matcher backend out of MATCHER_BACKENDS - str
+    :param ratio: ratio test of the hamming and mih backends, None to disable - float
+    :return: match: function (descriptors1, descriptors2) -> (query_idx, train_idx, distance)
+    """
+    if backend not in MATCHER_BACKENDS:
+        raise ValueError('Unknown matcher backend: {}'.format(backend))
+    if ratio is not None and backend == 'bf':
+        raise ValueError('The ratio test needs the hamming or mih matcher backend')
+
+    match = {'bf': match_bf, 'hamming': match_hamming, 'mih': match_mih}[backend]
+    return match if ratio is None else partial(match, ratio=ratio)
+
+
+def _init_match_worker(descriptors: list, backend: str, ratio=None) -> None:
+    """
+    Pool initializer, keeps the descriptors in each worker so only the pair indexes are sent per task.
+    """
+    global _worker_descriptors, _worker_match
+    _worker_descriptors = descriptors
+    _worker_match = get_match_function(backend, ratio)
+
+
+def _match_pair(pair: tuple) -> np.ndarray:
+    """
+    Match a single pair of images using the worker's descriptors.
+    :param pair: (image_idx1, image_idx2, threshold) tuple
+    :return: matches: filtered matching feature ids - np.array
+    """
+    image_idx1, image_idx2, threshold = pair
+
+    return filter_matches(*_worker_match(_worker_descriptors[image_idx1], _worker_descriptors[image_idx2]), threshold)
+
+
+def match_pairs(descriptors: list, pairs: list, backend='bf', processes=1, ratio=None) -> list:
+    """
+    Match all the given image pairs, across a process pool when more than one process is requested.
+    :param descriptors: a list of descriptors - list of np.arrays
+    :param pairs: list of (image_idx1, image_idx2, threshold) tuples
+    :param backend: matcher backend out of MATCHER_BACKENDS - str
+    :param processes: number of matching processes - int
+    :param ratio: ratio test of the hamming and mih backends, None to disable - float
+    :return: matches: matching feature ids for each pair - list of np.arrays
+    """
+    # Validate the backend before starting the workers:
+    get_match_function(backend, ratio)
+
+    if processes <= 1 or len(pairs) <= 1:
+        # In-process, the worker globals are released after use (the descriptors can be shared memory views):
+        _init_match_worker(descriptors, backend, ratio)
+        try:
+            return [_match_pair(pair) for pair in pairs]
+        finally:
+            _init_match_worker(None, backend)
+
+    chunk_size = max(1, len(pairs) // (processes * 4))
+    with Pool(processes=processes, initializer=_init_match_worker, initargs=(descriptors, backend, ratio)) as pool:
+        return pool.map(_match_pair, pairs, chunksize=chunk_size)
+
+
+def match_sequential(descriptors: list, match_window_overlap=5, do_quadratic_match=False,
+                     backend='bf', processes=1, filter_ratio=45, quadratic_filter_ratio=30,
+                     loop_candidates=None, ratio=None) -> tuple:
+    """
+    Matching engine: builds the pair list up front and matches all the pairs.
+    :param descriptors: a list of descriptors - list of np.arrays
+    :param match_window_overlap: the size of the match window of each image
+    :param do_quadratic_match: boolean flag for quadratic matching
+    :param backend: matcher backend out of MATCHER_BACKENDS - str
+    :param processes: number of matching processes - int
+    :param filter_ratio: percent of the best matches kept for sequential (and loop) pairs - int
+    :param quadratic_filter_ratio: percent of the best matches kept for quadratic pairs - int
+    :param loop_candidates: loop-closure pairs to verify, None for the fixed first/last window pairs - list
+    :param ratio: ratio test of the hamming and mih backends, None to disable - float
+    :return: matches: matching feature ids - list np.arrays
+    :return: pair_ids: the associated image ids - list of tuples
+    :return: pairs_per_sec: matching throughput - float
+    """
+    start = time.time()
+
+    pairs = get_sequential_pairs(len(descriptors), match_window_overlap, do_quadratic_match,
+                                 filter_ratio, quadratic_filter_ratio, loop_candidates)
+    matches = match_pairs(descriptors, pairs, backend, processes, ratio)
+    pair_ids = [(image_idx1 + 1, image_idx2 + 1) for image_idx1, image_idx2, _ in pairs]
+
+    elapsed = time.time() - start
+    pairs_per_sec = len(pairs) / elapsed if elapsed > 0 else float('inf')
+
+    return matches, pair_ids, pairs_per_sec
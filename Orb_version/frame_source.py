@@ -0,0 +1,292 @@
+import os
+import collections
+import threading
+import cv2
+import numpy as np
+
+# The video recorded by scan_script, and the number of frames taken out of it for the model:
+VIDEO_FILE_NAME = 'outpy.h264'
+DEFAULT_NUMBER_OF_FRAMES = 87
+
+# Frames are named like the images of the ffmpeg image2 muxer (image1.jpg, image2.jpg, ...):
+FRAME_NAME_FORMAT = 'image{}.jpg'
+JPEG_QUALITY = 95
+
+# Keyframe selection, frames are scored on a grayscale copy downscaled to this width:
+KEYFRAME_SCORE_WIDTH = 160
+
+# A slot keyframe is dropped when its sharpness (variance of the Laplacian) is below this fraction of the median
+# sharpness of the slots keyframes (motion blur), or when the median optical flow since the previous kept keyframe
+# is below this number of pixels of the downscaled frame (the drone is not moving):
+MIN_KEYFRAME_SHARPNESS = 0.25
+MIN_KEYFRAME_MOTION = 1.0
+
+# Number of corners tracked by the optical flow between keyframes:
+MOTION_CORNERS = 100
+
+# A JPEG encoded frame and the name of its image (in the images folder, the database and camera_poses/images.txt),
+# the frames are kept encoded so the candidates of a whole video fit in the memory of a small board:
+Frame = collections.namedtuple('Frame', ['name', 'data'])
+
+
+class FrameProgress(object):
+    """
+    The names of the frames written so far by write_frames, for a thread that needs the first frames before the
+    extraction ends: it sleeps on a condition variable until they are published, without polling the folder.
+    There is no overlap with the decoding: the frames are selected (and written) only after the whole video is
+    decoded, since only the first frame of the video is final before its end, so the waiting thread only saves the
+    writing of the other frames.
+    """
+
+    def __init__(self):
+        self.names = []
+        self.is_done = False
+        self._condition = threading.Condition()
+
+    def publish(self, name: str) -> None:
+        """
+        :param name: name of a frame that was completely written - str
+        """
+        with self._condition:
+            self.names.append(name)
+            self._condition.notify_all()
+
+    def done(self) -> None:
+        """
+        No more frames will be published (also after a failed extraction, so the waiting threads are released).
+        """
+        with self._condition:
+            self.is_done = True
+            self._condition.notify_all()
+
+    def wait(self, number_of_frames: int, timeout=None) -> list:
+        """
+        Block until number_of_frames frames are written, or until the extraction is done.
+        :param number_of_frames: the number of frames to wait for - int
+        :param timeout: maximal waiting time in seconds, None to wait for the frames - float
+        :return: names: the names of (at most number_of_frames of) the first written frames - list of str
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: len(self.names) >= number_of_frames or self.is_done, timeout)
+            return self.names[:number_of_frames]
+
+
+def encode_frame(image: np.ndarray) -> bytes:
+    """
+    :param image: grayscale or BGR frame - np.array
+    :return: data: the JPEG file content of the frame - bytes
+    """
+    is_encoded, data = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+    if not is_encoded:
+        raise IOError('cannot encode a frame')
+    return data.tobytes()
+
+
+def encode_last_candidate(candidates: list) -> None:
+    """
+    Encode the last candidate frame of read_candidates, if it is still a decoded frame.
+    :param candidates: (index, frame or JPEG data, small frame or None, sharpness) of each bucket - list
+    """
+    if len(candidates) > 0 and isinstance(candidates[-1][1], np.ndarray):
+        candidates[-1] = (candidates[-1][0], encode_frame(candidates[-1][1])) + candidates[-1][2:]
+
+
+def get_score_image(image: np.ndarray) -> np.ndarray:
+    """
+    :param image: grayscale or BGR frame - np.array
+    :return: small: the grayscale frame downscaled to KEYFRAME_SCORE_WIDTH - np.array
+    """
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    height = max(1, round(image.shape[0] * KEYFRAME_SCORE_WIDTH / image.shape[1]))
+    return cv2.resize(image, (KEYFRAME_SCORE_WIDTH, height), interpolation=cv2.INTER_AREA)
+
+
+def get_sharpness(small: np.ndarray) -> float:
+    """
+    :param small: downscaled grayscale frame - np.array
+    :return: sharpness: variance of the Laplacian of the frame (low for blurry frames) - float
+    """
+    return float(cv2.Laplacian(small, cv2.CV_64F).var())
+
+
+def get_motion(previous_small: np.ndarray, small: np.ndarray) -> float:
+    """
+    :param previous_small: downscaled grayscale frame - np.array
+    :param small: the next downscaled grayscale frame - np.array
+    :return: motion: median optical flow of the corners of the first frame in pixels, infinite if it can't be
+                     tracked (textureless or too different frames) - float
+    """
+    corners = cv2.goodFeaturesToTrack(previous_small, MOTION_CORNERS, 0.01, 5)
+    if corners is None:
+        return np.inf
+
+    tracked, status, _ = cv2.calcOpticalFlowPyrLK(previous_small, small, corners, None)
+    is_tracked = status.reshape(-1) == 1
+    if not np.any(is_tracked):
+        return np.inf
+    return float(np.median(np.linalg.norm((tracked - corners).reshape(-1, 2)[is_tracked], axis=1)))
+
+
+def read_candidates(video_path: str, number_of_frames: int, grayscale=True, score=False) -> tuple:
+    """
+    Decode the video once and keep between number_of_frames and 2 * number_of_frames candidate frames spread over it.
+    The raw h264 stream has no frame count, so the frames are split in buckets of stride frames, and the stride is
+    doubled (merging every two buckets) whenever there are more than 2 * number_of_frames buckets: the memory is
+    bounded. Without scoring, the first frame of each bucket is kept and only these frames are converted; with
+    scoring, the sharpest frame of each bucket is kept, except in the first bucket that keeps the first frame of the
+    video (the target of the first slot of read_keyframes, which must not be empty). Only the candidate of the last
+    bucket is held decoded (it can still be replaced by a sharper frame), the others are JPEG encoded.
+    :param video_path: path to the video file - str
+    :param number_of_frames: the number of frames to take - int
+    :param grayscale: boolean flag for grayscale frames instead of BGR frames
+    :param score: boolean flag for keeping the sharpest frame of each bucket
+    :return: candidates: (index, JPEG data, small frame or None, sharpness) of each bucket, in video order - list
+    :return: count: the number of frames of the video - int
+    """
+    capture = cv2.VideoCapture(video_path)
+    if not capture.isOpened():
+        raise IOError('cannot open the video %s' % video_path)
+
+    candidates = []
+    stride = 1
+    index = 0
+    try:
+        while capture.grab():
+            bucket = index // stride
+            is_new_bucket = len(candidates) == 0 or candidates[-1][0] // stride != bucket
+            if is_new_bucket or score:
+                is_decoded, image = capture.retrieve()
+                if is_decoded:
+                    small = get_score_image(image) if score else None
+                    sharpness = get_sharpness(small) if score else 0.0
+                    if grayscale and image.ndim == 3:
+                        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+                    # (the first frame of the video is never replaced, it is the frame of the first slot)
+                    if is_new_bucket:
+                        encode_last_candidate(candidates)
+                        candidates.append((index, image, small, sharpness))
+                    elif candidates[-1][0] != 0 and sharpness > candidates[-1][3]:
+                        candidates[-1] = (index, image, small, sharpness)
+
+                    if len(candidates) > 2 * number_of_frames:
+                        stride *= 2
+                        merged = []
+                        for candidate in candidates:
+                            if len(merged) > 0 and merged[-1][0] // stride == candidate[0] // stride:
+                                if merged[-1][0] != 0 and candidate[3] > merged[-1][3]:
+                                    merged[-1] = candidate
+                            else:
+                                merged.append(candidate)
+                        candidates = merged
+            index += 1
+    finally:
+        capture.release()
+
+    encode_last_candidate(candidates)
+    return candidates, index
+
+
+def read_frames(video_path: str, number_of_frames=DEFAULT_NUMBER_OF_FRAMES, grayscale=True) -> list:
+    """
+    Decode the video once and take number_of_frames evenly spaced frames out of it.
+    :param video_path: path to the video file - str
+    :param number_of_frames: the number of frames to take (all of them for a shorter video) - int
+    :param grayscale: boolean flag for grayscale frames (the ORB extractor input) instead of BGR frames
+    :return: frames: the frames in video order, named image1.jpg, image2.jpg, ... - list of Frame
+    """
+    candidates, count = read_candidates(video_path, number_of_frames, grayscale)
+
+    # Evenly spaced candidates (the candidates are evenly spaced over the video, and there are more of them than
+    # frames to take, so the rounded ranks are strictly increasing and no frame is selected twice):
+    if len(candidates) <= number_of_frames:
+        selected = np.arange(len(candidates))
+    else:
+        selected = np.round(np.linspace(0, len(candidates) - 1, number_of_frames)).astype(int)
+    if np.any(np.diff(selected) <= 0):
+        raise RuntimeError('a frame was selected twice')
+
+    return [Frame(FRAME_NAME_FORMAT.format(i + 1), candidates[position][1]) for i, position in enumerate(selected)]
+
+
+def read_keyframes(video_path: str, number_of_frames=DEFAULT_NUMBER_OF_FRAMES, grayscale=True,
+                   min_sharpness=MIN_KEYFRAME_SHARPNESS, min_motion=MIN_KEYFRAME_MOTION) -> list:
+    """
+    Decode the video once and take at most number_of_frames informative keyframes out of it.
+    The video is split in number_of_frames evenly spaced slots (centred on the frames of read_frames), the sharpest
+    frame of each slot is its keyframe, and the keyframes that are blurry or too close to the previous kept keyframe are
+    dropped. A keyframe keeps the name of its slot, so the names still match the reference camera poses of the
+    slots (missing names are the dropped slots).
+    :param video_path: path to the video file - str
+    :param number_of_frames: the number of slots - int
+    :param grayscale: boolean flag for grayscale frames (the ORB extractor input) instead of BGR frames
+    :param min_sharpness: minimal sharpness relative to the median sharpness of the slots keyframes - float
+    :param min_motion: minimal median optical flow since the previous keyframe, in downscaled pixels - float
+    :return: frames: the kept keyframes in video order - list of Frame
+    """
+    candidates, count = read_candidates(video_path, number_of_frames, grayscale, score=True)
+    if len(candidates) == 0:
+        return []
+
+    # The sharpest candidate of each slot, the slots are centred on the frames of read_frames (the frames the
+    # reference camera poses describe), so a keyframe is at most half a slot away from the pose of its name:
+    slots = {}
+    for candidate in candidates:
+        slot = int(round(candidate[0] * (number_of_frames - 1) / max(count - 1, 1)))
+        if slot not in slots or candidate[3] > slots[slot][3]:
+            slots[slot] = candidate
+
+    median_sharpness = np.median([candidate[3] for candidate in slots.values()])
+    frames = []
+    previous_small = None
+    for slot in sorted(slots):
+        _, data, small, sharpness = slots[slot]
+
+        # The first slot is always kept (the reference pose of the model):
+        if previous_small is not None and (sharpness < min_sharpness * median_sharpness or
+                                           get_motion(previous_small, small) < min_motion):
+            continue
+
+        frames.append(Frame(FRAME_NAME_FORMAT.format(slot + 1), data))
+        previous_small = small
+
+    return frames
+
+
+def write_frames(frames: list, images_path: str, progress=None) -> None:
+    """
+    Write the JPEG images of the frames (each to a temporary file first, so readers of the folder never see a partial
+    image).
+    :param frames: list of Frame
+    :param images_path: path to the images folder - str
+    :param progress: FrameProgress the name of each written frame is published to, None to not publish them
+    """
+    for frame in frames:
+        temp_path = os.path.join(images_path, frame.name + '.tmp')
+        with open(temp_path, 'wb') as file:
+            file.write(frame.data)
+        os.replace(temp_path, os.path.join(images_path, frame.name))
+        if progress is not None:
+            progress.publish(frame.name)
+
+
+def extract_frames(video_path: str, number_of_frames=DEFAULT_NUMBER_OF_FRAMES, images_path=None,
+                   grayscale=True, keyframes=False, progress=None) -> list:
+    """
+    :param video_path: path to the video file - str
+    :param number_of_frames: the number of frames to take - int
+    :param images_path: path to the images folder to write the frames to, None to keep them in memory only - str
+    :param grayscale: boolean flag for grayscale frames instead of BGR frames
+    :param keyframes: boolean flag for the informative keyframes of read_keyframes instead of evenly spaced frames
+    :param progress: FrameProgress of the written frames (published after the whole video is decoded), marked done
+                     when the extraction ends (even on failure)
+    :return: frames: list of Frame (see read_frames and read_keyframes)
+    """
+    try:
+        frames = (read_keyframes if keyframes else read_frames)(video_path, number_of_frames, grayscale)
+        if images_path is not None:
+            write_frames(frames, images_path, progress)
+    finally:
+        if progress is not None:
+            progress.done()
+    return frames
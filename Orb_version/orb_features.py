@@ -0,0 +1,73 @@
+import numpy as np
+import two_view_geometry as tvg
+
+"""
+camera matrix:
+    [505.61918164   0.         314.90808858]
+    [  0.         506.35795295 233.38488026]
+    [  0.           0.           1.        ]
+
+distortion coefficients:
+    [ 0.10637077  0.41155632 -0.00463533 -0.00815625 -2.5849433 ]
+
+    https://docs.opencv.org/2.4/modules/calib3d/doc/camera_calibration_and_3d_reconstruction.html
+"""
+fx = 505.61918164
+fy = 506.35795295
+cx = 314.90808858
+cy = 233.38488026
+k1 = 0.10637077
+k2 = 0.41155632
+p1 = -0.00463533
+p2 = -0.00815625
+
+# A single camera model for all images (for model=4, parameters are (fx, fy, cx, cy, k1, k2, p1, p2)), and its
+# COLMAP name:
+CAMERA_MODEL = 4
+CAMERA_MODEL_NAME = 'OPENCV'
+CAMERA_WIDTH = 640
+CAMERA_HEIGHT = 480
+CAMERA_PARAMS = np.array((fx, fy, cx, cy, k1, k2, p1, p2))
+
+# The same intrinsics for the geometric verification:
+CAMERA_MATRIX = tvg.get_camera_matrix(fx, fy, cx, cy)
+DIST_COEFFS = np.array((k1, k2, p1, p2))
+
+# ORB keeps all the keypoints tied with the weakest retained response, so leave some room in each image slot
+# (a quarter of nfeatures):
+FEATURE_SLOT_HEADROOM = 4
+
+# Size of a native ORB descriptor in bytes:
+ORB_DESCRIPTOR_SIZE = 32
+
+
+def get_slot_capacity(nfeatures: int) -> int:
+    """
+    :param nfeatures: maximal number of ORB features for each image - int
+    :return: capacity: number of feature rows reserved for each image - int
+    """
+    return nfeatures + nfeatures // FEATURE_SLOT_HEADROOM
+
+
+def detect_and_compute(orb, image: np.ndarray, capacity=None) -> tuple:
+    """
+    Detect keypoints and compute ORB descriptors for a single image.
+    :param orb: open-cv ORB detector
+    :param image: the image - np.array
+    :param capacity: maximal number of features to keep (the strongest are kept), by default the slot capacity
+                     of the detector nfeatures - int
+    :return: keypoints: (x, y, size, angle) of each keypoint - np.array of size (n,4)
+    :return: descriptors: native ORB descriptors - np.array of size (n,32)
+    """
+    capacity = get_slot_capacity(orb.getMaxFeatures()) if capacity is None else capacity
+    keypoint, dsk = orb.detectAndCompute(image, None)
+
+    kp = np.array([[k.pt[0], k.pt[1], k.size, k.angle] for k in keypoint], dtype=np.float32).reshape(-1, 4)
+    dsk = np.zeros((0, ORB_DESCRIPTOR_SIZE), dtype=np.uint8) if dsk is None else dsk
+
+    # Keep the strongest keypoints if there are too many:
+    if len(kp) > capacity:
+        strongest = np.sort(np.argsort([-k.response for k in keypoint], kind='stable')[:capacity])
+        kp, dsk = kp[strongest], dsk[strongest]
+
+    return kp, dsk
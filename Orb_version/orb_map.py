@@ -0,0 +1,69 @@
+import os
+import numpy as np
+
+"""
+Binary ORB map format, a single little-endian file:
+    header:       MAP_HEADER_DTYPE record (magic, version, descriptor size, number of points)
+    xyz:          float32 array of size (n,3)
+    descriptors:  uint8 array of size (n,descriptor_size)
+Both blocks are loaded as views of one memory map (or of one np.fromfile read).
+"""
+
+MAP_MAGIC = b'ORBMAP'
+MAP_VERSION = 1
+MAP_HEADER_DTYPE = np.dtype([('magic', 'S8'), ('version', '<u4'), ('descriptor_size', '<u4'), ('count', '<u8')])
+
+# Default name of the map file in the output folder:
+MAP_FILE_NAME = 'orb_map.bin'
+
+
+def write_map(path: str, xyz: np.ndarray, descriptors: np.ndarray) -> None:
+    """
+    Write the 3D points and their descriptors (to a temporary file first, so readers never see a partial map).
+    :param path: path to the map file - str
+    :param xyz: the 3D points - np.array of size (n,3)
+    :param descriptors: descriptor of each point - np.array of size (n,d) of uint8
+    """
+    xyz = np.ascontiguousarray(xyz, dtype='<f4').reshape(-1, 3)
+    descriptors = np.ascontiguousarray(descriptors, dtype=np.uint8)
+    if descriptors.ndim != 2 or len(descriptors) != len(xyz):
+        raise ValueError('expected one descriptor row for each of the %d points' % len(xyz))
+
+    header = np.zeros(1, dtype=MAP_HEADER_DTYPE)
+    header['magic'] = MAP_MAGIC
+    header['version'] = MAP_VERSION
+    header['descriptor_size'] = descriptors.shape[1]
+    header['count'] = len(xyz)
+
+    temp_path = path + '.{}.tmp'.format(os.getpid())
+    with open(temp_path, 'wb') as file:
+        file.write(header.tobytes())
+        file.write(xyz.tobytes())
+        file.write(descriptors.tobytes())
+    os.replace(temp_path, path)
+
+
+def read_map(path: str, mmap=True) -> tuple:
+    """
+    :param path: path to a map file written by write_map - str
+    :param mmap: boolean flag for memory-mapping the file instead of reading it
+    :return: xyz: the 3D points - np.array of size (n,3) of float32
+    :return: descriptors: descriptor of each point - np.array of size (n,d) of uint8
+    """
+    data = np.memmap(path, dtype=np.uint8, mode='r') if mmap else np.fromfile(path, dtype=np.uint8)
+    if len(data) < MAP_HEADER_DTYPE.itemsize:
+        raise ValueError('%s is not an ORB map file' % path)
+
+    header = data[:MAP_HEADER_DTYPE.itemsize].view(MAP_HEADER_DTYPE)[0]
+    if header['magic'] != MAP_MAGIC or header['version'] != MAP_VERSION:
+        raise ValueError('%s is not an ORB map file of version %d' % (path, MAP_VERSION))
+
+    count, descriptor_size = int(header['count']), int(header['descriptor_size'])
+    xyz_start = MAP_HEADER_DTYPE.itemsize
+    descriptors_start = xyz_start + count * 3 * 4
+    if len(data) != descriptors_start + count * descriptor_size:
+        raise ValueError('%s is truncated' % path)
+
+    xyz = data[xyz_start:descriptors_start].view('<f4').reshape(count, 3)
+    descriptors = data[descriptors_start:].reshape(count, descriptor_size)
+    return xyz, descriptors
@@ -0,0 +1,59 @@
+import cv2
+
+"""
+ORB extraction and matching presets, trading accuracy for speed per deployment:
+    nfeatures:              maximal number of ORB features for each image
+    nlevels:                number of ORB pyramid levels
+    fast_threshold:         FAST detector threshold
+    match_window_overlap:   the size of the sequential match window of each image
+    do_quadratic_match:     boolean flag for quadratic matching
+    filter_ratio:           percent of the best matches kept for each sequential pair
+    quadratic_filter_ratio: percent of the best matches kept for each quadratic pair
+'balanced' is the original configuration of the pipeline.
+"""
+PRESETS = {
+    'pi0-fast': {'nfeatures': 1000,
+                 'nlevels': 4,
+                 'fast_threshold': 30,
+                 'match_window_overlap': 5,
+                 'do_quadratic_match': False,
+                 'filter_ratio': 60,
+                 'quadratic_filter_ratio': 40},
+    'balanced': {'nfeatures': 3000,
+                 'nlevels': 8,
+                 'fast_threshold': 20,
+                 'match_window_overlap': 10,
+                 'do_quadratic_match': True,
+                 'filter_ratio': 45,
+                 'quadratic_filter_ratio': 30},
+    'quality': {'nfeatures': 5000,
+                'nlevels': 10,
+                'fast_threshold': 12,
+                'match_window_overlap': 15,
+                'do_quadratic_match': True,
+                'filter_ratio': 40,
+                'quadratic_filter_ratio': 30},
+}
+
+DEFAULT_PRESET = 'balanced'
+
+
+def get_preset(name: str) -> dict:
+    """
+    :param name: preset name out of PRESETS - str
+    :return: preset: a copy of the preset parameters - dict
+    """
+    if name not in PRESETS:
+        raise ValueError('Unknown preset: {} (available: {})'.format(name, ', '.join(sorted(PRESETS))))
+    return dict(PRESETS[name])
+
+
+def get_orb_params(preset: dict) -> dict:
+    """
+    :param preset: preset parameters - dict
+    :return: orb_params: keyword arguments for cv2.ORB_create - dict
+    """
+    return {'nfeatures': preset['nfeatures'],
+            'nlevels': preset['nlevels'],
+            'fastThreshold': preset['fast_threshold'],
+            'scoreType': cv2.ORB_FAST_SCORE}
@@ -0,0 +1,124 @@
+import sys
+from multiprocessing import shared_memory
+import numpy as np
+
+# Number of values stored for each keypoint (x, y, size, angle):
+KEYPOINT_SIZE = 4
+
+
+class SharedFeatureStore(object):
+    """
+    Keypoints and descriptors of a set of images, stored in shared memory so extraction workers can write their
+    results in place and the parent process can read them without pickling or copying.
+    Each image owns a fixed slot of `capacity` rows, the number of valid rows of each slot is kept in `counts`
+    (-1 for images that could not be read).
+    """
+
+    def __init__(self, number_of_images, capacity, descriptor_size, names=None):
+        """
+        Creates (names=None) or attaches to (names of existing blocks) the shared memory blocks.
+        :param number_of_images: number of image slots - int
+        :param capacity: maximal number of features in each slot - int
+        :param descriptor_size: number of bytes in each descriptor - int
+        :param names: shared memory block names (keypoints, descriptors, counts) to attach to - tuple
+        """
+        self.number_of_images = number_of_images
+        self.capacity = capacity
+        self.descriptor_size = descriptor_size
+
+        rows = max(number_of_images * capacity, 1)
+        sizes = (rows * KEYPOINT_SIZE * np.dtype(np.float32).itemsize,
+                 rows * descriptor_size,
+                 max(number_of_images, 1) * np.dtype(np.int32).itemsize)
+
+        if names is None:
+            self._blocks = [shared_memory.SharedMemory(create=True, size=size) for size in sizes]
+        else:
+            self._blocks = [shared_memory.SharedMemory(name=name) for name in names]
+
+        self._keypoints = np.ndarray((rows, KEYPOINT_SIZE), dtype=np.float32, buffer=self._blocks[0].buf)
+        self._descriptors = np.ndarray((rows, descriptor_size), dtype=np.uint8, buffer=self._blocks[1].buf)
+        self.counts = np.ndarray((max(number_of_images, 1),), dtype=np.int32, buffer=self._blocks[2].buf)
+
+        if names is None:
+            self.counts[:] = -1
+
+    @property
+    def spec(self) -> tuple:
+        """
+        Picklable description of the store, used by worker processes to attach to it.
+        :return: (number_of_images, capacity, descriptor_size, names) - tuple
+        """
+        return self.number_of_images, self.capacity, self.descriptor_size, tuple(b.name for b in self._blocks)
+
+    @classmethod
+    def attach(cls, spec):
+        """
+        Attach to an existing store.
+        :param spec: the store's spec property - tuple
+        :return: store: SharedFeatureStore object
+        """
+        return cls(*spec)
+
+    @property
+    def offsets(self) -> np.ndarray:
+        """
+        Index of the first row of each image slot.
+        :return: offsets: np.array of size (number_of_images,)
+        """
+        return np.arange(self.number_of_images, dtype=np.int64) * self.capacity
+
+    def write(self, slot, keypoints, descriptors) -> None:
+        """
+        Write the features of a single image into its slot.
+        :param slot: image slot index - int
+        :param keypoints: keypoints of size (n,4) as (x, y, size, angle) - np.array
+        :param descriptors: descriptors of size (n,descriptor_size) - np.array
+        """
+        count = len(keypoints)
+        assert count <= self.capacity
+        start = slot * self.capacity
+
+        self._keypoints[start:start + count] = keypoints
+        self._descriptors[start:start + count] = descriptors
+        self.counts[slot] = count
+
+    def keypoints(self, slot) -> np.ndarray:
+        """
+        :param slot: image slot index - int
+        :return: a view of the slot keypoints of size (n,4) - np.array
+        """
+        start = slot * self.capacity
+        return self._keypoints[start:start + max(self.counts[slot], 0)]
+
+    def descriptors(self, slot) -> np.ndarray:
+        """
+        :param slot: image slot index - int
+        :return: a view of the slot descriptors of size (n,descriptor_size) - np.array
+        """
+        start = slot * self.capacity
+        return self._descriptors[start:start + max(self.counts[slot], 0)]
+
+    def unlink(self) -> None:
+        """
+        Remove the shared memory blocks names, existing mappings stay valid until they are closed.
+        """
+        for block in self._blocks:
+            block.unlink()
+
+    def close(self) -> None:
+        """
+        Close this process mapping. NumPy doesn't keep the blocks buffers exported, so a view that outlives the
+        mapping would read unmapped memory: the store refuses to close while views of it are still referenced.
+        """
+        if self.counts is None:
+            return
+
+        # (the store attribute and the getrefcount argument are the only references to an array without views)
+        for name in ('_keypoints', '_descriptors', 'counts'):
+            if sys.getrefcount(getattr(self, name)) > 2:
+                raise BufferError('cannot close the shared feature store, views of it are still referenced')
+
+        self._keypoints = self._descriptors = self.counts = None
+        for block in self._blocks:
+            block.close()
@@ -0,0 +1,222 @@
+import queue
+import threading
+from collections import deque
+from multiprocessing import Pool
+import colmap_database as cdb
+import feature_matching as fm
+
+# Marks the end of the items in a queue:
+END_OF_QUEUE = None
+
+# Number of written items between two database commits:
+COMMIT_INTERVAL = 32
+
+
+class StreamingPipeline(object):
+    """
+    Feature extraction to database pipeline with bounded memory:
+    extraction workers feed a bounded queue, the matcher consumes it with a sliding window of match_window_overlap
+    images, and a single writer thread persists images, features and matches to the database as they arrive.
+    Peak memory depends on the window and queue sizes, not on the number of images.
+    """
+
+    def __init__(self, database_path, extract, to_colmap, camera, match_window_overlap=10, matcher='bf',
+                 processes=1, queue_size=None, initializer=None, initargs=(), filter_ratio=45, ratio=None,
+                 verify=None):
+        """
+        :param database_path: path to the created database file - str
+        :param extract: picklable function image path -> (name, keypoints, descriptors) or None
+        :param to_colmap: function (keypoints, descriptors) -> (keypoints, descriptors) in COLMAP database format
+        :param camera: the single camera of all the images as (model, width, height, params) - tuple
+        :param match_window_overlap: the size of the match window of each image - int
+        :param matcher: matcher backend out of feature_matching.MATCHER_BACKENDS - str
+        :param processes: number of extraction processes - int
+        :param queue_size: maximal number of extracted images waiting to be matched, 2 * processes by default - int
+        :param initializer: extraction pool initializer - function
+        :param initargs: arguments of the extraction pool initializer - tuple
+        :param filter_ratio: percent of the best matches kept for each pair - int
+        :param ratio: ratio test of the hamming and mih matchers, None to disable - float
+        :param verify: geometric verification function (keypoints1, keypoints2, matches) -> (inlier_matches, F,
+                       config) or None, the verified pairs are written to the two_view_geometries table
+        """
+        self.database_path = database_path
+        self.extract = extract
+        self.to_colmap = to_colmap
+        self.camera = camera
+        self.match_window_overlap = match_window_overlap
+        self.match = fm.get_match_function(matcher, ratio)
+        self.processes = max(processes, 1)
+        self.queue_size = queue_size if queue_size is not None else 2 * self.processes
+        self.initializer = initializer
+        self.initargs = initargs
+        self.filter_ratio = filter_ratio
+        self.verify = verify
+
+        self._features = queue.Queue(maxsize=self.queue_size)
+        self._writes = queue.Queue(maxsize=self.queue_size * max(match_window_overlap, 1))
+        self._errors = []
+        self.rows = 0
+        self.features = 0
+        self.matches = 0
+        self.verified_pairs = 0
+
+    def run(self, images: list) -> tuple:
+        """
+        Extract, match and write all the images.
+        :param images: a list of images paths (in sequence order)
+        :return: images_id_in_db: dictionary of all the images and their indexes in DB
+        :return: pair_ids: the matched image ids - list of tuples
+        """
+        producer = threading.Thread(target=self._produce, args=(images,), daemon=True)
+        writer = threading.Thread(target=self._write_all, daemon=True)
+        producer.start()
+        writer.start()
+
+        images_id_in_db, pair_ids = {}, []
+        try:
+            self._match_all(images_id_in_db, pair_ids)
+        except Exception as error:
+            self._errors.append(error)
+        finally:
+            self._writes.put(END_OF_QUEUE)
+
+            # Unblock the producer if the matcher stopped early:
+            while producer.is_alive() or not self._features.empty():
+                try:
+                    self._features.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+
+        producer.join()
+        writer.join()
+
+        if self._errors:
+            raise self._errors[0]
+
+        return images_id_in_db, pair_ids
+
+    def _produce(self, images: list) -> None:
+        """
+        Producer: extract the images features in chunks of one image per process, in sequence order.
+        """
+        try:
+            with Pool(processes=self.processes, initializer=self.initializer, initargs=self.initargs) as pool:
+                for start in range(0, len(images), self.processes):
+                    if self._errors:
+                        break
+                    for features in pool.map(self.extract, images[start:start + self.processes]):
+                        if features is not None:
+                            self._features.put(features)
+        except Exception as error:
+            self._errors.append(error)
+        finally:
+            self._features.put(END_OF_QUEUE)
+
+    def _match_all(self, images_id_in_db: dict, pair_ids: list) -> None:
+        """
+        Consumer: match each new image with the previous images of its window and queue the results for writing.
+        The first and last windows are kept to match the remaining (loop detection) pairs once the last image arrived.
+        """
+        window = deque(maxlen=max(self.match_window_overlap, 0))
+        first_window = {}
+        matched = set()
+        index = 0
+
+        while True:
+            features = self._features.get()
+            if features is END_OF_QUEUE:
+                break
+
+            name, keypoints, descriptors = features
+            images_id_in_db[index + 1] = name
+            self.features += len(keypoints)
+            self._writes.put(('image', index + 1, name, keypoints, descriptors))
+
+            for previous_index, previous_features in window:
+                if index - previous_index >= self.match_window_overlap:
+                    continue
+                self._match_pair(previous_index, previous_features, index, (keypoints, descriptors),
+                                 self.filter_ratio, matched, pair_ids)
+
+            window.append((index, (keypoints, descriptors)))
+            if index < self.match_window_overlap:
+                first_window[index] = (keypoints, descriptors)
+            index += 1
+
+        # Match the remaining pairs of the sequential scheme between the retained images:
+        retained = dict(first_window)
+        retained.update(window)
+        for image_idx1, image_idx2, threshold in fm.get_sequential_pairs(index, self.match_window_overlap,
+                                                                         filter_ratio=self.filter_ratio):
+            if (image_idx1, image_idx2) not in matched and image_idx1 in retained and image_idx2 in retained:
+                self._match_pair(image_idx1, retained[image_idx1], image_idx2, retained[image_idx2], threshold,
+                                 matched, pair_ids)
+
+    def _match_pair(self, image_idx1, features1, image_idx2, features2, threshold, matched, pair_ids) -> None:
+        """
+        Match (and verify) a single pair and queue its matches for writing.
+        :param features1: (keypoints, descriptors) of the first image - tuple
+        :param features2: (keypoints, descriptors) of the second image - tuple
+        """
+        matches = fm.filter_matches(*self.match(features1[1], features2[1]), threshold)
+        matched.add((image_idx1, image_idx2))
+        pair_ids.append((image_idx1 + 1, image_idx2 + 1))
+        self.matches += len(matches)
+
+        if len(matches) > 0:
+            self._writes.put(('matches', image_idx1 + 1, image_idx2 + 1, matches))
+
+        if self.verify is not None and len(matches) > 0:
+            geometry = self.verify(features1[0], features2[0], matches)
+            if geometry is not None:
+                self.verified_pairs += 1
+                self._writes.put(('two_view_geometry', image_idx1 + 1, image_idx2 + 1) + geometry)
+
+    def _write_all(self) -> None:
+        """
+        Writer: the only thread using the database connection, commits every COMMIT_INTERVAL items.
+        """
+        db = None
+        try:
+            db = cdb.COLMAPDatabase.connect(self.database_path)
+            db.set_bulk_pragmas()
+            db.create_tables()
+            camera_id = db.add_camera(*self.camera)
+            self.rows += 1
+
+            pending = 0
+            while True:
+                item = self._writes.get()
+                if item is END_OF_QUEUE:
+                    break
+
+                if item[0] == 'image':
+                    _, image_id, name, keypoints, descriptors = item
+                    keypoints, descriptors = self.to_colmap(keypoints, descriptors)
+                    db.add_image(name, camera_id, image_id=image_id)
+                    db.add_keypoints(image_id, keypoints)
+                    db.add_descriptors(image_id, descriptors)
+                    self.rows += 3
+                elif item[0] == 'matches':
+                    db.add_matches(*item[1:])
+                    self.rows += 1
+                else:
+                    _, image_id1, image_id2, inlier_matches, F, config = item
+                    db.add_two_view_geometry(image_id1, image_id2, inlier_matches, F=F, config=config)
+                    self.rows += 1
+
+                pending += 1
+                if pending >= COMMIT_INTERVAL:
+                    db.commit()
+                    pending = 0
+
+            db.commit()
+        except Exception as error:
+            self._errors.append(error)
+
+            # Keep consuming so the matcher is never blocked on a full queue:
+            while self._writes.get() is not END_OF_QUEUE:
+                pass
+        finally:
+            if db is not None:
+                db.close()
@@ -0,0 +1,242 @@
+from multiprocessing import Pool
+import cv2
+import numpy as np
+
+# COLMAP two view geometry configuration of a pair verified with a fundamental matrix
+# (see colmap/src/estimators/two_view_geometry.h):
+UNCALIBRATED = 3
+
+# Same defaults as COLMAP's geometric verification (SiftMatchingOptions):
+MAX_ERROR = 4.0
+CONFIDENCE = 0.999
+MIN_NUM_INLIERS = 15
+MIN_INLIER_RATIO = 0.25
+
+# RANSAC hypotheses are drawn and scored in batches of RANSAC_BATCH_SIZE, up to RANSAC_MAX_TRIALS in total:
+RANSAC_BATCH_SIZE = 256
+RANSAC_MAX_TRIALS = 2048
+
+# Maximal number of refits of the best model on its inliers (local optimization):
+REFINE_ITERATIONS = 3
+
+# Number of correspondences in a minimal sample of the linear (8-point) solver:
+SAMPLE_SIZE = 8
+
+# Normalized keypoints and camera matrix shared with the verification workers (set by the pool initializer):
+_worker_points = None
+_worker_camera_matrix = None
+
+
+def get_camera_matrix(fx: float, fy: float, cx: float, cy: float) -> np.ndarray:
+    """
+    :return: camera_matrix: the intrinsic matrix K - np.array of size (3,3)
+    """
+    return np.array([[fx, 0, cx], [0, fy, cy], [0, 0, 1]], dtype=np.float64)
+
+
+def normalize_points(keypoints: np.ndarray, camera_matrix: np.ndarray, dist_coeffs: np.ndarray) -> np.ndarray:
+    """
+    Undistort the keypoints and map them to normalized image coordinates (K^-1 x).
+    :param keypoints: (x, y, ...) of each keypoint - np.array of size (n,2+)
+    :param camera_matrix: the intrinsic matrix K - np.array of size (3,3)
+    :param dist_coeffs: distortion coefficients (k1, k2, p1, p2) - np.array
+    :return: points: normalized coordinates of each keypoint - np.array of size (n,2)
+    """
+    if len(keypoints) == 0:
+        return np.zeros((0, 2), dtype=np.float64)
+
+    points = np.ascontiguousarray(keypoints[:, :2], dtype=np.float64).reshape(-1, 1, 2)
+    return cv2.undistortPoints(points, camera_matrix, dist_coeffs).reshape(-1, 2)
+
+
+def _epipolar_rows(points1: np.ndarray, points2: np.ndarray) -> np.ndarray:
+    """
+    :return: rows of the linear system x2^T E x1 = 0 for each correspondence - np.array of size (..., 9)
+    """
+    x1, y1 = points1[..., 0], points1[..., 1]
+    x2, y2 = points2[..., 0], points2[..., 1]
+    return np.stack((x2 * x1, x2 * y1, x2, y2 * x1, y2 * y1, y2, x1, y1, np.ones_like(x1)), axis=-1)
+
+
+def _conditioning(points: np.ndarray) -> np.ndarray:
+    """
+    Hartley normalization: moves the centroid of the points to the origin, at a mean distance of sqrt(2).
+    :return: transformation: np.array of size (3,3)
+    """
+    center = points.mean(axis=0)
+    scale = np.sqrt(2) / max(np.linalg.norm(points - center, axis=1).mean(), np.finfo(np.float64).eps)
+    return np.array([[scale, 0, -scale * center[0]], [0, scale, -scale * center[1]], [0, 0, 1]])
+
+
+def _matrices_from_rows(rows: np.ndarray) -> np.ndarray:
+    """
+    Linear (8-point) epipolar matrices with the rank 2 constraint.
+    :param rows: epipolar rows of a stack of samples - np.array of size (h,m,9), m >= 8
+    :return: matrices - np.array of size (h,3,3)
+    """
+    # The null vector of the rows is the eigenvector of the smallest eigenvalue of rows^T rows:
+    _, vectors = np.linalg.eigh(rows.transpose(0, 2, 1) @ rows)
+    matrices = vectors[:, :, 0].reshape(-1, 3, 3)
+
+    u, singular_values, vt = np.linalg.svd(matrices)
+    singular_values[:, 2] = 0
+    return (u * singular_values[:, None, :]) @ vt
+
+
+def sampson_errors(matrices: np.ndarray, points1: np.ndarray, points2: np.ndarray) -> np.ndarray:
+    """
+    :param matrices: epipolar matrices (x2^T M x1 = 0) - np.array of size (h,3,3)
+    :param points1: points of the first image - np.array of size (n,2)
+    :param points2: points of the second image - np.array of size (n,2)
+    :return: errors: squared Sampson distance of each correspondence for each matrix - np.array of size (h,n)
+    """
+    homogeneous1 = np.column_stack((points1, np.ones(len(points1))))
+    homogeneous2 = np.column_stack((points2, np.ones(len(points2))))
+
+    epipolar_lines2 = matrices @ homogeneous1.T
+    epipolar_lines1 = matrices.transpose(0, 2, 1) @ homogeneous2.T
+    residuals = np.einsum('nk,hkn->hn', homogeneous2, epipolar_lines2)
+
+    denominator = (epipolar_lines2[:, 0] ** 2 + epipolar_lines2[:, 1] ** 2 +
+                   epipolar_lines1[:, 0] ** 2 + epipolar_lines1[:, 1] ** 2)
+    return residuals ** 2 / np.maximum(denominator, np.finfo(np.float64).tiny)
+
+
+def estimate_epipolar(points1: np.ndarray, points2: np.ndarray, threshold: float, seed=0) -> tuple:
+    """
+    Vectorized RANSAC: batches of minimal samples are solved with batched eigen decompositions and scored against
+    all the correspondences at once, until the adaptive number of trials is reached. The best model is then refit
+    on its inliers.
+    :param points1: points of the first image - np.array of size (n,2)
+    :param points2: points of the second image - np.array of size (n,2)
+    :param threshold: maximal Sampson distance of an inlier, in the points units - float
+    :param seed: random seed - int
+    :return: matrix: the epipolar matrix (x2^T M x1 = 0) - np.array of size (3,3), None if there are too few points
+    :return: inliers: inlier mask of the correspondences - boolean np.array of size (n,)
+    """
+    count = len(points1)
+    if count < SAMPLE_SIZE:
+        return None, np.zeros(count, dtype=bool)
+
+    rng = np.random.default_rng(seed)
+    conditioning1, conditioning2 = _conditioning(points1), _conditioning(points2)
+    rows = _epipolar_rows(points1 @ conditioning1[:2, :2].T + conditioning1[:2, 2],
+                          points2 @ conditioning2[:2, :2].T + conditioning2[:2, 2])
+    best_matrix, best_inliers = None, np.zeros(count, dtype=bool)
+    trials, required_trials = 0, RANSAC_MAX_TRIALS
+
+    while trials < min(required_trials, RANSAC_MAX_TRIALS):
+        # Distinct random samples: the SAMPLE_SIZE smallest of random keys for each hypothesis:
+        samples = np.argpartition(rng.random((RANSAC_BATCH_SIZE, count)), SAMPLE_SIZE - 1, axis=1)[:, :SAMPLE_SIZE]
+        matrices = conditioning2.T @ _matrices_from_rows(rows[samples]) @ conditioning1
+        inliers = sampson_errors(matrices, points1, points2) < threshold ** 2
+
+        best = int(np.argmax(inliers.sum(axis=1)))
+        if inliers[best].sum() > best_inliers.sum():
+            best_matrix, best_inliers = matrices[best], inliers[best]
+
+            inlier_ratio = best_inliers.sum() / count
+            outlier_probability = max(1 - inlier_ratio ** SAMPLE_SIZE, np.finfo(np.float64).eps)
+            required_trials = int(np.ceil(np.log(1 - CONFIDENCE) / np.log(outlier_probability)))
+
+        trials += RANSAC_BATCH_SIZE
+
+    # Refit with all the inliers while it increases their number:
+    for _ in range(REFINE_ITERATIONS):
+        if best_inliers.sum() < SAMPLE_SIZE:
+            break
+
+        refined = conditioning2.T @ _matrices_from_rows(rows[best_inliers][None])[0] @ conditioning1
+        refined_inliers = sampson_errors(refined[None], points1, points2)[0] < threshold ** 2
+        if refined_inliers.sum() <= best_inliers.sum():
+            break
+        best_matrix, best_inliers = refined, refined_inliers
+
+    return best_matrix, best_inliers
+
+
+def verify_pair(points1: np.ndarray, points2: np.ndarray, matches: np.ndarray, camera_matrix: np.ndarray,
+                max_error=MAX_ERROR, min_num_inliers=MIN_NUM_INLIERS, min_inlier_ratio=MIN_INLIER_RATIO, seed=0):
+    """
+    Geometric verification of the matches of a single pair with the known intrinsics: the epipolar geometry is
+    estimated between the undistorted normalized points, and returned as the fundamental matrix of the undistorted
+    pixel coordinates.
+    :param points1: normalized points of the first image - np.array of size (n,2)
+    :param points2: normalized points of the second image - np.array of size (m,2)
+    :param matches: matching feature ids - np.array of size (k,2)
+    :param camera_matrix: the intrinsic matrix K - np.array of size (3,3)
+    :param max_error: maximal epipolar error of an inlier in pixels - float
+    :param min_num_inliers: minimal number of inliers of a verified pair - int
+    :param min_inlier_ratio: minimal fraction of inlier matches of a verified pair - float
+    :param seed: random seed - int
+    :return: (inlier_matches, F, config) as expected by COLMAPDatabase.add_two_view_geometry, or None
+    """
+    if len(matches) < max(min_num_inliers, SAMPLE_SIZE):
+        return None
+
+    threshold = max_error / np.mean((camera_matrix[0, 0], camera_matrix[1, 1]))
+    matrix, inliers = estimate_epipolar(points1[matches[:, 0]], points2[matches[:, 1]], threshold, seed)
+    if matrix is None or inliers.sum() < max(min_num_inliers, min_inlier_ratio * len(matches)):
+        return None
+
+    inverse = np.linalg.inv(camera_matrix)
+    fundamental = inverse.T @ matrix @ inverse
+
+    return matches[inliers], fundamental / np.abs(fundamental).max(), UNCALIBRATED
+
+
+def _init_verify_worker(points: list, camera_matrix: np.ndarray) -> None:
+    """
+    Pool initializer, keeps the normalized keypoints in each worker so only the pair matches are sent per task.
+    """
+    global _worker_points, _worker_camera_matrix
+    _worker_points = points
+    _worker_camera_matrix = camera_matrix
+
+
+def _verify_pair(task: tuple):
+    """
+    :param task: (image_idx1, image_idx2, matches) tuple
+    :return: the verify_pair result of the pair
+    """
+    image_idx1, image_idx2, matches = task
+    return verify_pair(_worker_points[image_idx1], _worker_points[image_idx2], matches, _worker_camera_matrix,
+                       seed=image_idx1 * len(_worker_points) + image_idx2)
+
+
+def verify_pairs(keypoints: list, matches: list, pair_ids: list, camera_matrix: np.ndarray,
+                 dist_coeffs: np.ndarray, processes=1) -> list:
+    """
+    Geometric verification of all the matched pairs, across a process pool when more than one process is requested.
+    :param keypoints: (x, y, ...) keypoints of each image - list of np.arrays
+    :param matches: matching feature ids of each pair - list of np.arrays
+    :param pair_ids: the associated image ids (1-based indexes of keypoints) - list of tuples
+    :param camera_matrix: the intrinsic matrix K - np.array of size (3,3)
+    :param dist_coeffs: distortion coefficients (k1, k2, p1, p2) - np.array
+    :param processes: number of verification processes - int
+    :return: two_view_geometries: (image_id1, image_id2, inlier_matches, F, E, H, config) of the verified pairs
+                                  (E and H are identity)
+    """
+    points = [normalize_points(kp, camera_matrix, dist_coeffs) for kp in keypoints]
+    tasks = [(image_id1 - 1, image_id2 - 1, pair_matches) for (image_id1, image_id2), pair_matches
+             in zip(pair_ids, matches)]
+
+    if processes <= 1 or len(tasks) <= 1:
+        # In-process, the worker globals are released after use:
+        _init_verify_worker(points, camera_matrix)
+        try:
+            results = [_verify_pair(task) for task in tasks]
+        finally:
+            _init_verify_worker(None, None)
+    else:
+        chunk_size = max(1, len(tasks) // (processes * 4))
+        with Pool(processes=processes, initializer=_init_verify_worker, initargs=(points, camera_matrix)) as pool:
+            results = pool.map(_verify_pair, tasks, chunksize=chunk_size)
+
+    two_view_geometries = []
+    for (image_id1, image_id2), result in zip(pair_ids, results):
+        if result is not None:
+            inlier_matches, F, config = result
+            two_view_geometries.append((image_id1, image_id2, inlier_matches, F, np.eye(3), np.eye(3), config))
+
+    return two_view_geometries
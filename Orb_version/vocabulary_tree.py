@@ -0,0 +1,273 @@
+import numpy as np
+import feature_matching as fm
+
+# Default vocabulary shape: BRANCHING_FACTOR ** DEPTH visual words:
+BRANCHING_FACTOR = 8
+DEPTH = 4
+
+# Maximal number of descriptors used to train the vocabulary, and k-majority iterations for each node:
+TRAINING_SAMPLE_SIZE = 50000
+TRAINING_ITERATIONS = 8
+
+# Number of descriptors pushed down the tree in a single NumPy block:
+TRANSFORM_BLOCK_SIZE = 4096
+
+# Hamming distance of the missing children of nodes with less than BRANCHING_FACTOR members:
+_INVALID_DISTANCE = np.iinfo(np.uint16).max
+
+
+def _distances_to_children(descriptors: np.ndarray, children: np.ndarray) -> np.ndarray:
+    """
+    :param descriptors: ORB descriptors of size (n,32) - np.array of uint8
+    :param children: the candidate centers of each descriptor of size (n,k,32) - np.array of uint8
+    :return: distances: Hamming distance of each descriptor to each of its candidate centers, size (n,k) - np.array
+    """
+    xor = np.bitwise_xor(descriptors[:, None, :], children)
+    return fm.popcount64(np.ascontiguousarray(xor).view(np.uint64)).sum(axis=2, dtype=np.uint16)
+
+
+def _k_majority(members: np.ndarray, k: int, rng) -> tuple:
+    """
+    Cluster binary descriptors with k-majority (k-means with Hamming distance and a bitwise majority vote).
+    Clusters with less than k members use every member as a center.
+    :param members: ORB descriptors of size (m,32) - np.array of uint8
+    :param k: number of clusters - int
+    :param rng: numpy random generator
+    :return: centers: cluster centers of size (min(m,k),32) - np.array of uint8
+    :return: labels: the cluster of each member - np.array of size (m,)
+    """
+    if len(members) <= k:
+        return members.copy(), np.arange(len(members))
+
+    centers = members[rng.choice(len(members), k, replace=False)]
+    bits = np.unpackbits(members, axis=1).astype(np.float32)
+    labels = None
+
+    for _ in range(TRAINING_ITERATIONS):
+        distances = _distances_to_children(members, np.broadcast_to(centers, (len(members),) + centers.shape))
+        new_labels = np.argmin(distances, axis=1)
+        if labels is not None and np.array_equal(labels, new_labels):
+            break
+        labels = new_labels
+
+        # Bitwise majority of the members of each cluster (empty clusters keep their center):
+        one_hot = (labels[None, :] == np.arange(k)[:, None]).astype(np.float32)
+        sizes = one_hot.sum(axis=1)
+        votes = one_hot @ bits
+        majority = np.packbits(votes * 2 >= sizes[:, None], axis=1)
+        centers = np.where(sizes[:, None] > 0, majority, centers)
+
+    return centers, labels
+
+
+class VocabularyTree(object):
+    """
+    Hierarchical k-majority vocabulary of binary ORB descriptors with tf-idf word weights (as in DBoW2).
+    The tree is complete: the children of node n at level l are nodes n*k .. n*k+k-1 of level l+1, and the nodes
+    of the last level are the visual words. Nodes of small clusters keep some of their children empty.
+    """
+
+    def __init__(self, centers: list, valid: list, idf: np.ndarray):
+        """
+        :param centers: the node centers of each level, size (k**(l+1),32) - list of np.arrays of uint8
+        :param valid: which nodes of each level exist, size (k**(l+1),) - list of boolean np.arrays
+        :param idf: inverse document frequency of each word - np.array of size (k**depth,)
+        """
+        self.centers = centers
+        self.valid = valid
+        self.idf = idf
+        self.branching_factor = len(centers[0])
+        self.depth = len(centers)
+
+    @property
+    def number_of_words(self) -> int:
+        return len(self.idf)
+
+    @classmethod
+    def train(cls, descriptors: list, branching_factor=BRANCHING_FACTOR, depth=DEPTH,
+              sample_size=TRAINING_SAMPLE_SIZE, seed=0):
+        """
+        Train a vocabulary on a sample of the descriptors, the idf weights are computed over all the images.
+        :param descriptors: descriptors of each image - list of np.arrays of size (n,32)
+        :param branching_factor: number of children of each node - int
+        :param depth: number of tree levels - int
+        :param sample_size: maximal number of descriptors used for clustering - int
+        :param seed: random seed, the same input gives the same vocabulary - int
+        :return: vocabulary: VocabularyTree object
+        """
+        rng = np.random.default_rng(seed)
+        k = branching_factor
+
+        sample = np.concatenate([np.asarray(d, dtype=np.uint8) for d in descriptors] +
+                                [np.zeros((0, 32), dtype=np.uint8)])
+        if len(sample) > sample_size:
+            sample = sample[np.sort(rng.choice(len(sample), sample_size, replace=False))]
+
+        centers, valid = [], []
+        node_of_member = np.zeros(len(sample), dtype=np.int64)
+
+        for level in range(depth):
+            level_centers = np.zeros((k ** (level + 1), sample.shape[1]), dtype=np.uint8)
+            level_valid = np.zeros(k ** (level + 1), dtype=bool)
+            child_of_member = np.zeros(len(sample), dtype=np.int64)
+
+            # Split each node of the previous level (its members are contiguous after sorting):
+            order = np.argsort(node_of_member, kind='stable')
+            nodes, starts = np.unique(node_of_member[order], return_index=True)
+            for node, members in zip(nodes, np.split(order, starts[1:])):
+                node_centers, labels = _k_majority(sample[members], k, rng)
+                level_centers[node * k:node * k + len(node_centers)] = node_centers
+                level_valid[node * k:node * k + len(node_centers)] = True
+                child_of_member[members] = node * k + labels
+
+            centers.append(level_centers)
+            valid.append(level_valid)
+            node_of_member = child_of_member
+
+        vocabulary = cls(centers, valid, np.ones(k ** depth, dtype=np.float32))
+
+        # Inverse document frequency of each word over the images:
+        documents = np.zeros(vocabulary.number_of_words, dtype=np.float64)
+        for image_descriptors in descriptors:
+            documents[np.unique(vocabulary.transform_words(image_descriptors))] += 1
+        vocabulary.idf = np.log(max(len(descriptors), 1) / np.maximum(documents, 1)).astype(np.float32)
+
+        return vocabulary
+
+    @classmethod
+    def load(cls, path: str):
+        """
+        :param path: path to a vocabulary saved with save() - str
+        :return: vocabulary: VocabularyTree object
+        """
+        with np.load(path) as data:
+            depth = int(data['depth'])
+            return cls([data['centers_%d' % level] for level in range(depth)],
+                       [data['valid_%d' % level] for level in range(depth)],
+                       data['idf'])
+
+    def save(self, path: str) -> None:
+        """
+        :param path: path to the saved .npz vocabulary - str
+        """
+        arrays = {'depth': np.array(self.depth), 'idf': self.idf}
+        for level in range(self.depth):
+            arrays['centers_%d' % level] = self.centers[level]
+            arrays['valid_%d' % level] = self.valid[level]
+        np.savez(path, **arrays)
+
+    def transform_words(self, descriptors: np.ndarray) -> np.ndarray:
+        """
+        Push every descriptor down the tree to its visual word, O(depth * branching_factor) for each descriptor.
+        :param descriptors: ORB descriptors of size (n,32) - np.array of uint8
+        :return: words: visual word of each descriptor - np.array of size (n,)
+        """
+        descriptors = np.ascontiguousarray(descriptors, dtype=np.uint8)
+        words = np.zeros(len(descriptors), dtype=np.int64)
+        children = np.arange(self.branching_factor)
+
+        for start in range(0, len(descriptors), TRANSFORM_BLOCK_SIZE):
+            block = descriptors[start:start + TRANSFORM_BLOCK_SIZE]
+            node = np.zeros(len(block), dtype=np.int64)
+
+            for level in range(self.depth):
+                child_ids = node[:, None] * self.branching_factor + children
+                distances = _distances_to_children(block, self.centers[level][child_ids])
+                distances[~self.valid[level][child_ids]] = _INVALID_DISTANCE
+                node = child_ids[np.arange(len(block)), np.argmin(distances, axis=1)]
+
+            words[start:start + len(block)] = node
+
+        return words
+
+    def transform(self, descriptors: np.ndarray) -> tuple:
+        """
+        :param descriptors: ORB descriptors of size (n,32) - np.array of uint8
+        :return: words, weights: the L1 normalized tf-idf bag-of-words vector of the image (sparse) - np.arrays
+        """
+        words, counts = np.unique(self.transform_words(descriptors), return_counts=True)
+        weights = counts * self.idf[words]
+        norm = weights.sum()
+
+        return words, (weights / norm if norm > 0 else weights).astype(np.float32)
+
+
+class LoopClosureIndex(object):
+    """
+    Inverted file of the images bag-of-words vectors. A query only visits the images sharing a word with it,
+    and scores them with the DBoW2 L1 score, 1 - |v1 - v2| / 2 for L1 normalized vectors.
+    """
+
+    def __init__(self, vocabulary: VocabularyTree):
+        """
+        :param vocabulary: VocabularyTree object
+        """
+        self.vocabulary = vocabulary
+        self.bows = []
+        self._offsets = None
+
+    def __len__(self) -> int:
+        return len(self.bows)
+
+    def add(self, descriptors: np.ndarray) -> int:
+        """
+        :param descriptors: ORB descriptors of the next image of the sequence - np.array of size (n,32)
+        :return: image_idx: index of the added image - int
+        """
+        self.bows.append(self.vocabulary.transform(descriptors))
+        self._offsets = None
+        return len(self.bows) - 1
+
+    def _build(self) -> None:
+        """
+        Build the inverted file as CSR arrays: the postings of word w are _images/_weights[_offsets[w]:_offsets[w+1]].
+        """
+        words = np.concatenate([bow[0] for bow in self.bows] + [np.zeros(0, dtype=np.int64)])
+        weights = np.concatenate([bow[1] for bow in self.bows] + [np.zeros(0, dtype=np.float32)])
+        images = np.repeat(np.arange(len(self.bows)), [len(bow[0]) for bow in self.bows])
+
+        order = np.argsort(words, kind='stable')
+        self._images, self._weights = images[order], weights[order]
+        self._offsets = np.concatenate(([0], np.cumsum(np.bincount(words, minlength=self.vocabulary.number_of_words))))
+
+    def scores(self, image_idx: int) -> np.ndarray:
+        """
+        :param image_idx: index of the query image - int
+        :return: scores: similarity in [0,1] of the query image to every indexed image - np.array of size (n,)
+        """
+        if self._offsets is None:
+            self._build()
+
+        words, weights = self.bows[image_idx]
+        starts = self._offsets[words]
+        lengths = self._offsets[words + 1] - starts
+
+        # Gather the postings of all the query words at once:
+        first = np.cumsum(lengths) - lengths
+        postings = np.repeat(starts - first, lengths) + np.arange(lengths.sum())
+        query_weights = np.repeat(weights, lengths)
+        posting_weights = self._weights[postings]
+
+        common = query_weights + posting_weights - np.abs(query_weights - posting_weights)
+        return 0.5 * np.bincount(self._images[postings], common, minlength=len(self.bows))
+
+    def candidates(self, top_k=5, min_gap=1, min_score=0.0) -> list:
+        """
+        Loop-closure candidates of all the images.
+        :param top_k: maximal number of candidates for each image - int
+        :param min_gap: minimal index difference of a candidate pair (closer images are matched sequentially) - int
+        :param min_score: minimal similarity score of a candidate pair - float
+        :return: pairs: sorted list of (image_idx1, image_idx2) candidate pairs, image_idx1 < image_idx2
+        """
+        pairs = set()
+        indexes = np.arange(len(self.bows))
+
+        for image_idx in range(len(self.bows)):
+            scores = self.scores(image_idx)
+            scores[np.abs(indexes - image_idx) < min_gap] = -1
+
+            best = np.argsort(-scores, kind='stable')[:top_k]
+            for candidate in best[scores[best] > max(min_score, 0.0)]:
+                pairs.add((min(image_idx, candidate), max(image_idx, candidate)))
+
+        return sorted((int(image_idx1), int(image_idx2)) for image_idx1, image_idx2 in pairs)
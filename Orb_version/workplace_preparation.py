@@ -1,4 +1,3 @@
-import math
 import deepdish as dd
 import shutil
 import subprocess
@@ -7,54 +6,44 @@ from argparse import ArgumentParser
 from threading import Thread
 import numpy as np
 from matplotlib import pyplot as plt
+from frame_source import VIDEO_FILE_NAME, DEFAULT_NUMBER_OF_FRAMES, FRAME_NAME_FORMAT, FrameProgress, extract_frames
+from bootstrap_pose import estimate_first_pose, write_cameras_file
 
 number_of_images_in_temp_model = 10
 
+# A camera pose line of images.txt (IMAGE_ID, QW, QX, QY, QZ, TX, TY, TZ, CAMERA_ID, NAME) and its empty POINTS2D line:
+IMAGE_LINE_FORMAT = '{0} {1} {2} {3} {4} {5} {6} {7} 1 image{0}.jpg\n\n'
 
-def parse_args() -> str:
+
+def parse_args() -> tuple:
     """
     Function to parse user argument
-    :return: workspace_path
+    :return: workspace_path, keyframes (boolean flag for the keyframe selection), temp_model (boolean flag for
+             the temporary COLMAP model)
     """
     ap = ArgumentParser(description='Create camera_pose files.')
     ap.add_argument('--workspace_path', required=True)
+    ap.add_argument('--keyframes', action='store_true',
+                    help='keep only the sharp keyframes the camera moved to (at most one for each image slot)')
+    ap.add_argument('--temp_model', action='store_true',
+                    help='always get the first image pose from a temporary COLMAP model, instead of the in-process '
+                         'two-view bootstrap (the temporary model is otherwise only the fallback of the bootstrap)')
     args = vars(ap.parse_args())
-    return args['workspace_path']
+    return args['workspace_path'], args['keyframes'], args['temp_model']
 
 
-def remove_extra_images(path_to_images: str, number_of_images: int) -> None:
-    """
-    The function removes all the extra images created in the images folder
-    :param path_to_images: path to the model images folder
-    :param number_of_images: the number of images to reconstruct our model
+def prepare_video(path_to_video: str, number_of_images=DEFAULT_NUMBER_OF_FRAMES, keyframes=False,
+                  progress=None) -> None:
     """
-    last_image = 'image' + str(number_of_images) + '.jpg'
-    while last_image in listdir(path_to_images):
-        last_image_path = path.join(path_to_images, last_image)
-        remove(last_image_path)
-        print(f"remove {last_image}")
-        number_of_images += 1
-        last_image = 'image' + str(number_of_images) + '.jpg'
-
-
-def prepare_video(path_to_video: str, number_of_images=87) -> None:
-    """
-    The function prepares the images for our model based on a given video
-    :param path_to_video: video in h264 format
+    The function prepares the images for our model based on a given video, the video is decoded in-process (no
+    temporary mp4 and no extra images to remove)
+    :param path_to_video: path to the folder of the video in h264 format
     :param number_of_images: the number of images to reconstruct our model (87 by default)
+    :param keyframes: boolean flag for keeping only the sharp keyframes the camera moved to (see
+                      frame_source.read_keyframes), some of the image names are then missing
+    :param progress: frame_source.FrameProgress the written images are published to (see create_temp_model)
     """
-
-    temp_video = path.join(path_to_video, 'temp_outpy.mp4')
-    video = path.join(path_to_video, 'outpy.h264')
-
-    # create mp4 video for metadata and compute video duration
-    subprocess.run(['ffmpeg', '-i', video, '-c', 'copy', temp_video])
-    result = subprocess.run(["ffprobe", "-v", "error", "-show_entries",
-                             "format=duration", "-of",
-                             "default=noprint_wrappers=1:nokey=1", temp_video],
-                            stdout=subprocess.PIPE,
-                            stderr=subprocess.STDOUT)
-    video_duration = float(result.stdout)
+    video = path.join(path_to_video, VIDEO_FILE_NAME)
 
     # create images folder
     path_to_images = path.join(path_to_video, 'images')
@@ -62,19 +51,16 @@ def prepare_video(path_to_video: str, number_of_images=87) -> None:
         shutil.rmtree(path_to_images)
     makedirs(path_to_images)
 
-    # split the given video into images
-    subprocess.run(['ffmpeg', '-i', temp_video, '-r', str(number_of_images / video_duration), '-f', 'image2',
-                    path.join(path_to_images, 'image%d.jpg')])
-
-    # remove extra files
-    remove_extra_images(path_to_images, number_of_images)
-    remove(temp_video)
+    # split the given video into images (color images for COLMAP)
+    extract_frames(video, number_of_images, path_to_images, grayscale=False, keyframes=keyframes,
+                   progress=progress)
 
 
-def create_temp_model(temp_dir_path: str) -> str:
+def create_temp_model(temp_dir_path: str, progress: FrameProgress) -> str:
     """
     The function prepares the images for our model based on a given video
     :param temp_dir_path: video in h264 format
+    :param progress: frame_source.FrameProgress of the images written by prepare_video
     :return number_of_images: path to temporary model folder
     """
 
@@ -85,19 +71,13 @@ def create_temp_model(temp_dir_path: str) -> str:
     # remove old temporary folder if exists
     if path.exists(path_to_temp_model) and path.isdir(path_to_temp_model):
         shutil.rmtree(path_to_temp_model)
+    makedirs(path_to_temp_images)
 
-    number_of_temp_images = 0
+    # take only part of the images for the temp model (sleeps until prepare_video has written them, which is after
+    # it decoded the whole video)
     path_to_images = path.join(temp_dir_path, 'images')
-
-    # take only part of the images for the temp model
-    while number_of_temp_images < number_of_images_in_temp_model:
-        try:
-            number_of_temp_images = len([name for name in listdir(path_to_images) if name.endswith('.jpg')])
-        except FileNotFoundError:
-            number_of_temp_images = 0
-
-    # copy subdirectory example
-    shutil.copytree(path_to_images, path_to_temp_images)
+    for name in progress.wait(number_of_images_in_temp_model):
+        shutil.copy(path.join(path_to_images, name), path_to_temp_images)
 
     # run colmap to create model for the first 10 images in video
     subprocess.run(['colmap', 'automatic_reconstructor',
@@ -107,77 +87,92 @@ def create_temp_model(temp_dir_path: str) -> str:
     return path_to_temp_model
 
 
+def quaternions_to_rotation_matrices(quaternions: np.ndarray) -> np.ndarray:
+    """
+    The function converts quaternion vectors to rotation matrices, all at once
+    https://automaticaddison.com/how-to-convert-a-quaternion-to-a-rotation-matrix/
+    :param quaternions: (qw, qx, qy, qz) of each rotation - np.array of size (n,4)
+    :return rot_matrices: rotation matrices - np.array of size (n,3,3)
+    """
+    quaternions = np.asarray(quaternions, dtype=np.float64).reshape(-1, 4)
+    q0, q1, q2, q3 = (quaternions / np.linalg.norm(quaternions, axis=1, keepdims=True)).T
+
+    return np.stack([2 * (q0 * q0 + q1 * q1) - 1, 2 * (q1 * q2 - q0 * q3), 2 * (q1 * q3 + q0 * q2),
+                     2 * (q1 * q2 + q0 * q3), 2 * (q0 * q0 + q2 * q2) - 1, 2 * (q2 * q3 - q0 * q1),
+                     2 * (q1 * q3 - q0 * q2), 2 * (q2 * q3 + q0 * q1), 2 * (q0 * q0 + q3 * q3) - 1],
+                    axis=1).reshape(-1, 3, 3)
+
+
 def quaternion_to_rotation_matrix(q0, q1, q2, q3) -> np:
     """
     The function converts the quaternion vector to a rotation matrix
-    https://automaticaddison.com/how-to-convert-a-quaternion-to-a-rotation-matrix/
     :param q0: the value of qw
     :param q1: the value of qx
     :param q2: the value of qy
     :param q3: the value of qz
     :return rot_matrix: rotation matrix 3x3 as NumPy array
     """
+    return quaternions_to_rotation_matrices([q0, q1, q2, q3])[0]
 
-    # First row of the rotation matrix
-    r00 = 2 * (q0 * q0 + q1 * q1) - 1
-    r01 = 2 * (q1 * q2 - q0 * q3)
-    r02 = 2 * (q1 * q3 + q0 * q2)
-
-    # Second row of the rotation matrix
-    r10 = 2 * (q1 * q2 + q0 * q3)
-    r11 = 2 * (q0 * q0 + q2 * q2) - 1
-    r12 = 2 * (q2 * q3 - q0 * q1)
 
-    # Third row of the rotation matrix
-    r20 = 2 * (q1 * q3 - q0 * q2)
-    r21 = 2 * (q2 * q3 + q0 * q1)
-    r22 = 2 * (q0 * q0 + q3 * q3) - 1
+def rotation_matrices_to_quaternions(rotation_matrices: np.ndarray) -> np.ndarray:
+    """
+    The function converts rotation matrices to quaternion vectors in closed form, all at once.
+    Row i of the symmetric matrix k is 4 * q_i * q, the row of the largest diagonal element (largest |q_i|) is
+    used for each matrix so it never divides by a small number.
+    :param rotation_matrices: rotation matrices - np.array of size (n,3,3)
+    :return quaternions: (qw, qx, qy, qz) of each rotation, with qw >= 0 - np.array of size (n,4)
+    """
+    r = np.asarray(rotation_matrices, dtype=np.float64).reshape(-1, 3, 3)
+    r00, r01, r02 = r[:, 0, 0], r[:, 0, 1], r[:, 0, 2]
+    r10, r11, r12 = r[:, 1, 0], r[:, 1, 1], r[:, 1, 2]
+    r20, r21, r22 = r[:, 2, 0], r[:, 2, 1], r[:, 2, 2]
 
-    # 3x3 rotation matrix
-    rot_matrix = np.array([[r00, r01, r02],
-                           [r10, r11, r12],
-                           [r20, r21, r22]])
+    k = np.stack([1 + r00 + r11 + r22, r21 - r12, r02 - r20, r10 - r01,
+                  r21 - r12, 1 + r00 - r11 - r22, r01 + r10, r02 + r20,
+                  r02 - r20, r01 + r10, 1 - r00 + r11 - r22, r12 + r21,
+                  r10 - r01, r02 + r20, r12 + r21, 1 - r00 - r11 + r22], axis=1).reshape(-1, 4, 4)
+    largest = np.argmax(np.diagonal(k, axis1=1, axis2=2), axis=1)
 
-    return rot_matrix
+    quaternions = k[np.arange(len(k)), largest]
+    quaternions /= np.linalg.norm(quaternions, axis=1, keepdims=True)
+    quaternions[quaternions[:, 0] < 0] *= -1
+    return quaternions
 
 
-def rotation_matrix_to_quaternion(rotation_matrix: np) -> object:
+def get_bootstrap_pose(workspace_path: str, progress: FrameProgress) -> list:
     """
-    The function converts rotation matrix to quaternion vector
-    https://learnopencv.com/rotation-matrix-to-euler-angles/
-    :param rotation_matrix: rotation matrix 3x3 represented by NumPy array
-    :return quaternion vector: defined by (qx, qy, qz, qw)
+    The function estimates the absolut R & T of the first image in-process, from the same images as the temp model
+    (see bootstrap_pose), in seconds instead of running colmap
+    :param workspace_path: path to workspace_path
+    :param progress: frame_source.FrameProgress of the images written by prepare_video
+    :return R&T: R = list[0], T list[1] or an empty list if it can't be estimated
     """
+    # (the first images are written only after the whole video is decoded, see frame_source.FrameProgress)
+    names = progress.wait(number_of_images_in_temp_model)
+    if not names or names[0] != FRAME_NAME_FORMAT.format(1):
+        return []
 
-    cosine_for_pitch = math.sqrt(rotation_matrix[0][0] ** 2 + rotation_matrix[1][0] ** 2)
-    is_singular = cosine_for_pitch < 10 ** -6
-    if not is_singular:
-        yaw = math.atan2(rotation_matrix[1][0], rotation_matrix[0][0])
-        pitch = math.atan2(-rotation_matrix[2][0], cosine_for_pitch)
-        roll = math.atan2(rotation_matrix[2][1], rotation_matrix[2][2])
-    else:
-        yaw = math.atan2(-rotation_matrix[1][2], rotation_matrix[1][1])
-        pitch = math.atan2(-rotation_matrix[2][0], cosine_for_pitch)
-        roll = 0
-
-    e = (yaw, pitch, roll)
+    pose = estimate_first_pose([path.join(workspace_path, 'images', name) for name in names])
+    if pose is None:
+        return []
 
-    return euler_to_quaternion(e)
+    return get_reference_pose(rotation_matrices_to_quaternions(pose[0])[0], pose[1])
 
 
-def euler_to_quaternion(euler: tuple) -> object:
+def get_reference_pose(quaternion: np.ndarray, translation: np.ndarray) -> list:
     """
-    The function convert Euler angle to quaternion object
-    :param Euler: angle represented by yaw, pitch, roll
-    :return quaternion vector: defined by (qx, qy, qz, qw)
+    The function converts a COLMAP camera pose to the axes of the reference camera poses (the Y-Axis and the Z-Axis
+    are replaced)
+    :param quaternion: (qw, qx, qy, qz) of the COLMAP camera pose - np.array
+    :param translation: (tx, ty, tz) of the COLMAP camera pose - np.array
+    :return R&T: R = list[0], T list[1]
     """
-
-    (yaw, pitch, roll) = (euler[0], euler[1], euler[2])
-    qy = np.sin(roll / 2) * np.cos(pitch / 2) * np.cos(yaw / 2) - np.cos(roll / 2) * np.sin(pitch / 2) * np.sin(yaw / 2)
-    qx = np.cos(roll / 2) * np.sin(pitch / 2) * np.cos(yaw / 2) + np.sin(roll / 2) * np.cos(pitch / 2) * np.sin(yaw / 2)
-    qw = np.cos(roll / 2) * np.cos(pitch / 2) * np.sin(yaw / 2) - np.sin(roll / 2) * np.sin(pitch / 2) * np.cos(yaw / 2)
-    qz = np.cos(roll / 2) * np.cos(pitch / 2) * np.cos(yaw / 2) + np.sin(roll / 2) * np.sin(pitch / 2) * np.sin(yaw / 2)
-    return qx, qy, qz, qw
+    qw, qx, qz, qy = quaternion
+    tx, tz, ty = translation
+    rotation_matrix = quaternion_to_rotation_matrix(qw, qx, qy, qz)
+    translation_vector = np.array([tx, ty, tz])
+    return [rotation_matrix, translation_vector]
 
 
 def get_first_image_pose(image_src: str) -> list:
@@ -198,16 +193,7 @@ def get_first_image_pose(image_src: str) -> list:
 
         # convert and return the camera pose for the first image in model
         if image_id == 1:
-            qw = float(columns[1])
-            qx = float(columns[2])
-            qy = float(columns[4])
-            qz = float(columns[3])
-            rotation_matrix = quaternion_to_rotation_matrix(qw, qx, qy, qz)
-            tx = float(columns[5])
-            ty = float(columns[7])
-            tz = float(columns[6])
-            translation_vector = np.array([tx, ty, tz])
-            return [rotation_matrix, translation_vector]
+            return get_reference_pose(np.array(columns[1:5], dtype=float), np.array(columns[5:8], dtype=float))
 
     return []
 
@@ -241,6 +227,35 @@ def draw_rel_camera_pose(image: int, origin: list, camera_pose: list, plot_dir_p
     plt.clf()
 
 
+def get_pose_chain(camera_pose_dict: dict) -> tuple:
+    """
+    The function stacks the camera poses of a dictionary, in the order of its images
+    :param camera_pose_dict: dictionary of R&T camera poses for each image
+    :return: images: list of image numbers, rotations: np.array of size (n,3,3), translations: np.array of size (n,3)
+    """
+    images = list(camera_pose_dict.keys())
+    rotations = np.array([camera_pose_dict[image][0] for image in images], dtype=np.float64).reshape(-1, 3, 3)
+    translations = np.array([camera_pose_dict[image][1] for image in images], dtype=np.float64).reshape(-1, 3)
+    return images, rotations, translations
+
+
+def compose_rotations(rotations: np.ndarray) -> np.ndarray:
+    """
+    The function composes a chain of rotations, all at once: rotation i of the result is
+    rotations[i] @ ... @ rotations[1] @ rotations[0]
+    The inclusive scan doubles its step at each pass (Hillis-Steele), log2(n) batched matrix products instead of n
+    dependent products
+    :param rotations: the chain of rotations - np.array of size (n,3,3)
+    :return composed_rotations: the cumulative products - np.array of size (n,3,3)
+    """
+    composed_rotations = np.array(rotations, dtype=np.float64).reshape(-1, 3, 3)
+    step = 1
+    while step < len(composed_rotations):
+        composed_rotations[step:] = composed_rotations[step:] @ composed_rotations[:-step]
+        step *= 2
+    return composed_rotations
+
+
 def compute_absolut_camera_pose(camera_pose_rel_dict: dict, first_image_pose: list,
                                 workspace_path: str, do_plot=False) -> dict:
     """
@@ -257,40 +272,25 @@ def compute_absolut_camera_pose(camera_pose_rel_dict: dict, first_image_pose: li
     if do_plot:
         makedirs(ref_pose_images_path)
 
-    # initialize parameters for computing absolut camera poses
-    camera_pose_recover = {}
-    rotation = first_image_pose[0]
-    translation = first_image_pose[1]
-
-    is_first = True
-
-    prev_rotation = np.identity(3)
-    prev_translation = np.zeros(3)
-
-    # foreach image compute the absolut pose out of the reference pose
-    for image in camera_pose_rel_dict.keys():
-        rel_rotation = camera_pose_rel_dict[image][0]
-        rel_translation = camera_pose_rel_dict[image][1]
-
-        # for the first image, take the values from the temporary model
-        if not is_first:
-            rotation = rel_rotation @ np.linalg.inv(prev_rotation.T)
-            translation = rel_translation + prev_translation
-
-        # compute the absolut camera pose
-        camera_pose = rotation + translation
+    if not camera_pose_rel_dict:
+        return {}
 
-        if do_plot:
-            draw_rel_camera_pose(image, translation, camera_pose, ref_pose_images_path)
+    # for the first image, take the values from the temporary model
+    images, rotations, translations = get_pose_chain(camera_pose_rel_dict)
+    rotations[0] = first_image_pose[0]
+    translations[0] = first_image_pose[1]
 
-        # save the values foreach image (in R & T format)
-        camera_pose_recover[image] = [rotation, translation]
+    # compute the absolut pose of all the images out of the reference poses:
+    # R_i = rel_R_i @ R_i-1 and T_i = rel_T_i + T_i-1
+    rotations = compose_rotations(rotations)
+    translations = np.cumsum(translations, axis=0)
 
-        prev_rotation = rotation
-        prev_translation = translation
-        is_first = False
+    if do_plot:
+        for image, rotation, translation in zip(images, rotations, translations):
+            draw_rel_camera_pose(image, translation, rotation + translation, ref_pose_images_path)
 
-    return camera_pose_recover
+    # save the values foreach image (in R & T format)
+    return {image: [rotation, translation] for image, rotation, translation in zip(images, rotations, translations)}
 
 
 def write_camera_pose_to_file(camera_pose_abs_dict: dict, pose_dir_path: str) -> None:
@@ -299,36 +299,30 @@ def write_camera_pose_to_file(camera_pose_abs_dict: dict, pose_dir_path: str) ->
     :param camera_pose_abs_dict: A dictionary of recovered camera poses for each image
     :param pose_dir_path: path to image file
     """
+    # convert all the rotations at once
+    images, rotations, translations = get_pose_chain(camera_pose_abs_dict)
+    quaternions = rotation_matrices_to_quaternions(rotations)
+
+    # format all the camera poses (and their empty POINTS2D line) in a single block
+    lines = map(IMAGE_LINE_FORMAT.format, images, *quaternions.T.tolist(), *translations.T.tolist())
+
     image_dst = path.join(pose_dir_path, 'images.txt')
     with open(image_dst, 'w+') as file:
         file.write('# Image list with two lines of data per image:\n')
         file.write('#   IMAGE_ID, QW, QX, QY, QZ, TX, TY, TZ, CAMERA_ID, NAME\n')
         file.write('#   POINTS2D[] as (X, Y, POINT3D_ID)\n')
-        file.write(f'# Number of images: {len(camera_pose_abs_dict.keys())}\n')
-
-        # write each camera pose to file
-        for image in camera_pose_abs_dict.keys():
-            image_pose_data = []
-            t_vector = camera_pose_abs_dict[image][1]
-            qx, qy, qz, qw = rotation_matrix_to_quaternion(camera_pose_abs_dict[image][0])
-
-            image_pose_data.append(str(image))
-            # image_pose_data.append(f'{qw} {qx} {qy} {qz}')
-            image_pose_data.append(f'{qz} {qy} {qx} {qw}')
-            image_pose_data.append(' '.join(map(str, t_vector)))
-            image_pose_data.append('1')
-            image_pose_data.append(f'image{image}.jpg')
-
-            file.write(' '.join(image_pose_data) + '\n\n')
+        file.write(f'# Number of images: {len(images)}\n')
+        file.write(''.join(lines))
 
 
 def clear_workspace(workspace_path: str) -> None:
     """
-    The function deletes all the files in the workspace folder except the input video
+    The function deletes all the files in the workspace folder except the input video, the feature cache
+    and the runs report
     """
     # make sure the workspace in empty
     for filename in listdir(workspace_path):
-        if filename.endswith('.h264'):
+        if filename.endswith('.h264') or filename in ('feature_cache', 'sfm_report.jsonl'):
             continue
         path_to_node = path.join(workspace_path, filename)
         if path.isdir(path_to_node):
@@ -339,33 +333,42 @@ def clear_workspace(workspace_path: str) -> None:
 
 def main():
     # Parse input arguments:
-    workspace_path = parse_args()
+    workspace_path, keyframes, temp_model = parse_args()
 
     clear_workspace(workspace_path)
 
     # prepare video and create the images for our model
-    video_thread = Thread(target=prepare_video, args=(workspace_path, 87))
+    progress = FrameProgress()
+    video_thread = Thread(target=prepare_video, args=(workspace_path, DEFAULT_NUMBER_OF_FRAMES, keyframes, progress))
     video_thread.start()
 
-    # create temp folder for temp model
-    temp_model_workspace_path = create_temp_model(workspace_path)
-
     # create camera pose parameters
     pose_output_path = path.join(workspace_path, 'camera_poses')
     makedirs(pose_output_path)
-
-    # create camera input file
-    camera_src = path.join(temp_model_workspace_path, 'sparse/0/cameras.txt')
     camera_dst = path.join(pose_output_path, 'cameras.txt')
-    shutil.copyfile(camera_src, camera_dst)
 
     # create an empty points input file
     points_dst = path.join(pose_output_path, 'points3D.txt')
     open(points_dst, 'w').close()
 
-    # get camera poses for first image
-    image_src = path.join(temp_model_workspace_path, 'sparse/0/images.txt')
-    first_image_pose = get_first_image_pose(image_src)
+    # get camera poses for first image, in-process with the calibrated camera
+    first_image_pose = [] if temp_model else get_bootstrap_pose(workspace_path, progress)
+    if first_image_pose:
+        write_cameras_file(camera_dst)
+    else:
+        if not temp_model:
+            print("Bootstrap can't compute the camera pose for the first image - creating a temp model")
+
+        # create temp folder for temp model
+        temp_model_workspace_path = create_temp_model(workspace_path, progress)
+
+        # create camera input file
+        camera_src = path.join(temp_model_workspace_path, 'sparse/0/cameras.txt')
+        shutil.copyfile(camera_src, camera_dst)
+
+        # get camera poses for first image
+        image_src = path.join(temp_model_workspace_path, 'sparse/0/images.txt')
+        first_image_pose = get_first_image_pose(image_src)
 
     if not first_image_pose:
         print("Error in temp model - cant compute the camera pose for the first image")
@@ -0,0 +1,222 @@
+# Copyright (c) 2018, ETH Zurich and UNC Chapel Hill.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#
+#     * Neither the name of ETH Zurich and UNC Chapel Hill nor the names of
+#       its contributors may be used to endorse or promote products derived
+#       from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDERS OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import time
+import argparse
+import multiprocessing
+from tempfile import mkdtemp
+import numpy as np
+from read_write_model import read_next_bytes, write_next_bytes, \
+    read_images_binary, read_images_binary_arrays, \
+    read_points3d_binary, read_points3d_binary_arrays, \
+    write_images_binary_arrays, write_points3d_binary, \
+    write_points3d_binary_arrays, write_points3D_text_arrays, \
+    ImagesArrays, Points3DArrays
+
+
+def read_points3d_binary_struct(path_to_model_file):
+    """Per-record struct.unpack reader (the previous read_points3d_binary),
+    kept as the baseline of the benchmark."""
+    points3D = {}
+    with open(path_to_model_file, "rb") as fid:
+        num_points = read_next_bytes(fid, 8, "Q")[0]
+        for _ in range(num_points):
+            properties = read_next_bytes(
+                fid, num_bytes=43, format_char_sequence="QdddBBBd")
+            track_length = read_next_bytes(
+                fid, num_bytes=8, format_char_sequence="Q")[0]
+            track_elems = read_next_bytes(
+                fid, num_bytes=8*track_length,
+                format_char_sequence="ii"*track_length)
+            points3D[properties[0]] = (
+                np.array(properties[1:4]), np.array(properties[4:7]),
+                np.array(properties[7]),
+                np.array(tuple(map(int, track_elems[0::2]))),
+                np.array(tuple(map(int, track_elems[1::2]))))
+    return points3D
+
+
+def read_images_binary_struct(path_to_model_file):
+    """Per-record struct.unpack reader (the previous read_images_binary),
+    kept as the baseline of the benchmark."""
+    images = {}
+    with open(path_to_model_file, "rb") as fid:
+        num_reg_images = read_next_bytes(fid, 8, "Q")[0]
+        for _ in range(num_reg_images):
+            properties = read_next_bytes(
+                fid, num_bytes=64, format_char_sequence="idddddddi")
+            image_name = ""
+            current_char = read_next_bytes(fid, 1, "c")[0]
+            while current_char != b"\x00":
+                image_name += current_char.decode("utf-8")
+                current_char = read_next_bytes(fid, 1, "c")[0]
+            num_points2D = read_next_bytes(fid, num_bytes=8,
+                                           format_char_sequence="Q")[0]
+            x_y_id_s = read_next_bytes(fid, num_bytes=24*num_points2D,
+                                       format_char_sequence="ddq"*num_points2D)
+            images[properties[0]] = (
+                np.column_stack([tuple(map(float, x_y_id_s[0::3])),
+                                 tuple(map(float, x_y_id_s[1::3]))]),
+                np.array(tuple(map(int, x_y_id_s[2::3]))), image_name)
+    return images
+
+
+def write_points3d_binary_struct(points3D, path_to_model_file):
+    """Per-element struct.pack writer (the previous write_points3d_binary),
+    kept as the baseline of the benchmark."""
+    with open(path_to_model_file, "wb") as fid:
+        write_next_bytes(fid, len(points3D), "Q")
+        for _, pt in points3D.items():
+            write_next_bytes(fid, pt.id, "Q")
+            write_next_bytes(fid, pt.xyz.tolist(), "ddd")
+            write_next_bytes(fid, pt.rgb.tolist(), "BBB")
+            write_next_bytes(fid, pt.error, "d")
+            track_length = pt.image_ids.shape[0]
+            write_next_bytes(fid, track_length, "Q")
+            for image_id, point2D_id in zip(pt.image_ids, pt.point2D_idxs):
+                write_next_bytes(fid, [image_id, point2D_id], "ii")
+
+
+def write_points3D_text_join(points3D, path):
+    """Per-point string join writer (the previous write_points3D_text),
+    kept as the baseline of the benchmark."""
+    with open(path, "w") as fid:
+        for _, pt in points3D.items():
+            point_header = [pt.id, *pt.xyz, *pt.rgb, pt.error]
+            fid.write(" ".join(map(str, point_header)) + " ")
+            track_strings = []
+            for image_id, point2D in zip(pt.image_ids, pt.point2D_idxs):
+                track_strings.append(" ".join(map(str, [image_id, point2D])))
+            fid.write(" ".join(track_strings) + "\n")
+
+
+def write_synthetic_model(path, num_points, num_images, num_points2D, seed=0):
+    """Write random points3D.bin and images.bin files (tracks of 2 to 6
+    images) with the NumPy writers, so that large models are created
+    quickly."""
+    rng = np.random.default_rng(seed)
+
+    track_lengths = rng.integers(2, 7, size=num_points)
+    track_offsets = np.concatenate(([0], np.cumsum(track_lengths)))
+    write_points3d_binary_arrays(Points3DArrays(
+        ids=np.arange(1, num_points + 1), xyz=rng.normal(size=(num_points, 3)),
+        rgb=rng.integers(0, 256, size=(num_points, 3)),
+        error=rng.random(num_points), track_offsets=track_offsets,
+        image_ids=rng.integers(1, num_images + 1, size=track_offsets[-1]),
+        point2D_idxs=rng.integers(0, num_points2D, size=track_offsets[-1])),
+        os.path.join(path, "points3D.bin"))
+
+    qvecs = np.zeros((num_images, 4))
+    qvecs[:, 0] = 1
+    write_images_binary_arrays(ImagesArrays(
+        ids=np.arange(1, num_images + 1), qvecs=qvecs,
+        tvecs=rng.normal(size=(num_images, 3)),
+        camera_ids=np.ones(num_images, dtype=np.int64),
+        names=["image{}.jpg".format(i) for i in range(1, num_images + 1)],
+        point2D_offsets=num_points2D * np.arange(num_images + 1),
+        xys=rng.random((num_images * num_points2D, 2)) * 640,
+        point3D_ids=-np.ones(num_images * num_points2D, dtype=np.int64)),
+        os.path.join(path, "images.bin"))
+
+
+def benchmark(name, function, path, baseline=None):
+    start = time.time()
+    function(path)
+    elapsed = time.time() - start
+    speedup = "" if baseline is None else "%8.1fx" % (baseline / elapsed)
+    print("  %-44s %8.2f s %s" % (name, elapsed, speedup))
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the model readers and writers on a synthetic model")
+    parser.add_argument("--num_points", type=int, default=1000000)
+    parser.add_argument("--num_images", type=int, default=1000)
+    parser.add_argument("--num_points2D", type=int, default=2000,
+                        help="number of 2D points of each image")
+    parser.add_argument("--num_workers", type=int,
+                        default=multiprocessing.cpu_count())
+    parser.add_argument("--path", default=None,
+                        help="folder of the synthetic model (temporary)")
+    args = parser.parse_args()
+
+    path = args.path if args.path is not None else mkdtemp()
+    write_synthetic_model(path, args.num_points, args.num_images,
+                          args.num_points2D)
+    points_path = os.path.join(path, "points3D.bin")
+    images_path = os.path.join(path, "images.bin")
+
+    print("points3D.bin: %d points" % args.num_points)
+    baseline = benchmark("struct.unpack per record",
+                         read_points3d_binary_struct, points_path)
+    benchmark("read_points3d_binary_arrays", read_points3d_binary_arrays,
+              points_path, baseline)
+    benchmark("read_points3d_binary", read_points3d_binary, points_path,
+              baseline)
+
+    print("images.bin: %d images, %d 2D points each" %
+          (args.num_images, args.num_points2D))
+    baseline = benchmark("struct.unpack per record",
+                         read_images_binary_struct, images_path)
+    benchmark("read_images_binary_arrays", read_images_binary_arrays,
+              images_path, baseline)
+    benchmark("read_images_binary", read_images_binary, images_path,
+              baseline)
+
+    print("writing points3D: %d points" % args.num_points)
+    points3D = read_points3d_binary(points_path)
+    points3D_arrays = read_points3d_binary_arrays(points_path)
+    output_path = os.path.join(path, "output")
+    baseline = benchmark(
+        "struct.pack per element",
+        lambda path: write_points3d_binary_struct(points3D, path),
+        output_path)
+    benchmark("write_points3d_binary",
+              lambda path: write_points3d_binary(points3D, path),
+              output_path, baseline)
+    benchmark("write_points3d_binary_arrays",
+              lambda path: write_points3d_binary_arrays(points3D_arrays, path),
+              output_path, baseline)
+    baseline = benchmark(
+        "text, string join per point",
+        lambda path: write_points3D_text_join(points3D, path), output_path)
+    benchmark("write_points3D_text_arrays",
+              lambda path: write_points3D_text_arrays(points3D_arrays, path),
+              output_path, baseline)
+    benchmark("write_points3D_text_arrays (%d processes)" % args.num_workers,
+              lambda path: write_points3D_text_arrays(
+                  points3D_arrays, path, args.num_workers),
+              output_path, baseline)
+    os.remove(output_path)
+
+
+if __name__ == "__main__":
+    main()
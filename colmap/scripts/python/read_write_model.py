@@ -30,11 +30,13 @@
 # Author: Johannes L. Schoenberger (jsch-at-demuc-dot-de)
 
 import os
+import gc
 import sys
 import collections
 import numpy as np
 import struct
 import argparse
+import multiprocessing
 
 
 CameraModel = collections.namedtuple(
@@ -52,6 +54,39 @@ class Image(BaseImage):
         return qvec2rotmat(self.qvec)
 
 
+# Columnar model arrays decoded by the binary fast path. The track of point i
+# is image_ids/point2D_idxs[track_offsets[i]:track_offsets[i+1]] and the 2D
+# points of image i are xys/point3D_ids[point2D_offsets[i]:point2D_offsets[i+1]].
+Points3DArrays = collections.namedtuple(
+    "Points3DArrays", ["ids", "xyz", "rgb", "error", "track_offsets",
+                       "image_ids", "point2D_idxs"])
+ImagesArrays = collections.namedtuple(
+    "ImagesArrays", ["ids", "qvecs", "tvecs", "camera_ids", "names",
+                     "point2D_offsets", "xys", "point3D_ids"])
+
+# Fixed-size records of the binary model files (packed, little endian).
+POINT3D_BINARY_DTYPE = np.dtype([
+    ("id", "<u8"), ("xyz", "<f8", (3,)), ("rgb", "u1", (3,)),
+    ("error", "<f8"), ("track_length", "<u8")])
+TRACK_ELEMENT_BINARY_DTYPE = np.dtype([
+    ("image_id", "<i4"), ("point2D_idx", "<i4")])
+IMAGE_BINARY_DTYPE = np.dtype([
+    ("id", "<i4"), ("qvec", "<f8", (4,)), ("tvec", "<f8", (3,)),
+    ("camera_id", "<i4")])
+POINT2D_BINARY_DTYPE = np.dtype([("xy", "<f8", (2,)), ("point3D_id", "<i8")])
+
+# Row of the offset index of a points3D.bin file (see Points3DBinaryView),
+# saved next to it as points3D_index.npy.
+POINT3D_INDEX_DTYPE = np.dtype([
+    ("id", "<i8"), ("offset", "<i8"), ("track_length", "<i8")])
+POINT3D_INDEX_SUFFIX = "_index.npy"
+
+# Number of images and of 3D points formatted together by the text writers
+# (the unit of work of their process pool).
+IMAGES_TEXT_CHUNK_SIZE = 64
+POINTS3D_TEXT_CHUNK_SIZE = 65536
+
+
 CAMERA_MODELS = {
     CameraModel(model_id=0, model_name="SIMPLE_PINHOLE", num_params=3),
     CameraModel(model_id=1, model_name="PINHOLE", num_params=4),
@@ -222,67 +257,244 @@ def read_images_text(path):
     return images
 
 
+def gather_records(data, starts, dtype):
+    """Decode fixed-size records at arbitrary byte offsets of a buffer.
+    Rows of a sliding window view of the buffer are copied, so only one index
+    per record is needed.
+    :param data: file content as a uint8 array.
+    :param starts: byte offset of each record.
+    :param dtype: structured record dtype.
+    :return: Array of records.
+    """
+    if len(data) < dtype.itemsize:
+        return np.zeros(0, dtype=dtype)
+    windows = np.lib.stride_tricks.sliding_window_view(data, dtype.itemsize)
+    records = windows[np.asarray(starts, dtype=np.int64)]
+    return np.ascontiguousarray(records).view(dtype).reshape(-1)
+
+
+def gather_segments(data, starts, lengths, dtype):
+    """Decode runs of contiguous fixed-size records, e.g. the tracks of all 3D
+    points, into one array.
+    :param data: file content as a uint8 array.
+    :param starts: byte offset of the first record of each run.
+    :param lengths: number of records of each run.
+    :return: CSR offsets of the runs and the concatenated records.
+    """
+    lengths = np.asarray(lengths, dtype=np.int64)
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    run = np.repeat(np.arange(len(lengths)), lengths)
+    element_starts = np.asarray(starts, dtype=np.int64)[run] + \
+        dtype.itemsize * (np.arange(offsets[-1]) - offsets[run])
+    return offsets, gather_records(data, element_starts, dtype)
+
+
+def scatter_records(out, starts, records):
+    """Encode fixed-size records at arbitrary byte offsets of a buffer, the
+    inverse of gather_records.
+    :param out: uint8 array of the file content.
+    :param starts: byte offset of each record.
+    :param records: array of records.
+    """
+    if len(records) == 0:
+        return
+    itemsize = records.dtype.itemsize
+    windows = np.lib.stride_tricks.sliding_window_view(
+        out, itemsize, writeable=True)
+    windows[np.asarray(starts, dtype=np.int64)] = \
+        np.ascontiguousarray(records).view(np.uint8).reshape(-1, itemsize)
+
+
+def scatter_segments(out, starts, offsets, records):
+    """Encode runs of contiguous fixed-size records, the inverse of
+    gather_segments.
+    :param starts: byte offset of the first record of each run.
+    :param offsets: CSR offsets of the runs in records.
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    run = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    element_starts = np.asarray(starts, dtype=np.int64)[run] + \
+        records.dtype.itemsize * (np.arange(offsets[-1]) - offsets[run])
+    scatter_records(out, element_starts, records)
+
+
+def read_images_binary_arrays(path_to_model_file):
+    """
+    Fast path of read_images_binary: the file is read at once, only the start
+    of each image is found sequentially (names and 2D points vary in size) and
+    all fields are decoded with NumPy structured dtypes.
+    :return: ImagesArrays
+    """
+    data = np.fromfile(path_to_model_file, dtype=np.uint8)
+    raw = data.tobytes()
+    num_reg_images = struct.unpack_from("<Q", raw, 0)[0]
+
+    starts = np.empty(num_reg_images, dtype=np.int64)
+    points2D_starts = np.empty(num_reg_images, dtype=np.int64)
+    num_points2D = np.empty(num_reg_images, dtype=np.int64)
+    names = []
+    offset = 8
+    for i in range(num_reg_images):
+        name_end = raw.index(b"\x00", offset + IMAGE_BINARY_DTYPE.itemsize)
+        names.append(raw[offset + IMAGE_BINARY_DTYPE.itemsize:name_end]
+                     .decode("utf-8"))
+        starts[i] = offset
+        points2D_starts[i] = name_end + 9
+        num_points2D[i] = struct.unpack_from("<Q", raw, name_end + 1)[0]
+        offset = points2D_starts[i] + \
+            POINT2D_BINARY_DTYPE.itemsize * num_points2D[i]
+
+    headers = gather_records(data, starts, IMAGE_BINARY_DTYPE)
+    point2D_offsets, points2D = gather_segments(
+        data, points2D_starts, num_points2D, POINT2D_BINARY_DTYPE)
+    return ImagesArrays(
+        ids=headers["id"].astype(np.int64), qvecs=headers["qvec"],
+        tvecs=headers["tvec"], camera_ids=headers["camera_id"].astype(np.int64),
+        names=names, point2D_offsets=point2D_offsets, xys=points2D["xy"],
+        point3D_ids=points2D["point3D_id"].astype(np.int64))
+
+
 def read_images_binary(path_to_model_file):
     """
     see: src/base/reconstruction.cc
         void Reconstruction::ReadImagesBinary(const std::string& path)
         void Reconstruction::WriteImagesBinary(const std::string& path)
     """
+    arrays = read_images_binary_arrays(path_to_model_file)
     images = {}
-    with open(path_to_model_file, "rb") as fid:
-        num_reg_images = read_next_bytes(fid, 8, "Q")[0]
-        for _ in range(num_reg_images):
-            binary_image_properties = read_next_bytes(
-                fid, num_bytes=64, format_char_sequence="idddddddi")
-            image_id = binary_image_properties[0]
-            qvec = np.array(binary_image_properties[1:5])
-            tvec = np.array(binary_image_properties[5:8])
-            camera_id = binary_image_properties[8]
-            image_name = ""
-            current_char = read_next_bytes(fid, 1, "c")[0]
-            while current_char != b"\x00":   # look for the ASCII 0 entry
-                image_name += current_char.decode("utf-8")
-                current_char = read_next_bytes(fid, 1, "c")[0]
-            num_points2D = read_next_bytes(fid, num_bytes=8,
-                                           format_char_sequence="Q")[0]
-            x_y_id_s = read_next_bytes(fid, num_bytes=24*num_points2D,
-                                       format_char_sequence="ddq"*num_points2D)
-            xys = np.column_stack([tuple(map(float, x_y_id_s[0::3])),
-                                   tuple(map(float, x_y_id_s[1::3]))])
-            point3D_ids = np.array(tuple(map(int, x_y_id_s[2::3])))
-            images[image_id] = Image(
-                id=image_id, qvec=qvec, tvec=tvec,
-                camera_id=camera_id, name=image_name,
-                xys=xys, point3D_ids=point3D_ids)
+    for i, image_id in enumerate(arrays.ids.tolist()):
+        begin, end = arrays.point2D_offsets[i], arrays.point2D_offsets[i + 1]
+        images[image_id] = Image(
+            id=image_id, qvec=arrays.qvecs[i], tvec=arrays.tvecs[i],
+            camera_id=int(arrays.camera_ids[i]), name=arrays.names[i],
+            xys=arrays.xys[begin:end],
+            point3D_ids=arrays.point3D_ids[begin:end])
     return images
 
 
-def write_images_text(images, path):
+def images_to_arrays(images):
+    """:return: ImagesArrays of a dict of Image."""
+    images = list(images.values())
+    point2D_counts = [len(image.point3D_ids) for image in images]
+    return ImagesArrays(
+        ids=np.array([image.id for image in images], dtype=np.int64),
+        qvecs=np.array([image.qvec for image in images],
+                       dtype=np.float64).reshape(-1, 4),
+        tvecs=np.array([image.tvec for image in images],
+                       dtype=np.float64).reshape(-1, 3),
+        camera_ids=np.array([image.camera_id for image in images],
+                            dtype=np.int64),
+        names=[image.name for image in images],
+        point2D_offsets=np.concatenate(
+            ([0], np.cumsum(point2D_counts, dtype=np.int64))),
+        xys=np.concatenate([np.reshape(image.xys, (-1, 2))
+                            for image in images] +
+                           [np.zeros((0, 2))]).astype(np.float64),
+        point3D_ids=np.concatenate([image.point3D_ids for image in images] +
+                                   [np.zeros(0, dtype=np.int64)])
+        .astype(np.int64))
+
+
+def slice_images_arrays(images, begin, end):
+    """:return: ImagesArrays of the images [begin, end)."""
+    first, last = images.point2D_offsets[begin], images.point2D_offsets[end]
+    return ImagesArrays(
+        ids=images.ids[begin:end], qvecs=images.qvecs[begin:end],
+        tvecs=images.tvecs[begin:end], camera_ids=images.camera_ids[begin:end],
+        names=images.names[begin:end],
+        point2D_offsets=images.point2D_offsets[begin:end + 1] - first,
+        xys=images.xys[first:last], point3D_ids=images.point3D_ids[first:last])
+
+
+def format_images_text(images):
+    """Format the two images.txt lines of every image of ImagesArrays, with
+    the same number formatting as str()."""
+    points2D = list(map("{} {} {}".format, *images.xys.T.tolist(),
+                        images.point3D_ids.tolist()))
+    offsets = images.point2D_offsets.tolist()
+    headers = map("{} {} {} {} {} {} {} {} {} {}\n".format,
+                  images.ids.tolist(), *images.qvecs.T.tolist(),
+                  *images.tvecs.T.tolist(), images.camera_ids.tolist(),
+                  images.names)
+    join = " ".join
+    return "".join([header + join(points2D[begin:end]) + "\n"
+                    for header, begin, end in
+                    zip(headers, offsets[:-1], offsets[1:])])
+
+
+def write_text_chunks(fid, format_chunk, chunks, num_workers=1):
+    """Write formatted chunks in order, formatting them in a process pool
+    when num_workers > 1."""
+    if num_workers > 1 and len(chunks) > 1:
+        with multiprocessing.Pool(min(num_workers, len(chunks))) as pool:
+            for text in pool.imap(format_chunk, chunks):
+                fid.write(text)
+    else:
+        for chunk in chunks:
+            fid.write(format_chunk(chunk))
+
+
+def write_images_text_arrays(images, path, num_workers=1):
+    """Write ImagesArrays as images.txt, IMAGES_TEXT_CHUNK_SIZE images at a
+    time across num_workers processes."""
+    num_images = len(images.ids)
+    mean_observations = 0 if num_images == 0 else \
+        images.point2D_offsets[-1] / num_images
+    HEADER = "# Image list with two lines of data per image:\n" + \
+        "#   IMAGE_ID, QW, QX, QY, QZ, TX, TY, TZ, CAMERA_ID, NAME\n" + \
+        "#   POINTS2D[] as (X, Y, POINT3D_ID)\n" + \
+        "# Number of images: {}, mean observations per image: {}\n".format(
+            num_images, mean_observations)
+    chunks = [slice_images_arrays(images, begin,
+                                  min(begin + IMAGES_TEXT_CHUNK_SIZE,
+                                      num_images))
+              for begin in range(0, num_images, IMAGES_TEXT_CHUNK_SIZE)]
+    with open(path, "w") as fid:
+        fid.write(HEADER)
+        write_text_chunks(fid, format_images_text, chunks, num_workers)
+
+
+def write_images_text(images, path, num_workers=1):
     """
     see: src/base/reconstruction.cc
         void Reconstruction::ReadImagesText(const std::string& path)
         void Reconstruction::WriteImagesText(const std::string& path)
     """
-    if len(images) == 0:
-        mean_observations = 0
-    else:
-        mean_observations = sum((len(img.point3D_ids) for _, img in images.items()))/len(images)
-    HEADER = "# Image list with two lines of data per image:\n"
-    "#   IMAGE_ID, QW, QX, QY, QZ, TX, TY, TZ, CAMERA_ID, NAME\n"
-    "#   POINTS2D[] as (X, Y, POINT3D_ID)\n"
-    "# Number of images: {}, mean observations per image: {}\n".format(len(images), mean_observations)
+    write_images_text_arrays(images_to_arrays(images), path, num_workers)
 
-    with open(path, "w") as fid:
-        fid.write(HEADER)
-        for _, img in images.items():
-            image_header = [img.id, *img.qvec, *img.tvec, img.camera_id, img.name]
-            first_line = " ".join(map(str, image_header))
-            fid.write(first_line + "\n")
 
-            points_strings = []
-            for xy, point3D_id in zip(img.xys, img.point3D_ids):
-                points_strings.append(" ".join(map(str, [*xy, point3D_id])))
-            fid.write(" ".join(points_strings) + "\n")
+def write_images_binary_arrays(images, path_to_model_file):
+    """Write ImagesArrays as images.bin: the whole file is encoded in one
+    buffer with NumPy and written at once."""
+    num_points2D = np.diff(images.point2D_offsets)
+    names = np.frombuffer(b"".join(name.encode("utf-8") + b"\x00"
+                                   for name in images.names), dtype=np.uint8)
+    name_offsets = np.concatenate(([0], np.cumsum(
+        [len(name.encode("utf-8")) + 1 for name in images.names],
+        dtype=np.int64)))
+    sizes = IMAGE_BINARY_DTYPE.itemsize + np.diff(name_offsets) + 8 + \
+        POINT2D_BINARY_DTYPE.itemsize * num_points2D
+    starts = 8 + np.cumsum(sizes) - sizes
+    names_starts = starts + IMAGE_BINARY_DTYPE.itemsize
+    counts_starts = names_starts + np.diff(name_offsets)
+
+    headers = np.empty(len(images.ids), dtype=IMAGE_BINARY_DTYPE)
+    headers["id"] = images.ids
+    headers["qvec"] = images.qvecs
+    headers["tvec"] = images.tvecs
+    headers["camera_id"] = images.camera_ids
+    points2D = np.empty(len(images.point3D_ids), dtype=POINT2D_BINARY_DTYPE)
+    points2D["xy"] = images.xys
+    points2D["point3D_id"] = images.point3D_ids
+
+    out = np.empty(8 + int(sizes.sum()), dtype=np.uint8)
+    out[:8] = np.array([len(headers)], dtype="<u8").view(np.uint8)
+    scatter_records(out, starts, headers)
+    scatter_segments(out, names_starts, name_offsets, names)
+    scatter_records(out, counts_starts, num_points2D.astype("<u8"))
+    scatter_segments(out, counts_starts + 8, images.point2D_offsets, points2D)
+    out.tofile(path_to_model_file)
 
 
 def write_images_binary(images, path_to_model_file):
@@ -291,19 +503,7 @@ def write_images_binary(images, path_to_model_file):
         void Reconstruction::ReadImagesBinary(const std::string& path)
         void Reconstruction::WriteImagesBinary(const std::string& path)
     """
-    with open(path_to_model_file, "wb") as fid:
-        write_next_bytes(fid, len(images), "Q")
-        for _, img in images.items():
-            write_next_bytes(fid, img.id, "i")
-            write_next_bytes(fid, img.qvec.tolist(), "dddd")
-            write_next_bytes(fid, img.tvec.tolist(), "ddd")
-            write_next_bytes(fid, img.camera_id, "i")
-            for char in img.name:
-                write_next_bytes(fid, char.encode("utf-8"), "c")
-            write_next_bytes(fid, b"\x00", "c")
-            write_next_bytes(fid, len(img.point3D_ids), "Q")
-            for xy, p3d_id in zip(img.xys, img.point3D_ids):
-                write_next_bytes(fid, [*xy, p3d_id], "ddq")
+    write_images_binary_arrays(images_to_arrays(images), path_to_model_file)
 
 
 def read_points3D_text(path):
@@ -333,59 +533,330 @@ def read_points3D_text(path):
     return points3D
 
 
+def find_points3d_binary_starts(buffer):
+    """Byte offset of each point of a points3D.bin buffer. Only the track
+    length is needed to reach the next point.
+    :param buffer: bytes or mmap of the whole file.
+    """
+    num_points = struct.unpack_from("<Q", buffer, 0)[0]
+    track_length_offset = POINT3D_BINARY_DTYPE.fields["track_length"][1]
+    read_track_length = struct.Struct("<Q").unpack_from
+    starts = np.empty(num_points, dtype=np.int64)
+    offset = 8
+    for i in range(num_points):
+        starts[i] = offset
+        offset += POINT3D_BINARY_DTYPE.itemsize + \
+            TRACK_ELEMENT_BINARY_DTYPE.itemsize * \
+            read_track_length(buffer, offset + track_length_offset)[0]
+    if offset != len(buffer):
+        raise ValueError("Truncated or invalid points3D.bin file")
+    return starts
+
+
+def read_points3d_binary_arrays(path_to_model_file):
+    """
+    Fast path of read_points3d_binary: the file is read at once, only the start
+    of each point is found sequentially (by skipping its track) and all fields
+    and tracks are decoded with NumPy structured dtypes.
+    :return: Points3DArrays
+    """
+    data = np.fromfile(path_to_model_file, dtype=np.uint8)
+    starts = find_points3d_binary_starts(data.tobytes())
+    points = gather_records(data, starts, POINT3D_BINARY_DTYPE)
+    track_offsets, tracks = gather_segments(
+        data, starts + POINT3D_BINARY_DTYPE.itemsize, points["track_length"],
+        TRACK_ELEMENT_BINARY_DTYPE)
+    return Points3DArrays(
+        ids=points["id"].astype(np.int64), xyz=points["xyz"],
+        rgb=points["rgb"], error=points["error"], track_offsets=track_offsets,
+        image_ids=tracks["image_id"].astype(np.int64),
+        point2D_idxs=tracks["point2D_idx"].astype(np.int64))
+
+
 def read_points3d_binary(path_to_model_file):
     """
     see: src/base/reconstruction.cc
         void Reconstruction::ReadPoints3DBinary(const std::string& path)
         void Reconstruction::WritePoints3DBinary(const std::string& path)
     """
+    arrays = read_points3d_binary_arrays(path_to_model_file)
+    offsets = arrays.track_offsets.tolist()
     points3D = {}
-    with open(path_to_model_file, "rb") as fid:
-        num_points = read_next_bytes(fid, 8, "Q")[0]
-        for _ in range(num_points):
-            binary_point_line_properties = read_next_bytes(
-                fid, num_bytes=43, format_char_sequence="QdddBBBd")
-            point3D_id = binary_point_line_properties[0]
-            xyz = np.array(binary_point_line_properties[1:4])
-            rgb = np.array(binary_point_line_properties[4:7])
-            error = np.array(binary_point_line_properties[7])
-            track_length = read_next_bytes(
-                fid, num_bytes=8, format_char_sequence="Q")[0]
-            track_elems = read_next_bytes(
-                fid, num_bytes=8*track_length,
-                format_char_sequence="ii"*track_length)
-            image_ids = np.array(tuple(map(int, track_elems[0::2])))
-            point2D_idxs = np.array(tuple(map(int, track_elems[1::2])))
+    # The cyclic garbage collector would rescan the millions of new objects.
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for point3D_id, xyz, rgb, error, begin, end in zip(
+                arrays.ids.tolist(), arrays.xyz, arrays.rgb.astype(np.int64),
+                arrays.error, offsets[:-1], offsets[1:]):
             points3D[point3D_id] = Point3D(
-                id=point3D_id, xyz=xyz, rgb=rgb,
-                error=error, image_ids=image_ids,
-                point2D_idxs=point2D_idxs)
+                point3D_id, xyz, rgb, error, arrays.image_ids[begin:end],
+                arrays.point2D_idxs[begin:end])
+    finally:
+        if gc_enabled:
+            gc.enable()
     return points3D
 
 
-def write_points3D_text(points3D, path):
+class Points3DBinaryView(object):
+    """
+    Lazy view of a points3D.bin file: the file is memory-mapped and only the
+    offset index (id, byte offset and track length of every point) is held in
+    memory. The index is built by a single scan of the file and saved next to
+    it, so later views start without reading the points.
+
+        points3D = Points3DBinaryView("sparse/0/points3D.bin")
+        point3D = points3D[point3D_id]
+        arrays = points3D.read_rows(points3D.track_lengths >= 3)
+    """
+
+    def __init__(self, path_to_model_file, use_index_file=True):
+        self.path = path_to_model_file
+        self.data = np.memmap(path_to_model_file, dtype=np.uint8, mode="r")
+        self.index = None
+        index_path = os.path.splitext(path_to_model_file)[0] + \
+            POINT3D_INDEX_SUFFIX
+        if use_index_file:
+            self.index = self._load_index(index_path)
+        if self.index is None:
+            self.index = self._scan()
+            if use_index_file:
+                self._save_index(index_path)
+        self._order = np.argsort(self.index["id"], kind="stable")
+
+    def _scan(self):
+        # Only the track lengths are read, through the memory map.
+        starts = find_points3d_binary_starts(self.data)
+        points = gather_records(self.data, starts, POINT3D_BINARY_DTYPE)
+        index = np.empty(len(starts), dtype=POINT3D_INDEX_DTYPE)
+        index["id"] = points["id"]
+        index["offset"] = starts
+        index["track_length"] = points["track_length"]
+        return index
+
+    def _load_index(self, index_path):
+        """:return: The saved index if it is newer than the file and
+        consistent with its size, None otherwise."""
+        try:
+            if os.path.getmtime(index_path) < os.path.getmtime(self.path):
+                return None
+            index = np.load(index_path)
+        except (OSError, ValueError):
+            return None
+        if index.dtype != POINT3D_INDEX_DTYPE or len(self.data) < 8:
+            return None
+        if len(index) != self.data[:8].view("<u8")[0]:
+            return None
+        end = 8 if len(index) == 0 else index["offset"][-1] + \
+            POINT3D_BINARY_DTYPE.itemsize + \
+            TRACK_ELEMENT_BINARY_DTYPE.itemsize * index["track_length"][-1]
+        return index if end == len(self.data) else None
+
+    def _save_index(self, index_path):
+        # A read-only model folder is simply not indexed on disk.
+        temp_path = index_path + ".{}.tmp".format(os.getpid())
+        try:
+            with open(temp_path, "wb") as fid:
+                np.save(fid, self.index)
+            os.replace(temp_path, index_path)
+        except OSError:
+            pass
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def ids(self):
+        return self.index["id"]
+
+    @property
+    def track_lengths(self):
+        return self.index["track_length"]
+
+    def rows(self, point3D_ids):
+        """:return: Rows of the given point3D ids, KeyError for unknown ids."""
+        point3D_ids = np.asarray(point3D_ids, dtype=np.int64)
+        if len(self) == 0:
+            raise KeyError("Unknown point3D id")
+        positions = np.searchsorted(self.ids, point3D_ids, sorter=self._order)
+        rows = self._order[np.minimum(positions, len(self) - 1)]
+        if np.any(self.ids[rows] != point3D_ids):
+            raise KeyError("Unknown point3D id")
+        return rows
+
+    def __contains__(self, point3D_id):
+        try:
+            self.rows(point3D_id)
+        except KeyError:
+            return False
+        return True
+
+    def __getitem__(self, point3D_id):
+        return next(self.iter_rows(self.rows([point3D_id])))
+
+    def read_rows(self, rows=None):
+        """Decode the given rows (indices or boolean mask, all by default).
+        Only the pages of these points are read from the file.
+        :return: Points3DArrays
+        """
+        index = self.index if rows is None else self.index[rows]
+        points = gather_records(self.data, index["offset"],
+                                POINT3D_BINARY_DTYPE)
+        track_offsets, tracks = gather_segments(
+            self.data, index["offset"] + POINT3D_BINARY_DTYPE.itemsize,
+            index["track_length"], TRACK_ELEMENT_BINARY_DTYPE)
+        return Points3DArrays(
+            ids=points["id"].astype(np.int64), xyz=points["xyz"],
+            rgb=points["rgb"], error=points["error"],
+            track_offsets=track_offsets,
+            image_ids=tracks["image_id"].astype(np.int64),
+            point2D_idxs=tracks["point2D_idx"].astype(np.int64))
+
+    def iter_rows(self, rows=None, chunk_size=65536):
+        """Yield Point3D tuples of the given rows (indices or boolean mask,
+        all by default), decoded chunk by chunk."""
+        if rows is None:
+            rows = np.arange(len(self))
+        rows = np.asarray(rows)
+        if rows.dtype == bool:
+            rows = np.flatnonzero(rows)
+        for begin in range(0, len(rows), chunk_size):
+            arrays = self.read_rows(rows[begin:begin + chunk_size])
+            offsets = arrays.track_offsets.tolist()
+            rgb = arrays.rgb.astype(np.int64)
+            for i, point3D_id in enumerate(arrays.ids.tolist()):
+                yield Point3D(
+                    point3D_id, arrays.xyz[i], rgb[i], arrays.error[i],
+                    arrays.image_ids[offsets[i]:offsets[i + 1]],
+                    arrays.point2D_idxs[offsets[i]:offsets[i + 1]])
+
+    def iter_range(self, begin, end, chunk_size=65536):
+        """Yield the Point3D tuples of rows [begin, end) in file order."""
+        return self.iter_rows(np.arange(begin, min(end, len(self))),
+                              chunk_size)
+
+    def iter_filtered(self, min_track_len=0, chunk_size=65536):
+        """Yield the Point3D tuples with a track of at least min_track_len."""
+        return self.iter_rows(self.track_lengths >= min_track_len,
+                              chunk_size)
+
+    def __iter__(self):
+        return iter(self.ids.tolist())
+
+    def keys(self):
+        return self.ids.tolist()
+
+    def values(self):
+        return self.iter_rows()
+
+    def items(self):
+        for point3D in self.iter_rows():
+            yield point3D.id, point3D
+
+
+def points3D_to_arrays(points3D):
+    """:return: Points3DArrays of a dict of Point3D."""
+    points3D = list(points3D.values())
+    track_lengths = [len(point3D.image_ids) for point3D in points3D]
+    empty = np.zeros(0, dtype=np.int64)
+    return Points3DArrays(
+        ids=np.array([point3D.id for point3D in points3D], dtype=np.int64),
+        xyz=np.array([point3D.xyz for point3D in points3D],
+                     dtype=np.float64).reshape(-1, 3),
+        rgb=np.array([point3D.rgb for point3D in points3D],
+                     dtype=np.uint8).reshape(-1, 3),
+        error=np.array([point3D.error for point3D in points3D],
+                       dtype=np.float64),
+        track_offsets=np.concatenate(
+            ([0], np.cumsum(track_lengths, dtype=np.int64))),
+        image_ids=np.concatenate([point3D.image_ids for point3D in points3D] +
+                                 [empty]).astype(np.int64),
+        point2D_idxs=np.concatenate([point3D.point2D_idxs
+                                     for point3D in points3D] +
+                                    [empty]).astype(np.int64))
+
+
+def slice_points3D_arrays(points3D, begin, end):
+    """:return: Points3DArrays of the points [begin, end)."""
+    first, last = points3D.track_offsets[begin], points3D.track_offsets[end]
+    return Points3DArrays(
+        ids=points3D.ids[begin:end], xyz=points3D.xyz[begin:end],
+        rgb=points3D.rgb[begin:end], error=points3D.error[begin:end],
+        track_offsets=points3D.track_offsets[begin:end + 1] - first,
+        image_ids=points3D.image_ids[first:last],
+        point2D_idxs=points3D.point2D_idxs[first:last])
+
+
+def format_points3D_text(points3D):
+    """Format the points3D.txt line of every point of Points3DArrays, with
+    the same number formatting as str()."""
+    track = list(map("{} {}".format, points3D.image_ids.tolist(),
+                     points3D.point2D_idxs.tolist()))
+    offsets = points3D.track_offsets.tolist()
+    headers = map("{} {} {} {} {} {} {} {} ".format, points3D.ids.tolist(),
+                  *points3D.xyz.T.tolist(), *points3D.rgb.T.tolist(),
+                  points3D.error.tolist())
+    join = " ".join
+    return "".join([header + join(track[begin:end]) + "\n"
+                    for header, begin, end in
+                    zip(headers, offsets[:-1], offsets[1:])])
+
+
+def write_points3D_text_arrays(points3D, path, num_workers=1):
+    """Write Points3DArrays as points3D.txt, POINTS3D_TEXT_CHUNK_SIZE points
+    at a time across num_workers processes."""
+    num_points = len(points3D.ids)
+    mean_track_length = 0 if num_points == 0 else \
+        points3D.track_offsets[-1] / num_points
+    HEADER = "# 3D point list with one line of data per point:\n" + \
+        "#   POINT3D_ID, X, Y, Z, R, G, B, ERROR, " + \
+        "TRACK[] as (IMAGE_ID, POINT2D_IDX)\n" + \
+        "# Number of points: {}, mean track length: {}\n".format(
+            num_points, mean_track_length)
+    chunks = [slice_points3D_arrays(points3D, begin,
+                                    min(begin + POINTS3D_TEXT_CHUNK_SIZE,
+                                        num_points))
+              for begin in range(0, num_points, POINTS3D_TEXT_CHUNK_SIZE)]
+    with open(path, "w") as fid:
+        fid.write(HEADER)
+        write_text_chunks(fid, format_points3D_text, chunks, num_workers)
+
+
+def write_points3D_text(points3D, path, num_workers=1):
     """
     see: src/base/reconstruction.cc
         void Reconstruction::ReadPoints3DText(const std::string& path)
         void Reconstruction::WritePoints3DText(const std::string& path)
     """
-    if len(points3D) == 0:
-        mean_track_length = 0
-    else:
-        mean_track_length = sum((len(pt.image_ids) for _, pt in points3D.items()))/len(points3D)
-    HEADER = "# 3D point list with one line of data per point:\n"
-    "#   POINT3D_ID, X, Y, Z, R, G, B, ERROR, TRACK[] as (IMAGE_ID, POINT2D_IDX)\n"
-    "# Number of points: {}, mean track length: {}\n".format(len(points3D), mean_track_length)
+    write_points3D_text_arrays(points3D_to_arrays(points3D), path,
+                               num_workers)
 
-    with open(path, "w") as fid:
-        fid.write(HEADER)
-        for _, pt in points3D.items():
-            point_header = [pt.id, *pt.xyz, *pt.rgb, pt.error]
-            fid.write(" ".join(map(str, point_header)) + " ")
-            track_strings = []
-            for image_id, point2D in zip(pt.image_ids, pt.point2D_idxs):
-                track_strings.append(" ".join(map(str, [image_id, point2D])))
-            fid.write(" ".join(track_strings) + "\n")
+
+def write_points3d_binary_arrays(points3D, path_to_model_file):
+    """Write Points3DArrays as points3D.bin: the whole file is encoded in one
+    buffer with NumPy and written at once."""
+    track_lengths = np.diff(points3D.track_offsets)
+    sizes = POINT3D_BINARY_DTYPE.itemsize + \
+        TRACK_ELEMENT_BINARY_DTYPE.itemsize * track_lengths
+    starts = 8 + np.cumsum(sizes) - sizes
+
+    records = np.empty(len(points3D.ids), dtype=POINT3D_BINARY_DTYPE)
+    records["id"] = points3D.ids
+    records["xyz"] = points3D.xyz
+    records["rgb"] = points3D.rgb
+    records["error"] = points3D.error
+    records["track_length"] = track_lengths
+    tracks = np.empty(len(points3D.image_ids),
+                      dtype=TRACK_ELEMENT_BINARY_DTYPE)
+    tracks["image_id"] = points3D.image_ids
+    tracks["point2D_idx"] = points3D.point2D_idxs
+
+    out = np.empty(8 + int(sizes.sum()), dtype=np.uint8)
+    out[:8] = np.array([len(records)], dtype="<u8").view(np.uint8)
+    scatter_records(out, starts, records)
+    scatter_segments(out, starts + POINT3D_BINARY_DTYPE.itemsize,
+                     points3D.track_offsets, tracks)
+    out.tofile(path_to_model_file)
 
 
 def write_points3d_binary(points3D, path_to_model_file):
@@ -394,17 +865,8 @@ def write_points3d_binary(points3D, path_to_model_file):
         void Reconstruction::ReadPoints3DBinary(const std::string& path)
         void Reconstruction::WritePoints3DBinary(const std::string& path)
     """
-    with open(path_to_model_file, "wb") as fid:
-        write_next_bytes(fid, len(points3D), "Q")
-        for _, pt in points3D.items():
-            write_next_bytes(fid, pt.id, "Q")
-            write_next_bytes(fid, pt.xyz.tolist(), "ddd")
-            write_next_bytes(fid, pt.rgb.tolist(), "BBB")
-            write_next_bytes(fid, pt.error, "d")
-            track_length = pt.image_ids.shape[0]
-            write_next_bytes(fid, track_length, "Q")
-            for image_id, point2D_id in zip(pt.image_ids, pt.point2D_idxs):
-                write_next_bytes(fid, [image_id, point2D_id], "ii")
+    write_points3d_binary_arrays(points3D_to_arrays(points3D),
+                                 path_to_model_file)
 
 
 def detect_model_format(path, ext):
@@ -439,11 +901,13 @@ def read_model(path, ext=""):
     return cameras, images, points3D
 
 
-def write_model(cameras, images, points3D, path, ext=".bin"):
+def write_model(cameras, images, points3D, path, ext=".bin", num_workers=1):
     if ext == ".txt":
         write_cameras_text(cameras, os.path.join(path, "cameras" + ext))
-        write_images_text(images, os.path.join(path, "images" + ext))
-        write_points3D_text(points3D, os.path.join(path, "points3D") + ext)
+        write_images_text(images, os.path.join(path, "images" + ext),
+                          num_workers)
+        write_points3D_text(points3D, os.path.join(path, "points3D") + ext,
+                            num_workers)
     else:
         write_cameras_binary(cameras, os.path.join(path, "cameras" + ext))
         write_images_binary(images, os.path.join(path, "images" + ext))
@@ -451,31 +915,210 @@ def write_model(cameras, images, points3D, path, ext=".bin"):
     return cameras, images, points3D
 
 
+class Reconstruction(object):
+    """
+    Columnar model: the points and images are stored as contiguous arrays
+    (Points3DArrays and ImagesArrays) instead of one namedtuple per point, and
+    ids are mapped to rows through sorted id arrays.
+    """
+
+    def __init__(self, cameras, images, points3D):
+        """
+        :param cameras: dict of Camera (cameras are few).
+        :param images: ImagesArrays.
+        :param points3D: Points3DArrays.
+        """
+        self.cameras = cameras
+        self.images = images
+        self.points3D = points3D
+        self._image_order = np.argsort(images.ids, kind="stable")
+        self._point_order = np.argsort(points3D.ids, kind="stable")
+
+    @classmethod
+    def from_model(cls, cameras, images, points3D):
+        """Build a Reconstruction from the dicts returned by read_model."""
+        return cls(cameras, images_to_arrays(images),
+                   points3D_to_arrays(points3D))
+
+    def to_model(self):
+        """:return: cameras, images, points3D dicts as returned by read_model."""
+        images = {}
+        for i in range(self.num_images):
+            begin, end = self.images.point2D_offsets[i:i + 2]
+            image_id = int(self.images.ids[i])
+            images[image_id] = Image(
+                id=image_id, qvec=self.images.qvecs[i],
+                tvec=self.images.tvecs[i],
+                camera_id=int(self.images.camera_ids[i]),
+                name=self.images.names[i], xys=self.images.xys[begin:end],
+                point3D_ids=self.images.point3D_ids[begin:end])
+        points3D = {}
+        rgb = self.points3D.rgb.astype(np.int64)
+        for i in range(self.num_points3D):
+            begin, end = self.points3D.track_offsets[i:i + 2]
+            point3D_id = int(self.points3D.ids[i])
+            points3D[point3D_id] = Point3D(
+                id=point3D_id, xyz=self.points3D.xyz[i], rgb=rgb[i],
+                error=self.points3D.error[i],
+                image_ids=self.points3D.image_ids[begin:end],
+                point2D_idxs=self.points3D.point2D_idxs[begin:end])
+        return self.cameras, images, points3D
+
+    @classmethod
+    def read(cls, path, ext=""):
+        """Read a model folder, the binary files without any namedtuple."""
+        if ext == "":
+            ext = ".bin" if detect_model_format(path, ".bin") else ".txt"
+        if ext == ".txt":
+            return cls.from_model(*read_model(path, ext))
+        return cls(read_cameras_binary(os.path.join(path, "cameras.bin")),
+                   read_images_binary_arrays(os.path.join(path, "images.bin")),
+                   read_points3d_binary_arrays(
+                       os.path.join(path, "points3D.bin")))
+
+    def write(self, path, ext=".bin", num_workers=1):
+        """Write the model from the arrays, without building namedtuples."""
+        if ext == ".txt":
+            write_cameras_text(self.cameras, os.path.join(path, "cameras.txt"))
+            write_images_text_arrays(
+                self.images, os.path.join(path, "images.txt"), num_workers)
+            write_points3D_text_arrays(
+                self.points3D, os.path.join(path, "points3D.txt"), num_workers)
+        else:
+            write_cameras_binary(self.cameras,
+                                 os.path.join(path, "cameras.bin"))
+            write_images_binary_arrays(self.images,
+                                       os.path.join(path, "images.bin"))
+            write_points3d_binary_arrays(self.points3D,
+                                         os.path.join(path, "points3D.bin"))
+
+    @property
+    def num_images(self):
+        return len(self.images.ids)
+
+    @property
+    def num_points3D(self):
+        return len(self.points3D.ids)
+
+    @staticmethod
+    def _rows(ids, order, query):
+        query = np.asarray(query, dtype=np.int64)
+        positions = np.searchsorted(ids, query, sorter=order)
+        rows = order[np.minimum(positions, max(len(ids) - 1, 0))] \
+            if len(ids) > 0 else np.zeros(query.shape, dtype=np.int64)
+        if len(ids) == 0 or np.any(ids[rows] != query):
+            raise KeyError("unknown id")
+        return rows
+
+    def image_rows(self, image_ids):
+        """:return: rows of the images arrays of the given image ids."""
+        return self._rows(self.images.ids, self._image_order, image_ids)
+
+    def point3D_rows(self, point3D_ids):
+        """:return: rows of the points arrays of the given point3D ids."""
+        return self._rows(self.points3D.ids, self._point_order, point3D_ids)
+
+    def image(self, image_id):
+        """:return: Image namedtuple of a single image id."""
+        i = int(self.image_rows(image_id))
+        begin, end = self.images.point2D_offsets[i:i + 2]
+        return Image(id=int(image_id), qvec=self.images.qvecs[i],
+                     tvec=self.images.tvecs[i],
+                     camera_id=int(self.images.camera_ids[i]),
+                     name=self.images.names[i],
+                     xys=self.images.xys[begin:end],
+                     point3D_ids=self.images.point3D_ids[begin:end])
+
+    def point3D(self, point3D_id):
+        """:return: Point3D namedtuple of a single point3D id."""
+        i = int(self.point3D_rows(point3D_id))
+        begin, end = self.points3D.track_offsets[i:i + 2]
+        return Point3D(id=int(point3D_id), xyz=self.points3D.xyz[i],
+                       rgb=self.points3D.rgb[i].astype(np.int64),
+                       error=self.points3D.error[i],
+                       image_ids=self.points3D.image_ids[begin:end],
+                       point2D_idxs=self.points3D.point2D_idxs[begin:end])
+
+    def track_lengths(self):
+        return np.diff(self.points3D.track_offsets)
+
+    def bounding_box(self, percentile=0):
+        """:return: min and max corners of the points, ignoring the given
+        percentile of outliers on each side."""
+        if self.num_points3D == 0:
+            return np.zeros(3), np.zeros(3)
+        return np.percentile(self.points3D.xyz, percentile, axis=0), \
+            np.percentile(self.points3D.xyz, 100 - percentile, axis=0)
+
+    def filter_points3D(self, mask):
+        """
+        :param mask: boolean array of the points to keep, e.g.
+                     reconstruction.track_lengths() >= 3.
+        :return: a new Reconstruction with the kept points only, the 2D
+                 points of removed points get point3D_id -1.
+        """
+        mask = np.asarray(mask, dtype=bool)
+        element_mask = np.repeat(mask, self.track_lengths())
+        points3D = Points3DArrays(
+            ids=self.points3D.ids[mask], xyz=self.points3D.xyz[mask],
+            rgb=self.points3D.rgb[mask], error=self.points3D.error[mask],
+            track_offsets=np.concatenate(
+                ([0], np.cumsum(self.track_lengths()[mask]))),
+            image_ids=self.points3D.image_ids[element_mask],
+            point2D_idxs=self.points3D.point2D_idxs[element_mask])
+        point3D_ids = np.where(
+            np.isin(self.images.point3D_ids, self.points3D.ids[~mask]),
+            -1, self.images.point3D_ids)
+        return Reconstruction(self.cameras,
+                              self.images._replace(point3D_ids=point3D_ids),
+                              points3D)
+
+
+def qvecs2rotmats(qvecs):
+    """Rotation matrices of quaternions (w, x, y, z), normalized first.
+    :param qvecs: array of shape (N, 4).
+    :return: array of shape (N, 3, 3).
+    """
+    qvecs = np.asarray(qvecs, dtype=np.float64).reshape(-1, 4)
+    w, x, y, z = (qvecs / np.linalg.norm(qvecs, axis=1, keepdims=True)).T
+    return np.stack([
+        1 - 2 * y**2 - 2 * z**2, 2 * x * y - 2 * w * z, 2 * z * x + 2 * w * y,
+        2 * x * y + 2 * w * z, 1 - 2 * x**2 - 2 * z**2, 2 * y * z - 2 * w * x,
+        2 * z * x - 2 * w * y, 2 * y * z + 2 * w * x, 1 - 2 * x**2 - 2 * y**2],
+        axis=1).reshape(-1, 3, 3)
+
+
+def rotmats2qvecs(R):
+    """Quaternions (w, x, y, z) with w >= 0 of rotation matrices, in closed
+    form: row i of the symmetric matrix K below is 4 * q_i * q, and the row of
+    the largest |q_i| (largest diagonal element) is used for each matrix, so
+    the division is never by a small number.
+    :param R: array of shape (N, 3, 3).
+    :return: array of shape (N, 4).
+    """
+    R = np.asarray(R, dtype=np.float64).reshape(-1, 3, 3)
+    Rxx, Rxy, Rxz = R[:, 0, 0], R[:, 0, 1], R[:, 0, 2]
+    Ryx, Ryy, Ryz = R[:, 1, 0], R[:, 1, 1], R[:, 1, 2]
+    Rzx, Rzy, Rzz = R[:, 2, 0], R[:, 2, 1], R[:, 2, 2]
+    K = np.stack([
+        1 + Rxx + Ryy + Rzz, Rzy - Ryz, Rxz - Rzx, Ryx - Rxy,
+        Rzy - Ryz, 1 + Rxx - Ryy - Rzz, Rxy + Ryx, Rxz + Rzx,
+        Rxz - Rzx, Rxy + Ryx, 1 - Rxx + Ryy - Rzz, Ryz + Rzy,
+        Ryx - Rxy, Rxz + Rzx, Ryz + Rzy, 1 - Rxx - Ryy + Rzz],
+        axis=1).reshape(-1, 4, 4)
+    largest = np.argmax(np.diagonal(K, axis1=1, axis2=2), axis=1)
+    qvecs = K[np.arange(len(K)), largest]
+    qvecs /= np.linalg.norm(qvecs, axis=1, keepdims=True)
+    qvecs[qvecs[:, 0] < 0] *= -1
+    return qvecs
+
+
 def qvec2rotmat(qvec):
-    return np.array([
-        [1 - 2 * qvec[2]**2 - 2 * qvec[3]**2,
-         2 * qvec[1] * qvec[2] - 2 * qvec[0] * qvec[3],
-         2 * qvec[3] * qvec[1] + 2 * qvec[0] * qvec[2]],
-        [2 * qvec[1] * qvec[2] + 2 * qvec[0] * qvec[3],
-         1 - 2 * qvec[1]**2 - 2 * qvec[3]**2,
-         2 * qvec[2] * qvec[3] - 2 * qvec[0] * qvec[1]],
-        [2 * qvec[3] * qvec[1] - 2 * qvec[0] * qvec[2],
-         2 * qvec[2] * qvec[3] + 2 * qvec[0] * qvec[1],
-         1 - 2 * qvec[1]**2 - 2 * qvec[2]**2]])
+    return qvecs2rotmats(qvec)[0]
 
 
 def rotmat2qvec(R):
-    Rxx, Ryx, Rzx, Rxy, Ryy, Rzy, Rxz, Ryz, Rzz = R.flat
-    K = np.array([
-        [Rxx - Ryy - Rzz, 0, 0, 0],
-        [Ryx + Rxy, Ryy - Rxx - Rzz, 0, 0],
-        [Rzx + Rxz, Rzy + Ryz, Rzz - Rxx - Ryy, 0],
-        [Ryz - Rzy, Rzx - Rxz, Rxy - Ryx, Rxx + Ryy + Rzz]]) / 3.0
-    eigvals, eigvecs = np.linalg.eigh(K)
-    qvec = eigvecs[[3, 0, 1, 2], np.argmax(eigvals)]
-    if qvec[0] < 0:
-        qvec *= -1
-    return qvec
+    return rotmats2qvecs(R)[0]
 
 
 def main():
@@ -487,16 +1130,22 @@ def main():
                         help="path to output model folder")
     parser.add_argument("--output_format", choices=[".bin", ".txt"],
                         help="outut model format", default=".txt")
+    parser.add_argument("--num_workers", type=int,
+                        default=multiprocessing.cpu_count(),
+                        help="processes formatting the text output")
     args = parser.parse_args()
 
-    cameras, images, points3D = read_model(path=args.input_model, ext=args.input_format)
+    # The arrays are converted without building a namedtuple per point.
+    reconstruction = Reconstruction.read(args.input_model,
+                                         ext=args.input_format)
 
-    print("num_cameras:", len(cameras))
-    print("num_images:", len(images))
-    print("num_points3D:", len(points3D))
+    print("num_cameras:", len(reconstruction.cameras))
+    print("num_images:", reconstruction.num_images)
+    print("num_points3D:", reconstruction.num_points3D)
 
     if args.output_model is not None:
-        write_model(cameras, images, points3D, path=args.output_model, ext=args.output_format)
+        reconstruction.write(args.output_model, ext=args.output_format,
+                             num_workers=args.num_workers)
 
 
 if __name__ == "__main__":
@@ -29,8 +29,11 @@
 #
 # Author: Johannes L. Schoenberger (jsch-at-demuc-dot-de)
 
+import os
 import numpy as np
-from read_write_model import read_model, write_model
+from read_write_model import read_model, write_model, \
+    read_images_binary_arrays, read_points3d_binary_arrays, Reconstruction, \
+    Points3DBinaryView, qvec2rotmat, qvecs2rotmats, rotmats2qvecs
 from tempfile import mkdtemp
 
 
@@ -71,6 +74,36 @@ def compare_points(points3D1, points3D2):
         assert np.array_equal(point3D1.point2D_idxs, point3D2.point2D_idxs)
 
 
+def compare_images_arrays(images, images_arrays):
+    assert len(images) == len(images_arrays.ids)
+    for i, image_id in enumerate(images_arrays.ids):
+        image = images[image_id]
+        begin = images_arrays.point2D_offsets[i]
+        end = images_arrays.point2D_offsets[i + 1]
+        assert np.allclose(image.qvec, images_arrays.qvecs[i])
+        assert np.allclose(image.tvec, images_arrays.tvecs[i])
+        assert image.camera_id == images_arrays.camera_ids[i]
+        assert image.name == images_arrays.names[i]
+        assert np.allclose(image.xys, images_arrays.xys[begin:end])
+        assert np.array_equal(image.point3D_ids,
+                              images_arrays.point3D_ids[begin:end])
+
+
+def compare_points_arrays(points3D, points3D_arrays):
+    assert len(points3D) == len(points3D_arrays.ids)
+    for i, point3D_id in enumerate(points3D_arrays.ids):
+        point3D = points3D[point3D_id]
+        begin = points3D_arrays.track_offsets[i]
+        end = points3D_arrays.track_offsets[i + 1]
+        assert np.allclose(point3D.xyz, points3D_arrays.xyz[i])
+        assert np.array_equal(point3D.rgb, points3D_arrays.rgb[i])
+        assert np.allclose(point3D.error, points3D_arrays.error[i])
+        assert np.array_equal(point3D.image_ids,
+                              points3D_arrays.image_ids[begin:end])
+        assert np.array_equal(point3D.point2D_idxs,
+                              points3D_arrays.point2D_idxs[begin:end])
+
+
 def main():
     import sys
     if len(sys.argv) != 3:
@@ -112,6 +145,65 @@ def main():
     compare_points(points3D_txt, points3D_bin)
 
     print("... saved binary and loaded models are equal.")
+    print("Comparing binary model arrays ...")
+
+    compare_images_arrays(images_txt, read_images_binary_arrays(
+        os.path.join(tmpdir, "images.bin")))
+    compare_points_arrays(points3D_txt, read_points3d_binary_arrays(
+        os.path.join(tmpdir, "points3D.bin")))
+
+    print("... binary model arrays and text model are equal.")
+    print("Converting to a columnar reconstruction and back ...")
+
+    reconstruction = Reconstruction.read(tmpdir, ext=".bin")
+    compare_images_arrays(images_txt, reconstruction.images)
+    compare_points_arrays(points3D_txt, reconstruction.points3D)
+    reconstruction = Reconstruction.from_model(
+        cameras_txt, images_txt, points3D_txt)
+    cameras, images, points3D = reconstruction.to_model()
+    compare_cameras(cameras_txt, cameras)
+    compare_images(images_txt, images)
+    compare_points(points3D_txt, points3D)
+    for point3D_id in list(points3D_txt)[:100]:
+        compare_points({point3D_id: points3D_txt[point3D_id]},
+                       {point3D_id: reconstruction.point3D(point3D_id)})
+    for image_id in images_txt:
+        compare_images({image_id: images_txt[image_id]},
+                       {image_id: reconstruction.image(image_id)})
+
+    print("... columnar reconstruction and text model are equal.")
+    print("Reading the binary points lazily ...")
+
+    for _ in range(2):
+        # The second view uses the offset index saved by the first one.
+        points3D_view = Points3DBinaryView(
+            os.path.join(tmpdir, "points3D.bin"))
+        compare_points(points3D_txt, dict(points3D_view.items()))
+        assert sorted(points3D_view) == sorted(points3D_txt)
+        assert all(point3D_id in points3D_view for point3D_id in points3D_txt)
+        compare_points_arrays(points3D_txt, points3D_view.read_rows())
+    for point3D_id in list(points3D_txt)[:100]:
+        compare_points({point3D_id: points3D_txt[point3D_id]},
+                       {point3D_id: points3D_view[point3D_id]})
+    min_track_len = 3
+    filtered = dict((point3D.id, point3D) for point3D in
+                    points3D_view.iter_filtered(min_track_len))
+    compare_points(filtered, dict(
+        (point3D_id, point3D) for point3D_id, point3D in points3D_txt.items()
+        if len(point3D.image_ids) >= min_track_len))
+
+    print("... lazy binary points and text model are equal.")
+    print("Converting the image rotations in a batch ...")
+
+    qvecs = reconstruction.images.qvecs
+    qvecs = qvecs / np.linalg.norm(qvecs, axis=1, keepdims=True)
+    qvecs[qvecs[:, 0] < 0] *= -1
+    rotmats = qvecs2rotmats(qvecs)
+    for qvec, rotmat in zip(qvecs, rotmats):
+        assert np.allclose(qvec2rotmat(qvec), rotmat)
+    assert np.allclose(rotmats2qvecs(rotmats), qvecs)
+
+    print("... batch and single rotation conversions are equal.")
 
 
 if __name__ == "__main__":
@@ -27,11 +27,14 @@
 # ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 
+import os
 import argparse
 import numpy as np
 import open3d
 
-from read_write_model import read_model, write_model, qvec2rotmat, rotmat2qvec
+from read_write_model import read_model, write_model, qvec2rotmat, rotmat2qvec, \
+    qvecs2rotmats, read_cameras_binary, read_images_binary, detect_model_format, \
+    Points3DBinaryView
 
 
 class Model:
@@ -42,19 +45,33 @@ class Model:
         self.__vis = None
 
     def read_model(self, path, ext=""):
-        self.cameras, self.images, self.points3D = read_model(path, ext)
+        if ext == "" and detect_model_format(path, ".bin"):
+            ext = ".bin"
+        if ext == ".bin":
+            # The points are only decoded when they are drawn.
+            self.cameras = read_cameras_binary(os.path.join(path, "cameras.bin"))
+            self.images = read_images_binary(os.path.join(path, "images.bin"))
+            self.points3D = Points3DBinaryView(os.path.join(path, "points3D.bin"))
+        else:
+            self.cameras, self.images, self.points3D = read_model(path, ext)
 
     def add_points(self, min_track_len=3, remove_statistical_outlier=True):
         pcd = open3d.geometry.PointCloud()
 
-        xyz = []
-        rgb = []
-        for point3D in self.points3D.values():
-            track_len = len(point3D.point2D_idxs)
-            if track_len < min_track_len:
-                continue
-            xyz.append(point3D.xyz)
-            rgb.append(point3D.rgb / 255)
+        if isinstance(self.points3D, Points3DBinaryView):
+            points3D = self.points3D.read_rows(
+                self.points3D.track_lengths >= min_track_len)
+            xyz = points3D.xyz
+            rgb = points3D.rgb / 255
+        else:
+            xyz = []
+            rgb = []
+            for point3D in self.points3D.values():
+                track_len = len(point3D.point2D_idxs)
+                if track_len < min_track_len:
+                    continue
+                xyz.append(point3D.xyz)
+                rgb.append(point3D.rgb / 255)
 
         pcd.points = open3d.utility.Vector3dVector(xyz)
         pcd.colors = open3d.utility.Vector3dVector(rgb)
@@ -71,17 +88,17 @@ class Model:
 
     def add_cameras(self, scale=1):
         frames = []
-        for img in self.images.values():
-            # rotation
-            R = qvec2rotmat(img.qvec)
+        images = list(self.images.values())
 
-            # translation
-            t = img.tvec
+        # rotations of all the images at once
+        Rs = qvecs2rotmats([img.qvec for img in images])
 
-            # invert
-            t = -R.T @ t
-            R = R.T
+        # invert: camera to world rotations and projection centers
+        Rs = Rs.transpose(0, 2, 1)
+        ts = -np.einsum("nij,nj->ni", Rs,
+                        np.reshape([img.tvec for img in images], (-1, 3)))
 
+        for img, R, t in zip(images, Rs, ts):
             # intrinsics
             cam = self.cameras[img.camera_id]
 
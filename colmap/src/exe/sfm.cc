@@ -339,6 +339,7 @@ int RunPointFiltering(int argc, char** argv) {
 int RunPointTriangulator(int argc, char** argv) {
   std::string input_path;
   std::string output_path;
+  std::string output_type = "TXT";
   bool clear_points = false;
 
   OptionManager options;
@@ -346,12 +347,21 @@ int RunPointTriangulator(int argc, char** argv) {
   options.AddImageOptions();
   options.AddRequiredOption("input_path", &input_path);
   options.AddRequiredOption("output_path", &output_path);
+  options.AddDefaultOption("output_type", &output_type, "{BIN, TXT}");
   options.AddDefaultOption(
       "clear_points", &clear_points,
       "Whether to clear all existing points and observations");
   options.AddMapperOptions();
   options.Parse(argc, argv);
 
+  StringToLower(&output_type);
+  if (output_type != "bin" && output_type != "txt") {
+    std::cerr << "ERROR: Invalid `output_type` - supported values are "
+                 "{BIN, TXT}."
+              << std::endl;
+    return EXIT_FAILURE;
+  }
+
   if (!ExistsDir(input_path)) {
     std::cerr << "ERROR: `input_path` is not a directory" << std::endl;
     return EXIT_FAILURE;
@@ -489,7 +499,11 @@ int RunPointTriangulator(int argc, char** argv) {
   timer.PrintSeconds();
   
   PrintHeading1("Output format preparation");
-  reconstruction.Write(output_path);
+  if (output_type == "bin") {
+    reconstruction.WriteBinary(output_path);
+  } else {
+    reconstruction.WriteText(output_path);
+  }
 
   return EXIT_SUCCESS;
 }